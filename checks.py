@@ -0,0 +1,347 @@
+"""Проверки бота на временных базах: планы запросов, гонки заказа, план рассылки.
+
+Запуск: python checks.py plancheck | stress | fanoutcheck [параметры]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import aiosqlite
+from dotenv import load_dotenv
+
+# main.py завершается без токена и админов; проверкам Telegram не нужен
+load_dotenv()
+os.environ.setdefault("BOT_TOKEN", "123456:checks")
+os.environ.setdefault("ADMIN_IDS", "1")
+
+from main import (ADMIN_BATCH, ADMIN_IDS, FANOUT_ADMIN, FANOUT_PARTICIPANT, FANOUT_SQUAD, JOIN_OK,  # noqa: E402
+                  ORDER_MAX_PARTICIPANTS, ORDER_MIN_PARTICIPANTS, ORDERS_PAGE_SIZE, OUTBOX_PRIORITY_NORMAL,
+                  OUTBOX_PRIORITY_URGENT, PAGE_START, QUERY_REGISTRY, OrderFanout, apply_migrations, db_pool,
+                  explain_queries, get_confirmed_order_keyboard, order_join, order_start, write_queue)
+
+# --- Временная база вместо рабочей ---
+_saved_paths = []
+
+async def use_database(path: str):
+    """Переключает общий пул на временную базу (рабочий путь восстанавливается в release_database)"""
+    _saved_paths.append(db_pool.path)
+    db_pool.path = path
+    await db_pool.open()
+
+async def release_database():
+    await db_pool.close()
+    db_pool.path = _saved_paths.pop()
+
+# --- Проверка планов на синтетической базе ---
+# Горячие запросы: допустимые индексы и параметры замера по размеру базы (escorts, orders)
+PLAN_CHECKS = {
+    "get_escort": (("sqlite_autoindex_escorts_1",), lambda escorts, orders: (1000000 + escorts // 2,)),
+    "available_orders": (("idx_orders_status_created",), lambda escorts, orders: ()),
+    "my_orders": (("idx_order_escorts_escort_id",), lambda escorts, orders: (escorts // 2, escorts // 2) + PAGE_START + (ORDERS_PAGE_SIZE + 1,)),
+    "squad_orders_list": (("idx_orders_squad_created",), lambda escorts, orders: (1,) + PAGE_START + (ORDERS_PAGE_SIZE + 1,)),
+    "leaderboard": (("idx_escorts_avg_rating",), lambda escorts, orders: ()),
+    # рейтинг пользователей и сквадов отдается из leaderboard, в базу ходит только перечитывание строк
+    "user_rating_rows": (("sqlite_autoindex_escorts_1",), lambda escorts, orders: (1000000 + escorts // 2,)),
+    "squad_rating_rows": (("INTEGER PRIMARY KEY",), lambda escorts, orders: (escorts // 2,)),
+    "check_pending_orders": (("idx_orders_status_created",), lambda escorts, orders: ("2024-03-01T00:00:00",)),
+}
+# Во сколько раз запрос может замедлиться относительно сохраненного замера
+PLAN_CHECK_SLOWDOWN = 2.0
+
+SYNTHETIC_SEQ = "WITH RECURSIVE seq(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM seq WHERE x < ?) "
+SYNTHETIC_DATA = (
+    (SYNTHETIC_SEQ + "INSERT INTO squads (name) SELECT 'squad_' || x FROM seq", ("squads",)),
+    (SYNTHETIC_SEQ + '''
+        INSERT INTO escorts (telegram_id, username, pubg_id, squad_id, balance, completed_orders,
+                             rating_count, total_rating, rules_accepted)
+        SELECT 1000000 + x, 'user_' || x, 'pubg_' || x,
+               CASE WHEN x % 10 = 0 THEN NULL ELSE x % ? + 1 END,
+               x % 1000, x % 50, x % 7, (x % 7) * (x % 5 + 1), 1
+        FROM seq
+    ''', ("escorts", "squads")),
+    (SYNTHETIC_SEQ + '''
+        INSERT INTO orders (memo_order_id, customer_info, amount, status, squad_id, created_at, rating)
+        SELECT 'M' || x, 'client_' || x, 500 + x % 5000,
+               CASE WHEN x % 100 < 2 THEN 'pending' WHEN x % 100 < 5 THEN 'in_progress' ELSE 'completed' END,
+               CASE WHEN x % 100 < 2 THEN NULL ELSE x % ? + 1 END,
+               datetime('2024-01-01', '+' || (x / 10) || ' minutes'),
+               CASE WHEN x % 100 < 5 THEN 0 ELSE x % 6 END
+        FROM seq
+    ''', ("orders", "squads")),
+    ('''
+        INSERT INTO order_escorts (order_id, escort_id, pubg_id)
+        SELECT id, (id * 7919) % ? + 1, 'pubg' FROM orders WHERE status != 'pending'
+    ''', ("escorts",)),
+    ('''
+        INSERT INTO order_applications (order_id, escort_id, squad_id, pubg_id)
+        SELECT id, (id * 104729) % ? + 1, id % ? + 1, 'pubg' FROM orders WHERE status = 'pending'
+    ''', ("escorts", "squads")),
+    (SYNTHETIC_SEQ + '''
+        INSERT INTO action_log (action_type, user_id, order_id, description)
+        SELECT 'join_order', 1000000 + x % ?, x, 'synthetic' FROM seq
+    ''', ("orders", "escorts")),
+)
+
+async def build_synthetic_db(path: str, escorts: int, orders: int, squads: int):
+    """Создает базу по MIGRATIONS и заполняет ее синтетическими данными"""
+    sizes = {"escorts": escorts, "orders": orders, "squads": squads}
+    async with aiosqlite.connect(path) as conn:
+        await conn.execute("PRAGMA journal_mode = WAL")
+        await conn.execute("PRAGMA synchronous = OFF")
+        await apply_migrations(conn)
+        for sql, params in SYNTHETIC_DATA:
+            await conn.execute(sql, tuple(sizes[name] for name in params))
+        await conn.commit()
+
+async def run_plan_check(args):
+    """CLI: python checks.py plancheck - планы и время горячих запросов на большой синтетической базе"""
+    parser = argparse.ArgumentParser(prog="checks.py plancheck")
+    parser.add_argument("--escorts", type=int, default=100000)
+    parser.add_argument("--orders", type=int, default=1000000)
+    parser.add_argument("--squads", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5, help="запусков каждого запроса для медианы")
+    parser.add_argument("--db", help="готовая синтетическая база (не пересоздается)")
+    parser.add_argument("--save", help="сохранить замеры в JSON")
+    parser.add_argument("--baseline", help="сравнить с замерами из JSON")
+    options = parser.parse_args(args)
+
+    temp_dir = None
+    path = options.db
+    if not path or not os.path.exists(path):
+        if not path:
+            temp_dir = tempfile.TemporaryDirectory()
+            path = os.path.join(temp_dir.name, "plancheck.db")
+        started = time.perf_counter()
+        await build_synthetic_db(path, options.escorts, options.orders, options.squads)
+        print(f"Синтетическая база: {options.escorts} сопровождающих, {options.orders} заказов, "
+              f"построена за {time.perf_counter() - started:.1f} с")
+
+    baseline = {}
+    if options.baseline:
+        with open(options.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    failures = 0
+    timings = {}
+    try:
+        async with aiosqlite.connect(path) as conn:
+            report = {name: (plan, full_scans) for name, plan, full_scans in await explain_queries(conn)}
+            for name, (indexes, make_params) in PLAN_CHECKS.items():
+                plan, full_scans = report[name]
+                problems = [f"полное сканирование: {step}" for step in full_scans]
+                if not any(index in step for step in plan for index in indexes):
+                    problems.append(f"не используется ни один из индексов {', '.join(indexes)}")
+
+                sql = QUERY_REGISTRY[name][0]
+                params = make_params(options.escorts, options.orders)
+                samples = []
+                for _ in range(options.repeat):
+                    started = time.perf_counter()
+                    cursor = await conn.execute(sql, params)
+                    await cursor.fetchall()
+                    samples.append((time.perf_counter() - started) * 1000)
+                timings[name] = statistics.median(samples)
+
+                previous = baseline.get(name)
+                if previous and timings[name] > previous * PLAN_CHECK_SLOWDOWN and timings[name] - previous > 1:
+                    problems.append(f"медленнее базового замера: {previous:.2f} мс -> {timings[name]:.2f} мс")
+
+                print(f"{'FAIL' if problems else 'ok':4} {name:26} {timings[name]:9.2f} мс  {' | '.join(plan)}")
+                for problem in problems:
+                    print(f"     - {problem}")
+                failures += bool(problems)
+    finally:
+        if temp_dir is not None:
+            temp_dir.cleanup()
+
+    if options.save:
+        with open(options.save, "w", encoding="utf-8") as f:
+            json.dump(timings, f, ensure_ascii=False, indent=2)
+    print(f"Проверено запросов: {len(PLAN_CHECKS)}, с проблемами: {failures}")
+    return 1 if failures else 0
+
+# --- Нагрузочная проверка переходов заказа ---
+STRESS_INVARIANTS = '''
+    SELECT o.status, o.squad_id,
+           (SELECT COUNT(*) FROM order_applications WHERE order_id = o.id),
+           (SELECT COUNT(DISTINCT squad_id) FROM order_applications WHERE order_id = o.id),
+           (SELECT COUNT(*) FROM order_escorts WHERE order_id = o.id),
+           (SELECT COUNT(*) FROM order_escorts oe JOIN escorts e ON oe.escort_id = e.id
+            WHERE oe.order_id = o.id AND e.squad_id IS NOT o.squad_id)
+    FROM orders o WHERE o.id = ?
+'''
+
+async def run_order_stress(args):
+    """CLI: python checks.py stress - сотни одновременных заявок и стартов на один заказ"""
+    parser = argparse.ArgumentParser(prog="checks.py stress")
+    parser.add_argument("--joins", type=int, default=300, help="одновременных заявок на заказ")
+    parser.add_argument("--squads", type=int, default=5)
+    parser.add_argument("--starts", type=int, default=20, help="одновременных попыток начать заказ")
+    parser.add_argument("--rounds", type=int, default=5)
+    options = parser.parse_args(args)
+
+    temp_dir = tempfile.TemporaryDirectory()
+    path = os.path.join(temp_dir.name, "stress.db")
+    async with aiosqlite.connect(path) as conn:
+        await conn.execute("PRAGMA journal_mode = WAL")
+        await apply_migrations(conn)
+        await conn.executemany("INSERT INTO squads (name) VALUES (?)", [(f"squad_{i}",) for i in range(options.squads)])
+        await conn.executemany(
+            "INSERT INTO escorts (telegram_id, username, pubg_id, squad_id, rules_accepted) VALUES (?, ?, ?, ?, 1)",
+            [(1000000 + i, f"user_{i}", f"pubg_{i}", i % options.squads + 1) for i in range(options.joins)]
+        )
+        await conn.commit()
+
+    await use_database(path)
+    await write_queue.start()
+
+    async def start(order_db_id, squad_id):
+        # Старты разбросаны по времени, чтобы попадать между пачками заявок
+        await asyncio.sleep(random.random() * 0.05)
+        async with db_pool.acquire() as conn:
+            started = await order_start(conn, order_db_id, squad_id)
+            await conn.commit()
+            return started is not None
+
+    violations = 0
+    try:
+        for round_number in range(1, options.rounds + 1):
+            async with db_pool.acquire() as conn:
+                cursor = await conn.execute(
+                    "INSERT INTO orders (memo_order_id, customer_info, amount, status) VALUES (?, 'stress', 1000, 'pending')",
+                    (f"S{round_number}",)
+                )
+                order_db_id = cursor.lastrowid
+                await conn.commit()
+
+            calls = [order_join(order_db_id, i + 1, i % options.squads + 1, f"pubg_{i}") for i in range(options.joins)]
+            calls += [start(order_db_id, random.randint(1, options.squads)) for _ in range(options.starts)]
+            random.shuffle(calls)
+            started_at = time.perf_counter()
+            results = await asyncio.gather(*calls)
+            elapsed = time.perf_counter() - started_at
+
+            joins = {}
+            for result in results:
+                if isinstance(result, str):
+                    joins[result] = joins.get(result, 0) + 1
+            starts = sum(1 for result in results if result is True)
+            async with db_pool.read() as conn:
+                cursor = await conn.execute(STRESS_INVARIANTS, (order_db_id,))
+                status, squad_id, applications, application_squads, participants, foreign = await cursor.fetchone()
+
+            problems = []
+            if joins.get(JOIN_OK, 0) > ORDER_MAX_PARTICIPANTS * (starts + 1):
+                problems.append(f"принято заявок: {joins[JOIN_OK]}")
+            if starts > 1:
+                problems.append(f"заказ начат {starts} раз")
+            if status == 'in_progress':
+                if not ORDER_MIN_PARTICIPANTS <= participants <= ORDER_MAX_PARTICIPANTS:
+                    problems.append(f"участников: {participants}")
+                if foreign:
+                    problems.append(f"участников из чужого сквада: {foreign}")
+                if applications:
+                    problems.append(f"после старта остались заявки: {applications}")
+            elif applications > ORDER_MAX_PARTICIPANTS or application_squads > 1:
+                problems.append(f"заявок: {applications} от {application_squads} сквадов")
+
+            print(f"{'FAIL' if problems else 'ok':4} раунд {round_number}: {len(calls)} операций за {elapsed * 1000:.0f} мс "
+                  f"({len(calls) / elapsed:.0f} оп/с), статус {status}, сквад {squad_id}, участников {participants}, "
+                  f"заявок {applications}, стартов {starts}, заявки: {', '.join(f'{k} {v}' for k, v in sorted(joins.items()))}")
+            for problem in problems:
+                print(f"     - {problem}")
+            violations += bool(problems)
+    finally:
+        await write_queue.stop()
+        await release_database()
+        temp_dir.cleanup()
+    print(f"Раундов: {options.rounds}, с нарушениями: {violations}")
+    return 1 if violations else 0
+
+# --- Проверка плана рассылки ---
+async def run_fanout_check(args):
+    """CLI: python checks.py fanoutcheck - план рассылки события заказа на временной базе
+
+    Первый админ из ADMIN_IDS сначала не участвует в заказе (получает вариант
+    для админов), затем участвует (получает вариант участника с кнопками).
+    """
+    argparse.ArgumentParser(prog="checks.py fanoutcheck").parse_args(args)
+    admin_id = ADMIN_IDS[0]
+    participant_ids = [2000001, 2000002]
+    squad_member_id = 2000003
+    admin_keyboard = get_confirmed_order_keyboard("F1", is_admin=True)
+
+    temp_dir = tempfile.TemporaryDirectory()
+    path = os.path.join(temp_dir.name, "fanout.db")
+    async with aiosqlite.connect(path) as conn:
+        await apply_migrations(conn)
+        await conn.execute("INSERT INTO squads (name) VALUES ('fanout')")
+        await conn.executemany(
+            "INSERT INTO escorts (telegram_id, username, squad_id, rules_accepted) VALUES (?, ?, 1, 1)",
+            [(telegram_id, f"user_{telegram_id}") for telegram_id in participant_ids + [squad_member_id, admin_id]]
+        )
+        await conn.execute("INSERT INTO orders (memo_order_id, customer_info, amount, status) VALUES ('F1', 'check', 1000, 'in_progress')")
+        await conn.commit()
+
+    await use_database(path)
+    failures = 0
+    try:
+        for title, participants in (("админ вне заказа", participant_ids), ("админ - участник", participant_ids + [admin_id])):
+            async with db_pool.acquire() as conn:
+                await conn.execute("DELETE FROM outbox")
+                await conn.execute("DELETE FROM order_escorts")
+                await conn.executemany(
+                    "INSERT INTO order_escorts (order_id, escort_id, pubg_id) SELECT 1, id, 'pubg' FROM escorts WHERE telegram_id = ?",
+                    [(telegram_id,) for telegram_id in participants]
+                )
+                fanout = OrderFanout(1, 1)
+                fanout.add(FANOUT_PARTICIPANT, "participant", admin_reply_markup=admin_keyboard)
+                fanout.add(FANOUT_SQUAD, "squad")
+                fanout.add(FANOUT_ADMIN, "admin", reply_markup=admin_keyboard)
+                await fanout.enqueue(conn)
+                cursor = await conn.execute("SELECT chat_id, text, reply_markup IS NOT NULL, batch, priority FROM outbox")
+                rows = await cursor.fetchall()
+                await conn.commit()
+
+            expected = {telegram_id: ("participant", False, None, OUTBOX_PRIORITY_NORMAL) for telegram_id in participant_ids}
+            expected[squad_member_id] = ("squad", False, None, OUTBOX_PRIORITY_NORMAL)
+            for telegram_id in ADMIN_IDS:
+                expected.setdefault(telegram_id, ("admin", True, ADMIN_BATCH, OUTBOX_PRIORITY_URGENT))
+            if admin_id in participants:
+                expected[admin_id] = ("participant", True, None, OUTBOX_PRIORITY_NORMAL)
+
+            problems = []
+            received = {}
+            for chat_id, text, has_markup, batch, priority in rows:
+                if chat_id in received:
+                    problems.append(f"{chat_id} получает больше одного сообщения")
+                received[chat_id] = (text, bool(has_markup), batch, priority)
+            for chat_id, message in expected.items():
+                if received.get(chat_id) != message:
+                    problems.append(f"{chat_id}: ожидалось {message}, получено {received.get(chat_id)}")
+            print(f"{'FAIL' if problems else 'ok':4} {title}: сообщений {len(rows)}, получателей {len(received)}")
+            for problem in problems:
+                print(f"     - {problem}")
+            failures += bool(problems)
+    finally:
+        await release_database()
+        temp_dir.cleanup()
+    return 1 if failures else 0
+
+CHECKS = {
+    "plancheck": run_plan_check,
+    "stress": run_order_stress,
+    "fanoutcheck": run_fanout_check,
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in CHECKS:
+        print(f"Использование: python checks.py {{{' | '.join(CHECKS)}}} [параметры]")
+        sys.exit(2)
+    sys.exit(asyncio.run(CHECKS[sys.argv[1]](sys.argv[2:])))
@@ -1,8 +1,21 @@
+import argparse
 import asyncio
+import hmac
 import logging
 import csv
+import json
 import os
+import secrets
+import sqlite3
+import statistics
+import sys
+import time
 import traceback
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from functools import lru_cache
 
 # ====== ВАЖНО ДЛЯ ИИ ======
 # При обновлении кода всегда соблюдайте следующие правила для кнопок:
@@ -12,9 +25,10 @@ import traceback
 # 4. Исключение: только inline кнопки могут содержать эмодзи для красоты
 # ========================
 from datetime import datetime, timedelta
+from aiohttp import ClientSession, web
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from dotenv import load_dotenv
-from aiogram import Bot, Dispatcher, types, F
+from aiogram import BaseMiddleware, Bot, Dispatcher, types, F
 from aiogram.enums import ParseMode
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.filters import CommandStart, Command
@@ -23,7 +37,8 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.client.default import DefaultBotProperties
 import aiosqlite
-from aiogram.exceptions import TelegramAPIError
+from aiogram.exceptions import (TelegramAPIError, TelegramBadRequest, TelegramForbiddenError,
+                                TelegramNetworkError, TelegramRetryAfter, TelegramServerError)
 
 # Настройка логирования
 logging.basicConfig(
@@ -51,6 +66,7 @@ else:
     logger.info("получите свой Telegram ID от @userinfobot")
     exit(1)
 DB_PATH = "database.db"
+SCHEMA_PATH = "schema.sql"
 
 # Ссылки на документы
 OFFER_URL = "https://telegra.ph/Publichnaya-oferta-07-25-7"
@@ -179,175 +195,395 @@ class Form(StatesGroup):
     add_member_cd = State()
     add_member_age = State()
 
+# --- Пул соединений с базой данных ---
+DB_READERS = int(os.getenv("DB_READERS", "3"))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(64 * 1024 * 1024)))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+
+# Соединение, которое текущая задача уже держит (для вложенных вызовов хелперов)
+_held_connection = ContextVar("held_connection", default=None)
+
+class DatabasePool:
+    """Одно соединение-писатель и небольшой пул читателей поверх WAL"""
+
+    def __init__(self, path: str, readers: int = DB_READERS):
+        self.path = path
+        self.readers = readers
+        self._writer = None
+        self._writer_lock = None
+        self._reader_connections = []
+        self._idle_readers = None
+        # Вызываются после выхода из внешнего блока писателя (после коммита или отката)
+        self.release_hooks = []
+
+    async def _connect(self, read_only: bool = False):
+        conn = await aiosqlite.connect(self.path)
+        await conn.execute("PRAGMA journal_mode = WAL")
+        await conn.execute("PRAGMA synchronous = NORMAL")
+        await conn.execute(f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB}")
+        await conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+        await conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+        if read_only:
+            await conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    async def open(self):
+        self._writer = await self._connect()
+        self._writer_lock = asyncio.Lock()
+        self._idle_readers = asyncio.Queue()
+        for _ in range(self.readers):
+            conn = await self._connect(read_only=True)
+            self._reader_connections.append(conn)
+            self._idle_readers.put_nowait(conn)
+        logger.info(f"Пул соединений открыт: 1 писатель и {self.readers} читателей к {self.path}")
+
+    async def close(self):
+        for conn in self._reader_connections:
+            await conn.close()
+        self._reader_connections.clear()
+        if self._writer is not None:
+            await self._writer.close()
+            self._writer = None
+        logger.info("Пул соединений закрыт")
+
+    def _held(self):
+        held = _held_connection.get()
+        if held is not None and held[1] is asyncio.current_task():
+            return held
+        return None
+
+    def holds_writer(self) -> bool:
+        """Находится ли текущая задача внутри блока писателя"""
+        held = self._held()
+        return held is not None and held[2]
+
+    @asynccontextmanager
+    async def acquire(self):
+        """Выдает соединение-писатель; незавершенная транзакция откатывается при возврате"""
+        held = self._held()
+        if held is not None and held[2]:
+            # Вложенный вызов внутри уже открытого блока - используем то же соединение
+            yield held[0]
+            return
+
+        # Запись может изменить профиль - снимок апдейта больше не используем
+        forget_request_identity()
+        async with self._writer_lock:
+            token = _held_connection.set((self._writer, asyncio.current_task(), True))
+            try:
+                yield self._writer
+            finally:
+                _held_connection.reset(token)
+                if self._writer.in_transaction:
+                    await self._writer.rollback()
+        for hook in self.release_hooks:
+            hook()
+
+    @asynccontextmanager
+    async def read(self):
+        """Выдает соединение только для чтения, не дожидаясь писателя"""
+        held = self._held()
+        if held is not None:
+            # Внутри блока писателя читаем через него же, чтобы видеть свои изменения
+            yield held[0]
+            return
+
+        conn = await self._idle_readers.get()
+        token = _held_connection.set((conn, asyncio.current_task(), False))
+        try:
+            yield conn
+        finally:
+            _held_connection.reset(token)
+            self._idle_readers.put_nowait(conn)
+
+db_pool = DatabasePool(DB_PATH)
+
+# --- Очередь записи с групповым коммитом ---
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "100"))
+WRITE_BATCH_DELAY_MS = int(os.getenv("WRITE_BATCH_DELAY_MS", "5"))
+
+class WriteQueue:
+    """Собирает мелкие записи от всех корутин и коммитит их пачками через писателя"""
+
+    def __init__(self, pool: DatabasePool, batch_size: int = WRITE_BATCH_SIZE, delay_ms: int = WRITE_BATCH_DELAY_MS):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.delay = delay_ms / 1000
+        self.statements = 0
+        self.commits = 0
+        self._queue = None
+        self._task = None
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Очередь записи запущена: до {self.batch_size} операций за {self.delay * 1000:.0f} мс")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._queue.put_nowait(None)
+        await self._task
+        self._task = None
+        logger.info(f"Очередь записи остановлена: {self.statements} операций, {self.commits} коммитов")
+
+    async def submit(self, sql: str, params: tuple = (), wait: bool = True):
+        """Ставит запись в очередь; с wait=True дожидается коммита и возвращает rowcount
+
+        Внутри блока писателя запись выполняется в транзакции вызывающего и
+        коммитится вместе с ней (или откатывается, если блок не закоммитит).
+        """
+        held = self.pool._held()
+        if held is not None and held[2]:
+            cursor = await held[0].execute(sql, params)
+            self.statements += 1
+            return cursor.rowcount
+        if self._task is None:
+            # Очередь не запущена - пишем сразу
+            async with self.pool.acquire() as conn:
+                cursor = await conn.execute(sql, params)
+                await conn.commit()
+                self.statements += 1
+                self.commits += 1
+                return cursor.rowcount
+
+        future = asyncio.get_running_loop().create_future() if wait else None
+        self._queue.put_nowait((sql, params, future))
+        if future is not None:
+            return await future
+        return None
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            job = await self._queue.get()
+            if job is None:
+                break
+            if self._queue.qsize() < self.batch_size - 1:
+                # Даем соседним корутинам дописать свои операции в ту же пачку
+                await asyncio.sleep(self.delay)
+            batch = [job]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                job = self._queue.get_nowait()
+                if job is None:
+                    stopping = True
+                    break
+                batch.append(job)
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        results = []
+        try:
+            async with self.pool.acquire() as conn:
+                for sql, params, _ in batch:
+                    try:
+                        cursor = await conn.execute(sql, params)
+                        results.append((cursor.rowcount, None))
+                    except aiosqlite.Error as e:
+                        results.append((None, e))
+                await conn.commit()
+            self.statements += len(batch)
+            self.commits += 1
+        except aiosqlite.Error as e:
+            logger.error(f"Ошибка коммита пачки из {len(batch)} операций: {e}\n\n{traceback.format_exc()}")
+            results = [(None, e)] * len(batch)
+
+        for (sql, params, future), (rowcount, error) in zip(batch, results):
+            if future is None:
+                if error is not None:
+                    logger.error(f"Ошибка фоновой записи '{sql}' {params}: {error}")
+            elif not future.done():
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(rowcount)
+
+write_queue = WriteQueue(db_pool)
+
+# --- Советник по индексам ---
+QUERY_REGISTRY = {}
+
+def register_query(name: str, sql: str, sample_params: tuple = ()):
+    """Регистрирует горячий запрос для проверки плана и возвращает его текст"""
+    QUERY_REGISTRY[name] = (sql, sample_params)
+    return sql
+
+# Постраничные запросы: ключ страницы - (created_at, id) крайней показанной строки
+PAGE_NEXT = "n"  # к более старым
+PAGE_PREV = "p"  # к более новым
+PAGE_START = ("9999-12-31", 0)  # ключ перед первой страницей
+ORDERS_PAGE_SIZE = 10
+
+def register_keyset_query(name: str, sql: str, sample_params: tuple = ()):
+    """Регистрирует запрос страницы; в sql подставляются {cmp} и {order}.
+
+    Возвращает тексты для обоих направлений: {PAGE_NEXT: ..., PAGE_PREV: ...}
+    """
+    return {
+        PAGE_NEXT: register_query(name, sql.format(cmp="<", order="DESC"), sample_params),
+        PAGE_PREV: sql.format(cmp=">", order="ASC"),
+    }
+
+async def explain_queries(conn):
+    """Прогоняет EXPLAIN QUERY PLAN по всем зарегистрированным запросам"""
+    report = []
+    for name, (sql, params) in QUERY_REGISTRY.items():
+        try:
+            cursor = await conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            plan = [row[3] for row in await cursor.fetchall()]
+        except aiosqlite.Error as e:
+            plan = [f"ошибка: {e}"]
+        # SCAN без USING INDEX - полный проход по таблице
+        full_scans = [step for step in plan if step.startswith("ошибка") or (step.startswith("SCAN ") and " USING " not in step)]
+        report.append((name, plan, full_scans))
+    return report
+
+def format_index_report(report, verbose: bool = True) -> str:
+    flagged = [item for item in report if item[2]]
+    lines = [f"Советник по индексам: запросов {len(report)}, с полным сканированием {len(flagged)}"]
+    for name, plan, full_scans in report:
+        if not verbose and not full_scans:
+            continue
+        lines.append(f"\n{'[SCAN]' if full_scans else '[ok]'} {name}")
+        lines.extend(f"  {step}" for step in plan)
+    return "\n".join(lines)
+
 # --- Функции базы данных ---
+# --- Миграции схемы ---
+# Номер примененной миграции хранится в PRAGMA user_version.
+# Схему меняем только новым шагом в конце MIGRATIONS, старые шаги не правим.
+
+def _split_sql(script: str):
+    """Делит SQL-скрипт на отдельные выражения"""
+    statements, buffer = [], ""
+    for line in script.splitlines(keepends=True):
+        buffer += line
+        if sqlite3.complete_statement(buffer):
+            statements.append(buffer.strip())
+            buffer = ""
+    if buffer.strip():
+        statements.append(buffer.strip())
+    return statements
+
+async def _add_column_if_missing(conn, table: str, column: str, definition: str):
+    cursor = await conn.execute(f"PRAGMA table_info({table})")
+    if column not in {row[1] for row in await cursor.fetchall()}:
+        await conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+async def _migration_base_schema(conn):
+    """Базовая схема из schema.sql; догоняет базы, созданные старыми версиями бота"""
+    with open(SCHEMA_PATH, 'r', encoding='utf-8') as f:
+        for statement in _split_sql(f.read()):
+            await conn.execute(statement)
+    await _add_column_if_missing(conn, "escorts", "total_rating", "REAL DEFAULT 0")
+    await _add_column_if_missing(conn, "squads", "leader_id", "INTEGER REFERENCES escorts (id) ON DELETE SET NULL")
+
+async def _migration_hot_path_indexes(conn):
+    """Составные индексы под горячие запросы заказов, сквадов и рейтингов"""
+    for statement in (
+        # available_orders, check_pending_orders, admin_rate_orders
+        "CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders (status, created_at)",
+        # squad_orders_list, escort_status_handler
+        "CREATE INDEX IF NOT EXISTS idx_orders_squad_created ON orders (squad_id, created_at)",
+        # get_squad_escorts, find_squad, рейтинги сквадов
+        "CREATE INDEX IF NOT EXISTS idx_escorts_squad_id ON escorts (squad_id)",
+        # рейтинги пользователей: выражение совпадает с ORDER BY в запросах
+        "CREATE INDEX IF NOT EXISTS idx_escorts_avg_rating ON escorts ((total_rating / rating_count)) WHERE rating_count > 0",
+        # my_orders
+        "CREATE INDEX IF NOT EXISTS idx_order_escorts_escort_id ON order_escorts (escort_id)",
+        "CREATE INDEX IF NOT EXISTS idx_order_applications_escort_id ON order_applications (escort_id)",
+        # подсчет заявок по сквадам внутри заказа
+        "CREATE INDEX IF NOT EXISTS idx_order_applications_order_squad ON order_applications (order_id, squad_id)",
+        # Дубли UNIQUE/PRIMARY KEY и префикс нового индекса - только замедляют запись
+        "DROP INDEX IF EXISTS idx_order_applications_order_id",
+        "DROP INDEX IF EXISTS idx_order_escorts_order_id",
+        "DROP INDEX IF EXISTS idx_escorts_telegram_id",
+        "DROP INDEX IF EXISTS idx_orders_memo_order_id",
+    ):
+        await conn.execute(statement)
+
+async def _migration_outbox(conn):
+    """Таблица исходящих сообщений для фоновой доставки уведомлений"""
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            parse_mode TEXT,
+            fallback_text TEXT,
+            reply_markup TEXT,
+            batch TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP
+        )
+    ''')
+    # Воркеры выбирают только ожидающие сообщения, срок которых подошел
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (next_attempt_at) WHERE status = 'pending'")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_batch ON outbox (batch, status) WHERE batch IS NOT NULL")
+
+async def _migration_outbox_priority(conn):
+    """Приоритет в outbox: массовые объявления не задерживают остальные уведомления"""
+    await _add_column_if_missing(conn, "outbox", "priority", "INTEGER NOT NULL DEFAULT 0")
+    await conn.execute("DROP INDEX IF EXISTS idx_outbox_pending")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (priority, next_attempt_at) WHERE status = 'pending'")
+
+async def _migration_escort_reachable(conn):
+    """Флаг доступности пользователя для рассылок: сбрасывается, если бот заблокирован"""
+    await _add_column_if_missing(conn, "escorts", "reachable", "INTEGER NOT NULL DEFAULT 1")
+    await _add_column_if_missing(conn, "escorts", "last_delivery_error", "TIMESTAMP")
+
+async def _migration_outbox_lease(conn):
+    """Аренда строк outbox: выборщик забирает сообщение на писателе, повторно его не отправят"""
+    await _add_column_if_missing(conn, "outbox", "lease_until", "REAL NOT NULL DEFAULT 0")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_sending ON outbox (lease_until) WHERE status = 'sending'")
+
+MIGRATIONS = [
+    (1, "базовая схема", _migration_base_schema),
+    (2, "индексы горячих запросов", _migration_hot_path_indexes),
+    (3, "очередь исходящих сообщений", _migration_outbox),
+    (4, "приоритет исходящих сообщений", _migration_outbox_priority),
+    (5, "доступность получателей", _migration_escort_reachable),
+    (6, "аренда сообщений outbox", _migration_outbox_lease),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+async def apply_migrations(conn):
+    """Применяет недостающие шаги MIGRATIONS к открытому соединению"""
+    cursor = await conn.execute("PRAGMA user_version")
+    current_version = (await cursor.fetchone())[0]
+    if current_version >= SCHEMA_VERSION:
+        logger.info(f"Схема базы данных актуальна (версия {current_version})")
+        return
+
+    for version, description, migrate in MIGRATIONS:
+        if version <= current_version:
+            continue
+        # Каждый шаг применяется атомарно вместе с новым номером версии
+        await conn.execute("BEGIN IMMEDIATE")
+        try:
+            await migrate(conn)
+            await conn.execute(f"PRAGMA user_version = {version}")
+            await conn.commit()
+        except BaseException:
+            await conn.rollback()
+            raise
+        logger.info(f"Применена миграция {version}: {description}")
+    logger.info(f"База данных успешно инициализирована (версия схемы {SCHEMA_VERSION})")
+
 async def init_db():
     logger.info(f"Попытка подключения к базе данных: {DB_PATH}")
     try:
         # Создаем директории если их нет
-        import os
         db_dir = os.path.dirname(DB_PATH) if os.path.dirname(DB_PATH) else "."
         if not os.path.exists(db_dir):
             os.makedirs(db_dir, exist_ok=True)
 
         async with aiosqlite.connect(DB_PATH) as conn:
-            # Включаем поддержку foreign keys
-            await conn.execute("PRAGMA foreign_keys = ON")
-            
-            # Читаем и выполняем SQL-схему из файла
-            try:
-                with open('schema.sql', 'r', encoding='utf-8') as f:
-                    schema_sql = f.read()
-                    await conn.executescript(schema_sql)
-            except FileNotFoundError:
-                logger.warning("Файл schema.sql не найден, создаем таблицы вручную")
-                # Fallback - создание таблиц вручную
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS squads (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        name TEXT UNIQUE NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        rating REAL DEFAULT 0,
-                        rating_count INTEGER DEFAULT 0,
-                        leader_id INTEGER,
-                        FOREIGN KEY (leader_id) REFERENCES escorts (id) ON DELETE SET NULL
-                    )
-                ''')
-                
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS escorts (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        telegram_id INTEGER UNIQUE NOT NULL,
-                        username TEXT,
-                        pubg_id TEXT,
-                        squad_id INTEGER,
-                        balance REAL DEFAULT 0,
-                        reputation INTEGER DEFAULT 0,
-                        completed_orders INTEGER DEFAULT 0,
-                        rating REAL DEFAULT 0,
-                        rating_count INTEGER DEFAULT 0,
-                        total_rating REAL DEFAULT 0,
-                        is_banned INTEGER DEFAULT 0,
-                        ban_until TIMESTAMP,
-                        restrict_until TIMESTAMP,
-                        rules_accepted INTEGER DEFAULT 0,
-                        FOREIGN KEY (squad_id) REFERENCES squads (id) ON DELETE SET NULL
-                    )
-                ''')
-                
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS orders (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        memo_order_id TEXT UNIQUE NOT NULL,
-                        customer_info TEXT NOT NULL,
-                        amount REAL NOT NULL,
-                        commission_amount REAL DEFAULT 0.0,
-                        status TEXT DEFAULT 'pending',
-                        squad_id INTEGER,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        completed_at TIMESTAMP,
-                        rating INTEGER DEFAULT 0,
-                        FOREIGN KEY (squad_id) REFERENCES squads (id) ON DELETE SET NULL
-                    )
-                ''')
-                
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS order_escorts (
-                        order_id INTEGER,
-                        escort_id INTEGER,
-                        pubg_id TEXT,
-                        PRIMARY KEY (order_id, escort_id),
-                        FOREIGN KEY (order_id) REFERENCES orders (id) ON DELETE CASCADE,
-                        FOREIGN KEY (escort_id) REFERENCES escorts (id) ON DELETE CASCADE
-                    )
-                ''')
-                
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS order_applications (
-                        order_id INTEGER,
-                        escort_id INTEGER,
-                        squad_id INTEGER,
-                        pubg_id TEXT,
-                        PRIMARY KEY (order_id, escort_id),
-                        FOREIGN KEY (order_id) REFERENCES orders (id) ON DELETE CASCADE,
-                        FOREIGN KEY (escort_id) REFERENCES escorts (id) ON DELETE CASCADE,
-                        FOREIGN KEY (squad_id) REFERENCES squads (id) ON DELETE SET NULL
-                    )
-                ''')
-                
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS payouts (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        order_id INTEGER,
-                        escort_id INTEGER,
-                        amount REAL,
-                        payout_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (order_id) REFERENCES orders (id) ON DELETE SET NULL,
-                        FOREIGN KEY (escort_id) REFERENCES escorts (id) ON DELETE SET NULL
-                    )
-                ''')
-                
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS action_log (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        action_type TEXT,
-                        user_id INTEGER,
-                        order_id INTEGER,
-                        description TEXT,
-                        action_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-                
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS squad_leaders (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        leader_id INTEGER NOT NULL,
-                        squad_id INTEGER NOT NULL,
-                        appointed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (leader_id) REFERENCES escorts (id) ON DELETE CASCADE,
-                        FOREIGN KEY (squad_id) REFERENCES squads (id) ON DELETE CASCADE,
-                        UNIQUE(leader_id, squad_id)
-                    )
-                ''')
-                
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS squad_applications (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER NOT NULL,
-                        squad_id INTEGER NOT NULL,
-                        city TEXT,
-                        pubg_id TEXT,
-                        cd TEXT,
-                        age TEXT,
-                        status TEXT DEFAULT 'pending',
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (user_id) REFERENCES escorts (id) ON DELETE CASCADE,
-                        FOREIGN KEY (squad_id) REFERENCES squads (id) ON DELETE CASCADE
-                    )
-                ''')
-                
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS squad_criteria (
-                        squad_id INTEGER PRIMARY KEY,
-                        criteria_text TEXT,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (squad_id) REFERENCES squads (id) ON DELETE CASCADE
-                    )
-                ''')
-                
-                # Создаем индексы
-                await conn.execute("CREATE INDEX IF NOT EXISTS idx_escorts_telegram_id ON escorts (telegram_id)")
-                await conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_memo_order_id ON orders (memo_order_id)")
-                await conn.execute("CREATE INDEX IF NOT EXISTS idx_order_escorts_order_id ON order_escorts (order_id)")
-                await conn.execute("CREATE INDEX IF NOT EXISTS idx_order_applications_order_id ON order_applications (order_id)")
-                await conn.execute("CREATE INDEX IF NOT EXISTS idx_payouts_order_id ON payouts (order_id)")
-                await conn.execute("CREATE INDEX IF NOT EXISTS idx_action_log_action_date ON action_log (action_date)")
-                await conn.execute("CREATE INDEX IF NOT EXISTS idx_squad_leaders_leader_id ON squad_leaders (leader_id)")
-                await conn.execute("CREATE INDEX IF NOT EXISTS idx_squad_leaders_squad_id ON squad_leaders (squad_id)")
-                await conn.execute("CREATE INDEX IF NOT EXISTS idx_squad_applications_user_id ON squad_applications (user_id)")
-                await conn.execute("CREATE INDEX IF NOT EXISTS idx_squad_applications_squad_id ON squad_applications (squad_id)")
-            
-            await conn.commit()
-        logger.info("База данных успешно инициализирована")
+            await apply_migrations(conn)
     except aiosqlite.Error as e:
         logger.error(f"Ошибка инициализации базы данных: {e}\n\n{traceback.format_exc()}")
         raise
@@ -357,38 +593,363 @@ async def init_db():
 
 async def log_action(action_type: str, user_id: int, order_id: int = None, description: str = None):
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
-            await conn.execute(
-                "INSERT INTO action_log (action_type, user_id, order_id, description) VALUES (?, ?, ?, ?)",
-                (action_type, user_id, order_id, description)
-            )
-            await conn.commit()
+        await write_queue.submit(
+            "INSERT INTO action_log (action_type, user_id, order_id, description) VALUES (?, ?, ?, ?)",
+            (action_type, user_id, order_id, description),
+            wait=False
+        )
         logger.info(f"Лог действия: {action_type}, user_id: {user_id}, order_id: {order_id}, description: {description}")
     except aiosqlite.Error as e:
         logger.error(f"Ошибка при записи лога действия: {e}\n\n{traceback.format_exc()}")
 
+# --- Запись сопровождающего ---
+ESCORT_FIELDS = (
+    "id", "telegram_id", "squad_id", "pubg_id", "balance", "reputation", "completed_orders", "username",
+    "rating", "rating_count", "is_banned", "ban_until", "restrict_until", "rules_accepted"
+)
+ESCORT_COLUMNS = ", ".join(ESCORT_FIELDS)
+
+class Escort:
+    """Строка таблицы escorts; в проекциях заполнены только запрошенные поля"""
+    __slots__ = ESCORT_FIELDS
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__ if hasattr(self, name))
+        return f"Escort({fields})"
+
+def escort_row_factory(cursor, row):
+    """row_factory для курсора: собирает Escort по именам колонок запроса"""
+    escort = Escort()
+    for (name, *_), value in zip(cursor.description, row):
+        setattr(escort, name, value)
+    return escort
+
+# --- Горячие запросы ---
+# Регистрируются для советника по индексам (/explain и python main.py explain)
+
+SQL_GET_ESCORT = register_query("get_escort", f"SELECT {ESCORT_COLUMNS} FROM escorts WHERE telegram_id = ?", (0,))
+SQL_SQUAD_ESCORTS = register_query("get_squad_escorts", "SELECT telegram_id, username, pubg_id, rating FROM escorts WHERE squad_id = ?", (0,))
+SQL_STALE_IN_PROGRESS_ORDERS = register_query("check_pending_orders", '''
+    SELECT id, memo_order_id, squad_id
+    FROM orders
+    WHERE status = 'in_progress' AND created_at < ?
+''', ('',))
+SQL_LEADERBOARD = register_query("leaderboard", '''
+    SELECT e.id, e.telegram_id, e.username, e.squad_id, s.name,
+           e.total_rating, e.rating_count, e.completed_orders
+    FROM escorts e
+    LEFT JOIN squads s ON e.squad_id = s.id
+    WHERE e.rating_count > 0
+    ORDER BY (e.total_rating / e.rating_count) DESC
+''', ())
+# Перечитывание помеченных строк рейтинга; column - e.telegram_id или e.id
+SQL_LEADERBOARD_ROWS = '''
+    SELECT e.id, e.telegram_id, e.username, e.squad_id, s.name,
+           e.total_rating, e.rating_count, e.completed_orders
+    FROM escorts e
+    LEFT JOIN squads s ON e.squad_id = s.id
+    WHERE {column} IN ({marks})
+'''
+# Варианты перечитывания для проверки планов: оценки помечают строки по telegram_id,
+# смена состава сквада - по escorts.id
+SQL_USER_RATING_ROWS = register_query(
+    "user_rating_rows", SQL_LEADERBOARD_ROWS.format(column="e.telegram_id", marks="?"), (0,)
+)
+SQL_SQUAD_RATING_ROWS = register_query(
+    "squad_rating_rows", SQL_LEADERBOARD_ROWS.format(column="e.id", marks="?"), (0,)
+)
+SQL_PENDING_BOARD = register_query("available_orders", '''
+    SELECT o.id, o.memo_order_id, o.customer_info, o.amount, o.created_at,
+           oa.squad_id, COUNT(oa.order_id)
+    FROM orders o
+    LEFT JOIN order_applications oa ON oa.order_id = o.id
+    WHERE o.status = 'pending'
+    GROUP BY o.id, oa.squad_id
+    ORDER BY o.created_at DESC, o.id DESC
+''', ())
+SQL_MY_ORDERS = register_keyset_query("my_orders", '''
+    SELECT o.created_at, o.id, o.memo_order_id, o.customer_info, o.amount, o.status
+    FROM orders o
+    WHERE o.id IN (
+        SELECT order_id FROM order_escorts WHERE escort_id = ?
+        UNION
+        SELECT order_id FROM order_applications WHERE escort_id = ?
+    )
+      AND (o.created_at, o.id) {cmp} (?, ?)
+    ORDER BY o.created_at {order}, o.id {order}
+    LIMIT ?
+''', (0, 0) + PAGE_START + (ORDERS_PAGE_SIZE + 1,))
+SQL_UNRATED_ORDERS = register_query("admin_rate_orders", "SELECT memo_order_id, customer_info, amount FROM orders WHERE status = 'completed' AND rating = 0", ())
+SQL_LEADER_SQUAD = register_query("leader_squad", '''
+    SELECT sl.squad_id, s.name
+    FROM squad_leaders sl
+    JOIN squads s ON sl.squad_id = s.id
+    JOIN escorts e ON sl.leader_id = e.id
+    WHERE e.telegram_id = ?
+''', (0,))
+SQL_SQUAD_ORDERS = register_keyset_query("squad_orders_list", '''
+    SELECT o.created_at, o.id, o.memo_order_id, o.customer_info, o.amount, o.status, o.completed_at
+    FROM orders o
+    WHERE o.squad_id = ?
+      AND (o.created_at, o.id) {cmp} (?, ?)
+    ORDER BY o.created_at {order}, o.id {order}
+    LIMIT ?
+''', (0,) + PAGE_START + (ORDERS_PAGE_SIZE + 1,))
+SQL_SQUAD_ACTIVE_ORDERS = register_query("squad_active_orders", '''
+    SELECT o.id, o.memo_order_id, o.customer_info, o.amount, o.created_at
+    FROM orders o
+    WHERE o.squad_id = ? AND o.status = 'in_progress'
+    ORDER BY o.created_at ASC
+''', (0,))
+SQL_OPEN_SQUADS = register_query("find_squad", '''
+    SELECT s.id, s.name, COUNT(e.id) as member_count
+    FROM squads s
+    LEFT JOIN escorts e ON s.id = e.squad_id
+    GROUP BY s.id, s.name
+    HAVING COUNT(e.id) < 10
+    ORDER BY s.name
+''', ())
+
+# --- Кэш профилей ---
+ESCORT_CACHE_SIZE = int(os.getenv("ESCORT_CACHE_SIZE", "10000"))
+ESCORT_CACHE_TTL = int(os.getenv("ESCORT_CACHE_TTL", "300"))
+
+class EscortCache:
+    """LRU-кэш профилей по telegram_id с TTL; сбрасывается явно после каждой записи в escorts"""
+
+    def __init__(self, size: int = ESCORT_CACHE_SIZE, ttl: int = ESCORT_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Растет при каждом сбросе: загрузка, начатая до сброса, в кэш не попадет
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._ids = {}
+        # Подписчики на сброс (таблица рейтинга): listener(telegram_ids=, escort_ids=, full=)
+        self.listeners = []
+
+    def get(self, telegram_id: int):
+        """Возвращает Escort или None"""
+        entry = self._entries.get(telegram_id)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self._drop(telegram_id)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(telegram_id)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, telegram_id: int, escort, generation: int):
+        if generation != self.generation:
+            return
+        self._entries[telegram_id] = (time.monotonic() + self.ttl, escort)
+        self._entries.move_to_end(telegram_id)
+        self._ids[escort.id] = telegram_id
+        while len(self._entries) > self.size:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _drop(self, telegram_id: int):
+        entry = self._entries.pop(telegram_id, None)
+        if entry is not None:
+            self._ids.pop(entry[1].id, None)
+
+    def invalidate(self, *telegram_ids: int):
+        self.generation += 1
+        for telegram_id in telegram_ids:
+            self._drop(telegram_id)
+        for listener in self.listeners:
+            listener(telegram_ids=telegram_ids)
+
+    def invalidate_ids(self, escort_ids):
+        """Сброс по escorts.id - для запросов, которые обновляют строки по id"""
+        self.generation += 1
+        for escort_id in escort_ids:
+            telegram_id = self._ids.get(escort_id)
+            if telegram_id is not None:
+                self._drop(telegram_id)
+        for listener in self.listeners:
+            listener(escort_ids=escort_ids)
+
+    def clear(self):
+        """Полный сброс - для массовых обновлений (расформирование сквада и т.п.)"""
+        self.generation += 1
+        self._entries.clear()
+        self._ids.clear()
+        for listener in self.listeners:
+            listener(full=True)
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        hit_rate = self.hits / total * 100 if total else 0.0
+        return (f"профили: {len(self._entries)}/{self.size}, попаданий {self.hits}, промахов {self.misses} "
+                f"({hit_rate:.1f}% попаданий), вытеснено {self.evictions}")
+
+escort_cache = EscortCache()
+
+# --- Полосы обработки апдейтов ---
+# Апдейты раскладываются по полосам по хэшу пользователя: внутри полосы строго по
+# очереди (двойное нажатие "присоединиться" или шаги анкеты не обгоняют друг друга),
+# разные полосы работают параллельно.
+UPDATE_LANES = int(os.getenv("UPDATE_LANES", "16"))
+
+class UpdateLane:
+    __slots__ = ("lock", "depth", "max_depth", "processed")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()  # ожидающие получают блокировку в порядке прихода
+        self.depth = 0
+        self.max_depth = 0
+        self.processed = 0
+
+class UpdateLanes:
+    def __init__(self, count: int = UPDATE_LANES):
+        self.lanes = [UpdateLane() for _ in range(count)]
+
+    def lane(self, key: int) -> UpdateLane:
+        return self.lanes[hash(key) % len(self.lanes)]
+
+    def depths(self):
+        return [lane.depth for lane in self.lanes]
+
+    def stats(self) -> str:
+        depths = self.depths()
+        busy = sum(1 for depth in depths if depth)
+        return (f"полосы: {len(self.lanes)}, занято {busy}, в очереди {sum(depths) - busy}, "
+                f"глубина сейчас {max(depths)}, максимум {max(lane.max_depth for lane in self.lanes)}, "
+                f"обработано {sum(lane.processed for lane in self.lanes)}")
+
+class LaneMiddleware(BaseMiddleware):
+    """Пропускает апдейт только когда его полоса свободна"""
+
+    def __init__(self, lanes: UpdateLanes):
+        self.lanes = lanes
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        chat = data.get("event_chat")
+        key = user.id if user is not None else chat.id if chat is not None else None
+        if key is None:
+            return await handler(event, data)
+        lane = self.lanes.lane(key)
+        lane.depth += 1
+        lane.max_depth = max(lane.max_depth, lane.depth)
+        try:
+            async with lane.lock:
+                return await handler(event, data)
+        finally:
+            lane.depth -= 1
+            lane.processed += 1
+
+update_lanes = UpdateLanes()
+
+# --- Контекст запроса ---
+# Профиль загружается одним запросом на апдейт (или берется из кэша), роли - из role_index
+
+_request_identity = ContextVar("request_identity", default=None)
+
+class RequestIdentity:
+    """Снимок пользователя на время обработки одного апдейта"""
+    __slots__ = ("telegram_id", "escort", "leader_squad_id", "is_admin")
+
+    def __init__(self, telegram_id: int, escort, leader_squad_id, is_admin: bool):
+        self.telegram_id = telegram_id
+        self.escort = escort
+        self.leader_squad_id = leader_squad_id
+        self.is_admin = is_admin
+
+async def load_escort_profile(telegram_id: int):
+    """Профиль из кэша или одним запросом к базе"""
+    escort = escort_cache.get(telegram_id)
+    if escort is not None:
+        return escort
+    generation = escort_cache.generation
+    async with db_pool.read() as conn:
+        cursor = await conn.execute(SQL_GET_ESCORT, (telegram_id,))
+        cursor.row_factory = escort_row_factory
+        escort = await cursor.fetchone()
+    if escort is not None:
+        escort_cache.put(telegram_id, escort, generation)
+    return escort
+
+async def load_request_identity(telegram_id: int) -> RequestIdentity:
+    escort = await load_escort_profile(telegram_id)
+    return RequestIdentity(telegram_id, escort, role_index.leader_squad(telegram_id), is_admin(telegram_id))
+
+def current_identity(telegram_id: int):
+    """Снимок текущего апдейта, если он относится к этому пользователю и еще актуален"""
+    identity = _request_identity.get()
+    if identity is not None and identity.telegram_id == telegram_id:
+        return identity
+    return None
+
+def forget_request_identity():
+    """Сбрасывает снимок после записи, дальше профиль читается из базы"""
+    if _request_identity.get() is not None:
+        _request_identity.set(None)
+
+class IdentityMiddleware(BaseMiddleware):
+    """Загружает пользователя апдейта и кладет снимок в data['identity']"""
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        try:
+            identity = await load_request_identity(user.id)
+        except aiosqlite.Error as e:
+            logger.error(f"Ошибка загрузки контекста пользователя {user.id}: {e}\n\n{traceback.format_exc()}")
+            return await handler(event, data)
+        data["identity"] = identity
+        token = _request_identity.set(identity)
+        try:
+            return await handler(event, data)
+        finally:
+            _request_identity.reset(token)
+
+# Полосы - до загрузки профиля, чтобы он читался уже после предыдущего апдейта пользователя
+dp.update.outer_middleware(LaneMiddleware(update_lanes))
+dp.update.outer_middleware(IdentityMiddleware())
+
 async def get_escort(telegram_id: int):
+    identity = current_identity(telegram_id)
+    if identity is not None:
+        return identity.escort
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
-            cursor = await conn.execute(
-                "SELECT id, squad_id, pubg_id, balance, reputation, completed_orders, username, "
-                "rating, rating_count, is_banned, ban_until, restrict_until, rules_accepted "
-                "FROM escorts WHERE telegram_id = ?", (telegram_id,)
-            )
-            return await cursor.fetchone()
+        return await load_escort_profile(telegram_id)
     except aiosqlite.Error as e:
         logger.error(f"Ошибка в get_escort для {telegram_id}: {e}\n\n{traceback.format_exc()}")
         return None
 
+async def get_escort_fields(telegram_id: int, *fields: str):
+    """Читает только нужные поля сопровождающего, без полной строки"""
+    unknown = set(fields) - set(ESCORT_FIELDS)
+    if unknown:
+        raise ValueError(f"Неизвестные поля escorts: {', '.join(sorted(unknown))}")
+    identity = current_identity(telegram_id)
+    if identity is not None:
+        return identity.escort
+    cached = escort_cache.get(telegram_id)
+    if cached is not None:
+        return cached
+    try:
+        async with db_pool.read() as conn:
+            cursor = await conn.execute(f"SELECT {', '.join(fields)} FROM escorts WHERE telegram_id = ?", (telegram_id,))
+            cursor.row_factory = escort_row_factory
+            return await cursor.fetchone()
+    except aiosqlite.Error as e:
+        logger.error(f"Ошибка в get_escort_fields для {telegram_id}: {e}\n\n{traceback.format_exc()}")
+        return None
+
 async def find_or_create_user(telegram_id: int, username: str = None):
     """Находит пользователя или создает его если не существует"""
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
-            cursor = await conn.execute(
-                "SELECT id, squad_id, pubg_id, balance, reputation, completed_orders, username, "
-                "rating, rating_count, is_banned, ban_until, restrict_until, rules_accepted "
-                "FROM escorts WHERE telegram_id = ?", (telegram_id,)
-            )
+        async with db_pool.acquire() as conn:
+            cursor = await conn.execute(SQL_GET_ESCORT, (telegram_id,))
+            cursor.row_factory = escort_row_factory
             user = await cursor.fetchone()
             
             if not user:
@@ -400,11 +961,8 @@ async def find_or_create_user(telegram_id: int, username: str = None):
                 await conn.commit()
                 
                 # Получаем созданного пользователя
-                cursor = await conn.execute(
-                    "SELECT id, squad_id, pubg_id, balance, reputation, completed_orders, username, "
-                    "rating, rating_count, is_banned, ban_until, restrict_until, rules_accepted "
-                    "FROM escorts WHERE telegram_id = ?", (telegram_id,)
-                )
+                cursor = await conn.execute(SQL_GET_ESCORT, (telegram_id,))
+                cursor.row_factory = escort_row_factory
                 user = await cursor.fetchone()
                 logger.info(f"Создан новый пользователь {telegram_id} (@{username})")
             
@@ -414,13 +972,12 @@ async def find_or_create_user(telegram_id: int, username: str = None):
         return None
 
 async def add_escort(telegram_id: int, username: str):
+    forget_request_identity()
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
-            await conn.execute(
-                "INSERT OR IGNORE INTO escorts (telegram_id, username, rules_accepted) VALUES (?, ?, 0)",
-                (telegram_id, username)
-            )
-            await conn.commit()
+        await write_queue.submit(
+            "INSERT OR IGNORE INTO escorts (telegram_id, username, rules_accepted) VALUES (?, ?, 0)",
+            (telegram_id, username)
+        )
         logger.info(f"Добавлен пользователь {telegram_id} (@{username})")
         return True
     except aiosqlite.Error as e:
@@ -429,10 +986,8 @@ async def add_escort(telegram_id: int, username: str):
 
 async def get_squad_escorts(squad_id: int):
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
-            cursor = await conn.execute(
-                "SELECT telegram_id, username, pubg_id, rating FROM escorts WHERE squad_id = ?", (squad_id,)
-            )
+        async with db_pool.read() as conn:
+            cursor = await conn.execute(SQL_SQUAD_ESCORTS, (squad_id,))
             return await cursor.fetchall()
     except aiosqlite.Error as e:
         logger.error(f"Ошибка в get_squad_escorts для squad_id {squad_id}: {e}\n\n{traceback.format_exc()}")
@@ -440,7 +995,7 @@ async def get_squad_escorts(squad_id: int):
 
 async def get_squad_info(squad_id: int):
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute(
                 '''
                 SELECT s.name, COUNT(e.id) as member_count,
@@ -458,54 +1013,485 @@ async def get_squad_info(squad_id: int):
         logger.error(f"Ошибка в get_squad_info для squad_id {squad_id}: {e}\n\n{traceback.format_exc()}")
         return None
 
-async def notify_squad(squad_id: int, message: str):
-    if squad_id is None:
-        async with aiosqlite.connect(DB_PATH) as conn:
-            cursor = await conn.execute("SELECT telegram_id FROM escorts")
-            escorts = await cursor.fetchall()
-    else:
-        escorts = await get_squad_escorts(squad_id)
-    for telegram_id, *_ in escorts:
-        try:
-            await bot.send_message(telegram_id, message)
-        except TelegramAPIError as e:
-            logger.warning(f"Не удалось уведомить {telegram_id}: {e}")
+# --- Рассылки ---
+# Массовые отправки идут через общий лимит: не больше BROADCAST_RATE сообщений в
+# секунду на весь бот и не чаще раза в BROADCAST_CHAT_INTERVAL в один чат.
+
+BROADCAST_RATE = 30
+BROADCAST_CHAT_INTERVAL = 1.0
+BROADCAST_CONCURRENCY = 20
+BROADCAST_MAX_ATTEMPTS = 4
+BROADCAST_BACKOFF = 1.0  # секунд, удваивается с каждой попыткой
+BROADCAST_PROGRESS_INTERVAL = 5.0
+
+DELIVERED = "delivered"
+FAILED = "failed"
+BLOCKED = "blocked"
+
+class TokenBucket:
+    """Общий лимит отправок в секунду; pause() останавливает все отправки после flood control"""
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        # Без запаса: отправки идут равномерно, а не пачкой в начале секунды
+        self.capacity = capacity
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+class ChatPacer:
+    """Интервал между сообщениями в один чат"""
+
+    def __init__(self, interval: float, max_chats: int = 10000):
+        self.interval = interval
+        self.max_chats = max_chats
+        self._next = {}
+
+    async def wait(self, chat_id: int):
+        now = time.monotonic()
+        ready = self._next.get(chat_id, 0.0)
+        # Слот занимается до ожидания, чтобы параллельные отправки в чат шли по очереди
+        self._next[chat_id] = max(now, ready) + self.interval
+        if len(self._next) > self.max_chats:
+            self._next = {cid: t for cid, t in self._next.items() if t > now}
+        if ready > now:
+            await asyncio.sleep(ready - now)
+
+send_limiter = TokenBucket(BROADCAST_RATE)
+chat_pacer = ChatPacer(BROADCAST_CHAT_INTERVAL)
+
+# Ошибки Bad Request, после которых писать в чат бесполезно (как и после Forbidden)
+UNREACHABLE_ERRORS = ("chat not found", "user is deactivated", "bot was blocked", "user not found")
+
+def is_unreachable_error(e: TelegramAPIError) -> bool:
+    if isinstance(e, TelegramForbiddenError):
+        return True
+    message = str(e).lower()
+    return any(error in message for error in UNREACHABLE_ERRORS)
 
-async def notify_all_users_about_new_order(order_id: str, customer_info: str, amount: float):
-    """Отправляет уведомление всем пользователям о новом заказе"""
+async def mark_unreachable(chat_id: int):
+    """Исключает пользователя из рассылок до следующего /start"""
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
-            cursor = await conn.execute("SELECT telegram_id FROM escorts WHERE rules_accepted = 1")
-            users = await cursor.fetchall()
-        
-        notification_text = (
-            f" НОВЫЙ ЗАКАЗ!\n\n"
-            f" Заказ #{order_id}\n"
-            f" Клиент: {customer_info}\n"
-            f" Сумма: {amount:.0f} руб.\n\n"
-            f"Перейдите в раздел 'Заказы' → 'Доступные заказы' чтобы присоединиться!"
+        await write_queue.submit(
+            "UPDATE escorts SET reachable = 0, last_delivery_error = CURRENT_TIMESTAMP WHERE telegram_id = ?",
+            (chat_id,),
+            wait=False
         )
-        
-        successful_notifications = 0
-        failed_notifications = 0
-        
-        for (telegram_id,) in users:
+    except aiosqlite.Error as e:
+        logger.error(f"Ошибка в mark_unreachable для {chat_id}: {e}\n\n{traceback.format_exc()}")
+
+async def mark_reachable(chat_id: int):
+    try:
+        await write_queue.submit(
+            "UPDATE escorts SET reachable = 1 WHERE telegram_id = ? AND reachable = 0",
+            (chat_id,),
+            wait=False
+        )
+    except aiosqlite.Error as e:
+        logger.error(f"Ошибка в mark_reachable для {chat_id}: {e}\n\n{traceback.format_exc()}")
+
+async def send_paced(chat_id: int, text: str, **kwargs) -> str:
+    """Отправляет сообщение с учетом лимитов; возвращает DELIVERED, FAILED или BLOCKED"""
+    for attempt in range(BROADCAST_MAX_ATTEMPTS):
+        await chat_pacer.wait(chat_id)
+        await send_limiter.acquire()
+        try:
+            await bot.send_message(chat_id, text, **kwargs)
+            return DELIVERED
+        except TelegramRetryAfter as e:
+            # Flood control действует на весь бот - останавливаем все рассылки
+            logger.warning(f"Flood control при отправке {chat_id}: пауза {e.retry_after} с")
+            send_limiter.pause(e.retry_after)
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            if is_unreachable_error(e):
+                logger.info(f"Пользователь {chat_id} недоступен, исключаем из рассылок: {e}")
+                await mark_unreachable(chat_id)
+                return BLOCKED
+            logger.warning(f"Не удалось отправить сообщение {chat_id}: {e}")
+            return FAILED
+        except (TelegramNetworkError, TelegramServerError) as e:
+            logger.warning(f"Ошибка сети при отправке {chat_id} (попытка {attempt + 1}): {e}")
+            await asyncio.sleep(BROADCAST_BACKOFF * 2 ** attempt)
+        except TelegramAPIError as e:
+            logger.warning(f"Не удалось отправить сообщение {chat_id}: {e}")
+            return FAILED
+    return FAILED
+
+background_tasks = set()
+
+def spawn_background(coro, name: str):
+    """Запускает фоновую задачу и держит на нее ссылку до завершения"""
+    task = asyncio.create_task(coro, name=name)
+    background_tasks.add(task)
+
+    def done(task):
+        background_tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error(f"Фоновая задача {name} завершилась с ошибкой: {task.exception()!r}")
+
+    task.add_done_callback(done)
+    return task
+
+class Broadcast:
+    """Отправка одного текста списку чатов с ограниченным параллелизмом.
+
+    on_progress(broadcast) вызывается раз в BROADCAST_PROGRESS_INTERVAL секунд и
+    по завершении (broadcast.finished = True).
+    """
+
+    def __init__(self, name: str, chat_ids, text: str, on_progress=None,
+                 concurrency: int = BROADCAST_CONCURRENCY, **send_kwargs):
+        self.name = name
+        self.chat_ids = list(dict.fromkeys(chat_ids))
+        self.text = text
+        self.on_progress = on_progress
+        self.concurrency = concurrency
+        self.send_kwargs = send_kwargs
+        self.counts = {DELIVERED: 0, FAILED: 0, BLOCKED: 0}
+        self.finished = False
+        self.started = time.monotonic()
+
+    @property
+    def total(self) -> int:
+        return len(self.chat_ids)
+
+    @property
+    def done(self) -> int:
+        return sum(self.counts.values())
+
+    def summary(self) -> str:
+        return (f"доставлено {self.counts[DELIVERED]}, заблокировали бота {self.counts[BLOCKED]}, "
+                f"ошибок {self.counts[FAILED]} из {self.total} за {time.monotonic() - self.started:.0f} с")
+
+    async def _report(self):
+        if self.on_progress is None:
+            return
+        try:
+            await self.on_progress(self)
+        except TelegramAPIError as e:
+            logger.warning(f"Не удалось обновить прогресс рассылки {self.name}: {e}")
+
+    async def run(self):
+        pending = iter(self.chat_ids)
+
+        async def worker():
+            for chat_id in pending:
+                self.counts[await send_paced(chat_id, self.text, **self.send_kwargs)] += 1
+
+        async def progress():
+            while True:
+                await asyncio.sleep(BROADCAST_PROGRESS_INTERVAL)
+                await self._report()
+
+        reporter = asyncio.create_task(progress())
+        try:
+            await asyncio.gather(*(worker() for _ in range(min(self.concurrency, self.total))))
+        finally:
+            reporter.cancel()
+            self.finished = True
+        logger.info(f"Рассылка {self.name}: {self.summary()}")
+        await self._report()
+        return self
+
+    def start(self):
+        return spawn_background(self.run(), f"broadcast:{self.name}")
+
+# --- Очередь исходящих сообщений ---
+# Уведомления записываются в outbox той же транзакцией, что и изменение состояния,
+# и доставляются фоновыми воркерами через send_paced. Обработчик не ждет отправки,
+# а недоставленное после перезапуска досылается.
+
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+OUTBOX_BATCH = 20  # небольшая выборка, чтобы срочные сообщения обгоняли массовые
+OUTBOX_POLL_INTERVAL = 1.0
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_DELAY = 30  # секунд до повтора, удваивается с каждой попыткой
+OUTBOX_KEEP_DAYS = 7
+OUTBOX_LEASE = 120  # секунд на отправку забранного сообщения, потом оно снова ожидает
+OUTBOX_QUEUED = ("pending", "sending")  # статусы еще не обработанных сообщений
+OUTBOX_PRIORITY_URGENT = -1  # служебные уведомления админам
+OUTBOX_PRIORITY_NORMAL = 0
+OUTBOX_PRIORITY_BULK = 1  # объявления всем пользователям
+OUTBOX_TRACK_INTERVAL = 10
+OUTBOX_TRACK_TIMEOUT = 6 * 3600
+ADMIN_BATCH = "admins"  # метка сообщений админам для отчета о доставке
+
+SQL_OUTBOX_COLUMNS = "(chat_id, text, parse_mode, fallback_text, reply_markup, batch, priority)"
+SQL_OUTBOX_BATCH_STATUS = register_query(
+    "outbox_batch_status", "SELECT status, COUNT(*) FROM outbox WHERE batch = ? GROUP BY status", ("",)
+)
+SQL_OUTBOX_ADMIN_STATUS = register_query(
+    "outbox_admin_status",
+    "SELECT chat_id, status, COUNT(*), MAX(sent_at) FROM outbox WHERE batch = ? GROUP BY chat_id, status",
+    (ADMIN_BATCH,)
+)
+SQL_OUTBOX_DUE = register_query("outbox_due", '''
+    SELECT id
+    FROM outbox
+    WHERE status = 'pending' AND next_attempt_at <= ?
+    ORDER BY priority, next_attempt_at
+    LIMIT ?
+''', (0.0, OUTBOX_BATCH))
+# Забирает подошедшие сообщения одним оператором на писателе: строку, уже забранную
+# другим выборщиком, повторное условие status = 'pending' не пропустит
+SQL_OUTBOX_CLAIM = f'''
+    UPDATE outbox SET status = 'sending', lease_until = ?
+    WHERE id IN ({SQL_OUTBOX_DUE}) AND status = 'pending'
+    RETURNING id, chat_id, text, parse_mode, fallback_text, reply_markup, attempts, priority, next_attempt_at
+'''
+# Сообщения, чья аренда истекла (процесс упал или перезапущен посреди отправки)
+SQL_OUTBOX_EXPIRE = "UPDATE outbox SET status = 'pending' WHERE status = 'sending' AND lease_until < ?"
+
+class Outbox:
+    """Доставка сообщений из таблицы outbox: один выборщик и пул воркеров"""
+
+    def __init__(self, workers: int = OUTBOX_WORKERS):
+        self.workers = workers
+        self.counts = {DELIVERED: 0, FAILED: 0, BLOCKED: 0}
+        self.retries = 0
+        self._tasks = []
+        self._queue = None
+        self._wake = None
+        self._wake_pending = False
+        self._inflight = set()
+
+    def mark_enqueued(self):
+        self._wake_pending = True
+
+    def on_release(self):
+        # Будим выборщик только после выхода из блока писателя, когда строки уже закоммичены
+        if self._wake_pending and self._wake is not None:
+            self._wake_pending = False
+            self._wake.set()
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.workers * 2)
+        self._wake = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._fetch(), name="outbox:fetch")]
+        self._tasks += [asyncio.create_task(self._work(), name=f"outbox:worker{i}") for i in range(self.workers)]
+        logger.info(f"Очередь исходящих сообщений запущена: {self.workers} воркеров")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info(f"Очередь исходящих сообщений остановлена: {self.stats()}")
+
+    async def _claim(self):
+        """Переводит подошедшие сообщения в 'sending' и возвращает их в порядке приоритета"""
+        now = time.time()
+        async with db_pool.acquire() as conn:
+            await conn.execute(SQL_OUTBOX_EXPIRE, (now,))
+            cursor = await conn.execute(SQL_OUTBOX_CLAIM, (now + OUTBOX_LEASE, now, OUTBOX_BATCH))
+            rows = await cursor.fetchall()
+            await conn.commit()
+        rows.sort(key=lambda row: (row[-2], row[-1]))
+        # Аренда могла истечь, пока сообщение ждало паузы Telegram: второй раз его не ставим
+        return [row[:-2] for row in rows if row[0] not in self._inflight]
+
+    async def _fetch(self):
+        while True:
+            self._wake.clear()
             try:
-                await bot.send_message(telegram_id, notification_text)
-                successful_notifications += 1
-            except TelegramAPIError as e:
-                failed_notifications += 1
-                logger.warning(f"Не удалось отправить уведомление пользователю {telegram_id}: {e}")
+                rows = await self._claim()
+            except aiosqlite.Error as e:
+                logger.error(f"Ошибка выборки outbox: {e}\n\n{traceback.format_exc()}")
+                rows = []
+            for row in rows:
+                self._inflight.add(row[0])
+                await self._queue.put(row)
+            if len(rows) < OUTBOX_BATCH:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), OUTBOX_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _work(self):
+        while True:
+            row = await self._queue.get()
+            try:
+                await self._deliver(*row)
+            except aiosqlite.Error as e:
+                logger.error(f"Ошибка обновления outbox для сообщения {row[0]}: {e}\n\n{traceback.format_exc()}")
+            finally:
+                self._inflight.discard(row[0])
+
+    async def _deliver(self, message_id, chat_id, text, parse_mode, fallback_text, reply_markup, attempts):
+        kwargs = {}
+        if parse_mode:
+            kwargs["parse_mode"] = parse_mode
+        if reply_markup:
+            kwargs["reply_markup"] = InlineKeyboardMarkup.model_validate_json(reply_markup)
+        outcome = await send_paced(chat_id, text, **kwargs)
+        if outcome == FAILED and fallback_text:
+            # Например, не разобралась разметка - отправляем текст без форматирования
+            kwargs.pop("parse_mode", None)
+            outcome = await send_paced(chat_id, fallback_text, **kwargs)
+        if outcome == FAILED and attempts + 1 < OUTBOX_MAX_ATTEMPTS:
+            self.retries += 1
+            await write_queue.submit(
+                "UPDATE outbox SET status = 'pending', attempts = attempts + 1, next_attempt_at = ? WHERE id = ? AND status = 'sending'",
+                (time.time() + OUTBOX_RETRY_DELAY * 2 ** attempts, message_id)
+            )
+            return
+        self.counts[outcome] += 1
+        if outcome != DELIVERED and is_admin(chat_id):
+            logger.warning(f"Уведомление админу {chat_id} не доставлено: {outcome}")
+        await write_queue.submit(
+            "UPDATE outbox SET status = ?, attempts = attempts + 1, sent_at = CURRENT_TIMESTAMP WHERE id = ? AND status = 'sending'",
+            (outcome, message_id)
+        )
+
+    async def purge(self):
+        """Удаляет обработанные сообщения старше OUTBOX_KEEP_DAYS"""
+        try:
+            await write_queue.submit(
+                "DELETE FROM outbox WHERE status NOT IN (?, ?) AND created_at < datetime('now', ?)",
+                OUTBOX_QUEUED + (f"-{OUTBOX_KEEP_DAYS} days",)
+            )
+        except aiosqlite.Error as e:
+            logger.error(f"Ошибка очистки outbox: {e}\n\n{traceback.format_exc()}")
+
+    def stats(self) -> str:
+        return (f"доставлено {self.counts[DELIVERED]}, заблокировали бота {self.counts[BLOCKED]}, "
+                f"ошибок {self.counts[FAILED]}, повторов {self.retries}, в работе {len(self._inflight)}")
+
+outbox = Outbox()
+db_pool.release_hooks.append(outbox.on_release)
+
+def _outbox_values(text: str, parse_mode, fallback_text, reply_markup, batch, priority):
+    markup = reply_markup.model_dump_json(exclude_none=True) if reply_markup is not None else None
+    return (text, parse_mode, fallback_text, markup, batch, priority)
+
+async def enqueue_message(conn, chat_ids, text: str, parse_mode=None, fallback_text=None, reply_markup=None, batch=None,
+                          priority: int = OUTBOX_PRIORITY_NORMAL) -> int:
+    """Ставит сообщение в outbox через соединение вызывающего; коммит - за ним"""
+    values = _outbox_values(text, parse_mode, fallback_text, reply_markup, batch, priority)
+    rows = [(chat_id,) + values for chat_id in chat_ids]
+    await conn.executemany(f"INSERT INTO outbox {SQL_OUTBOX_COLUMNS} VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    outbox.mark_enqueued()
+    return len(rows)
+
+async def enqueue_select(conn, recipients_sql: str, params, text: str, parse_mode=None, fallback_text=None,
+                         reply_markup=None, batch=None, priority: int = OUTBOX_PRIORITY_NORMAL) -> int:
+    """То же для получателей из запроса; recipients_sql возвращает столбец chat_id"""
+    values = _outbox_values(text, parse_mode, fallback_text, reply_markup, batch, priority)
+    cursor = await conn.execute(
+        f"INSERT INTO outbox {SQL_OUTBOX_COLUMNS} SELECT r.chat_id, ?, ?, ?, ?, ?, ? FROM ({recipients_sql}) r",
+        values + tuple(params)
+    )
+    outbox.mark_enqueued()
+    return cursor.rowcount
+
+@asynccontextmanager
+async def outbox_writer():
+    """Писатель для постановки сообщений.
+
+    Внутри уже открытого блока писателя сообщения уходят вместе с коммитом
+    вызывающего, иначе коммитятся сразу.
+    """
+    nested = db_pool.holds_writer()
+    async with db_pool.acquire() as conn:
+        yield conn
+        if not nested:
+            await conn.commit()
+
+async def outbox_batch_status(batch: str):
+    """Число сообщений пачки по статусам"""
+    async with db_pool.read() as conn:
+        cursor = await conn.execute(SQL_OUTBOX_BATCH_STATUS, (batch,))
+        return dict(await cursor.fetchall())
+
+async def track_outbox_batch(batch: str, report_chat_id: int, title: str):
+    """Фоновая задача: ждет, пока пачка будет разослана, и присылает итог в report_chat_id"""
+    deadline = time.monotonic() + OUTBOX_TRACK_TIMEOUT
+    while True:
+        await asyncio.sleep(OUTBOX_TRACK_INTERVAL)
+        counts = await outbox_batch_status(batch)
+        queued = sum(counts.get(status, 0) for status in OUTBOX_QUEUED)
+        if not queued or time.monotonic() > deadline:
+            break
+    summary = (
+        f"{title}\n"
+        f" Доставлено: {counts.get(DELIVERED, 0)}\n"
+        f" Заблокировали бота: {counts.get(BLOCKED, 0)}\n"
+        f" Не удалось: {counts.get(FAILED, 0)}"
+    )
+    if queued:
+        summary += f"\n Еще в очереди: {queued}"
+    logger.info(f"Итог рассылки {batch}: {counts}")
+    async with outbox_writer() as conn:
+        await enqueue_message(conn, [report_chat_id], summary)
+
+async def notify_squad(squad_id: int, message: str):
+    """Ставит сообщение участникам сквада в outbox (squad_id None - всем пользователям)"""
+    try:
+        async with outbox_writer() as conn:
+            if squad_id is None:
+                await enqueue_select(conn, "SELECT telegram_id AS chat_id FROM escorts WHERE reachable = 1", (), message)
+            else:
+                await enqueue_select(
+                    conn, "SELECT telegram_id AS chat_id FROM escorts WHERE squad_id = ? AND reachable = 1", (squad_id,), message
+                )
+    except aiosqlite.Error as e:
+        # В транзакции вызывающего ошибка должна откатить и его изменения
+        if db_pool.holds_writer():
+            raise
+        logger.error(f"Ошибка в notify_squad для squad_id {squad_id}: {e}\n\n{traceback.format_exc()}")
+
+async def notify_all_users_about_new_order(order_id: str, customer_info: str, amount: float, batch: str = None) -> int:
+    """Ставит уведомление о новом заказе всем пользователям в outbox; возвращает число получателей
+
+    Внутри блока писателя ошибка базы пробрасывается вызывающему: заказ и его
+    объявления откатываются вместе.
+    """
+    notification_text = (
+        f" НОВЫЙ ЗАКАЗ!\n\n"
+        f" Заказ #{order_id}\n"
+        f" Клиент: {customer_info}\n"
+        f" Сумма: {amount:.0f} руб.\n\n"
+        f"Перейдите в раздел 'Заказы' → 'Доступные заказы' чтобы присоединиться!"
+    )
+    try:
+        async with outbox_writer() as conn:
+            queued = await enqueue_select(
+                conn, "SELECT telegram_id AS chat_id FROM escorts WHERE rules_accepted = 1 AND reachable = 1", (),
+                notification_text, batch=batch or f"new_order:{order_id}", priority=OUTBOX_PRIORITY_BULK
+            )
         
-        logger.info(f"Уведомления о новом заказе #{order_id}: отправлено {successful_notifications}, не удалось {failed_notifications}")
+        logger.info(f"Уведомления о новом заказе #{order_id}: в очереди {queued}")
+        return queued
         
-    except Exception as e:
-        logger.error(f"Ошибка при отправке уведомлений о новом заказе: {e}")
+    except aiosqlite.Error as e:
+        if db_pool.holds_writer():
+            raise
+        logger.error(f"Ошибка при отправке уведомлений о новом заказе: {e}\n\n{traceback.format_exc()}")
+        return 0
 
 async def show_order_participants_menu(message, order_db_id: int, memo_order_id: str):
     """Показывает динамическое меню участников заказа"""
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             # Получаем всех участников заказа с их Telegram username и PUBG ID
             cursor = await conn.execute(
                 '''
@@ -570,58 +1556,187 @@ async def notify_squad_with_mentions(squad_id: int, message: str):
         return
 
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with outbox_writer() as conn:
             cursor = await conn.execute(
                 '''
-                SELECT e.telegram_id, e.username, s.name
+                SELECT e.telegram_id, e.username
                 FROM escorts e
-                JOIN squads s ON e.squad_id = s.id
                 WHERE e.squad_id = ?
                 ''', (squad_id,)
             )
             squad_members = await cursor.fetchall()
 
-        if not squad_members:
-            return
+            if not squad_members:
+                return
 
-        # Создаем список упоминаний
-        mentions = []
-        for telegram_id, username, squad_name in squad_members:
-            if username:
-                mentions.append(f"@{username}")
-            else:
-                mentions.append(f"[Пользователь](tg://user?id={telegram_id})")
+            # Создаем список упоминаний
+            mentions = []
+            for telegram_id, username in squad_members:
+                if username:
+                    mentions.append(f"@{username}")
+                else:
+                    mentions.append(f"[Пользователь](tg://user?id={telegram_id})")
 
-        # Формируем сообщение с упоминаниями
-        mention_text = ", ".join(mentions)
-        full_message = f"{message}\n\n Участники сквада: {mention_text}"
+            # Формируем сообщение с упоминаниями
+            mention_text = ", ".join(mentions)
+            full_message = f"{message}\n\n Участники сквада: {mention_text}"
 
-        # Отправляем уведомление всем участникам сквада
-        for telegram_id, username, _ in squad_members:
-            try:
-                await bot.send_message(telegram_id, full_message, parse_mode=ParseMode.MARKDOWN)
-            except TelegramAPIError:
-                # Пытаемся отправить без форматирования
-                try:
-                    await bot.send_message(telegram_id, message)
-                except TelegramAPIError:
-                    pass
+            # Если разметка не пройдет, воркер отправит текст без упоминаний - отдельный
+            # notify_squad не нужен, иначе при ошибке сообщение уходило дважды
+            fanout = OrderFanout(squad_id=squad_id)
+            fanout.add(FANOUT_SQUAD, full_message, parse_mode=ParseMode.MARKDOWN, fallback_text=message)
+            await fanout.enqueue(conn)
 
-    except Exception as e:
-        logger.error(f"Ошибка в notify_squad_with_mentions: {e}")
-        # Fallback на обычные уведомления
-        await notify_squad(squad_id, message)
+    except aiosqlite.Error as e:
+        # В транзакции вызывающего ошибка должна откатить и его изменения
+        if db_pool.holds_writer():
+            raise
+        logger.error(f"Ошибка в notify_squad_with_mentions для squad_id {squad_id}: {e}\n\n{traceback.format_exc()}")
 
 async def notify_admins(message: str, reply_markup=None):
-    for admin_id in ADMIN_IDS:
-        try:
-            await bot.send_message(admin_id, message, reply_markup=reply_markup)
-        except TelegramAPIError as e:
-            logger.warning(f"Не удалось уведомить админа {admin_id}: {e}")
+    """Ставит сообщение всем админам в outbox.
+
+    Каждому админу - своя строка, воркеры outbox доставляют их параллельно
+    и раньше остальных сообщений, так что медленный или заблокированный чат
+    одного админа не задерживает ни других админов, ни ответ пользователю.
+    """
+    try:
+        async with outbox_writer() as conn:
+            await enqueue_message(
+                conn, ADMIN_IDS, message, reply_markup=reply_markup, batch=ADMIN_BATCH, priority=OUTBOX_PRIORITY_URGENT
+            )
+    except aiosqlite.Error as e:
+        # В транзакции вызывающего ошибка должна откатить и его изменения
+        if db_pool.holds_writer():
+            raise
+        logger.error(f"Ошибка в notify_admins: {e}\n\n{traceback.format_exc()}")
+
+async def admin_delivery_report() -> str:
+    """Итоги доставки уведомлений по каждому админу"""
+    async with db_pool.read() as conn:
+        cursor = await conn.execute(SQL_OUTBOX_ADMIN_STATUS, (ADMIN_BATCH,))
+        rows = await cursor.fetchall()
+    counts = {admin_id: {} for admin_id in ADMIN_IDS}
+    last_sent = {}
+    for chat_id, status, count, sent_at in rows:
+        counts.setdefault(chat_id, {})[status] = count
+        if status == DELIVERED and sent_at:
+            last_sent[chat_id] = sent_at
+    lines = []
+    for admin_id, statuses in counts.items():
+        lines.append(
+            f"админ {admin_id}: доставлено {statuses.get(DELIVERED, 0)}, заблокировали бота {statuses.get(BLOCKED, 0)}, "
+            f"ошибок {statuses.get(FAILED, 0)}, в очереди {sum(statuses.get(status, 0) for status in OUTBOX_QUEUED)}, "
+            f"последняя доставка {last_sent.get(admin_id, 'нет')}"
+        )
+    return "\n".join(lines)
+
+# --- Рассылка событий заказа ---
+# Роли получателей в порядке приоритета: кто попал в несколько ролей,
+# получает вариант сообщения первой из них (не путать с битами ролей доступа ROLE_*)
+FANOUT_PARTICIPANT = "participant"
+FANOUT_ADMIN = "admin"
+FANOUT_SQUAD = "squad"
+FANOUT_ROLES = (FANOUT_PARTICIPANT, FANOUT_ADMIN, FANOUT_SQUAD)
+# Админы получают уведомления о завершении; карточка каждого старта - только по настройке
+ORDER_START_NOTIFY_ADMINS = os.getenv("ORDER_START_NOTIFY_ADMINS", "0") == "1"
+
+class FanoutVariant:
+    __slots__ = ("text", "parse_mode", "fallback_text", "reply_markup", "admin_reply_markup")
+
+    def __init__(self, text, parse_mode, fallback_text, reply_markup, admin_reply_markup):
+        self.text = text
+        self.parse_mode = parse_mode
+        self.fallback_text = fallback_text
+        self.reply_markup = reply_markup
+        self.admin_reply_markup = admin_reply_markup
+
+class OrderFanout:
+    """План рассылки по событию заказа.
+
+    Для каждой роли задается свой вариант сообщения; получатели собираются
+    из участников заказа, сквада и админов, и каждый получает ровно одно
+    сообщение - вариант своей старшей роли. Недоступные пользователи пропускаются.
+    """
+
+    def __init__(self, order_db_id: int = None, squad_id: int = None, batch: str = None, participants=None):
+        self.order_db_id = order_db_id
+        self.squad_id = squad_id
+        self.batch = batch
+        # Участники, уже известные вызывающему (доступные chat_id), - чтобы не читать их повторно
+        self.participants = participants
+        self.variants = {}
+
+    def add(self, role: str, text: str, parse_mode=None, fallback_text=None, reply_markup=None, admin_reply_markup=None):
+        """Вариант сообщения для роли; admin_reply_markup - клавиатура для админов в этой роли"""
+        if role not in FANOUT_ROLES:
+            raise ValueError(f"Неизвестная роль получателя: {role}")
+        self.variants[role] = FanoutVariant(text, parse_mode, fallback_text, reply_markup, admin_reply_markup)
+        return self
+
+    async def _recipients(self, conn, role: str):
+        if role == FANOUT_ADMIN:
+            return list(ADMIN_IDS)
+        if role == FANOUT_PARTICIPANT:
+            if self.participants is not None:
+                return list(self.participants)
+            if self.order_db_id is None:
+                return []
+            cursor = await conn.execute(
+                '''
+                SELECT e.telegram_id
+                FROM order_escorts oe
+                JOIN escorts e ON oe.escort_id = e.id
+                WHERE oe.order_id = ? AND e.reachable = 1
+                ''', (self.order_db_id,)
+            )
+        else:
+            if self.squad_id is None:
+                return []
+            cursor = await conn.execute(
+                "SELECT telegram_id FROM escorts WHERE squad_id = ? AND reachable = 1", (self.squad_id,)
+            )
+        return [row[0] for row in await cursor.fetchall()]
+
+    async def plan(self, conn):
+        """Получатели по ролям без повторов: {роль: [chat_id, ...]}"""
+        seen = set()
+        plan = {}
+        for role in FANOUT_ROLES:
+            if role not in self.variants:
+                continue
+            chat_ids = []
+            for chat_id in await self._recipients(conn, role):
+                if chat_id not in seen:
+                    seen.add(chat_id)
+                    chat_ids.append(chat_id)
+            plan[role] = chat_ids
+        return plan
+
+    async def enqueue(self, conn) -> int:
+        """Ставит план в outbox через соединение вызывающего; возвращает число сообщений
+
+        Вариант для админов уходит как notify_admins: с меткой ADMIN_BATCH и срочным приоритетом.
+        """
+        queued = 0
+        for role, chat_ids in (await self.plan(conn)).items():
+            variant = self.variants[role]
+            batch, priority = self.batch, OUTBOX_PRIORITY_NORMAL
+            if role == FANOUT_ADMIN:
+                batch, priority = self.batch or ADMIN_BATCH, OUTBOX_PRIORITY_URGENT
+            admins = [chat_id for chat_id in chat_ids if is_admin(chat_id)] if variant.admin_reply_markup else []
+            others = [chat_id for chat_id in chat_ids if chat_id not in admins]
+            for group, markup in ((others, variant.reply_markup), (admins, variant.admin_reply_markup)):
+                if group:
+                    queued += await enqueue_message(
+                        conn, group, variant.text, parse_mode=variant.parse_mode, fallback_text=variant.fallback_text,
+                        reply_markup=markup, batch=batch, priority=priority
+                    )
+        return queued
 
 async def get_order_applications(order_id: int):
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute(
                 '''
                 SELECT e.telegram_id, e.username, e.pubg_id, e.squad_id, s.name
@@ -638,7 +1753,7 @@ async def get_order_applications(order_id: int):
 
 async def get_order_info(memo_order_id: str):
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute(
                 "SELECT id, customer_info, amount, status, squad_id, commission_amount FROM orders WHERE memo_order_id = ?",
                 (memo_order_id,)
@@ -649,51 +1764,37 @@ async def get_order_info(memo_order_id: str):
         return None
 
 async def update_escort_reputation(escort_id: int, rating: int):
-    try:
-        async with aiosqlite.connect(DB_PATH) as conn:
-            # Обновляем систему рейтинга в звездах
-            await conn.execute(
-                '''
-                UPDATE escorts
-                SET total_rating = total_rating + ?,
-                    rating_count = rating_count + 1
-                WHERE id = ?
-                ''',
-                (rating, escort_id)
-            )
-            await conn.commit()
+    forget_request_identity()
+    try:
+        # Обновляем систему рейтинга в звездах
+        await write_queue.submit(
+            '''
+            UPDATE escorts
+            SET total_rating = total_rating + ?,
+                rating_count = rating_count + 1
+            WHERE id = ?
+            ''',
+            (rating, escort_id)
+        )
+        escort_cache.invalidate_ids([escort_id])
     except aiosqlite.Error as e:
         logger.error(f"Ошибка в update_escort_reputation для escort_id {escort_id}: \n{e}\n{traceback.format_exc()}")
 
-async def update_squad_reputation(squad_id: int, rating: int):
-    try:
-        async with aiosqlite.connect(DB_PATH) as conn:
-            # Получаем текущие значения рейтинга
-            cursor = await conn.execute(
-                "SELECT rating, rating_count FROM squads WHERE id = ?", (squad_id,)
-            )
-            row = await cursor.fetchone()
-            if row:
-                current_rating, rating_count = row
-                new_rating_count = rating_count + 1
-                new_rating = (current_rating * rating_count + rating) / new_rating_count
-
-                await conn.execute(
-                    '''
-                    UPDATE squads
-                    SET rating = ?,
-                        rating_count = ?
-                    WHERE id = ?
-                    ''',
-                    (new_rating, new_rating_count, squad_id)
-                )
-            await conn.commit()
-    except aiosqlite.Error as e:
-        logger.error(f"Ошибка в update_squad_reputation для squad_id {squad_id}: \n{e}\n{traceback.format_exc()}")
+async def update_squad_reputation(conn, squad_id: int, rating: int):
+    """Пересчитывает средний рейтинг сквада в транзакции вызывающего (коммит за ним)."""
+    await conn.execute(
+        '''
+        UPDATE squads
+        SET rating = (rating * rating_count + ?) / (rating_count + 1.0),
+            rating_count = rating_count + 1
+        WHERE id = ?
+        ''',
+        (rating, squad_id)
+    )
 
 async def get_order_escorts(order_id: int):
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute(
                 '''
                 SELECT e.telegram_id, e.username, oe.pubg_id, e.squad_id, s.name
@@ -714,14 +1815,8 @@ async def get_order_escorts(order_id: int):
 
 async def check_pending_orders():
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
-            cursor = await conn.execute(
-                '''
-                SELECT id, memo_order_id, squad_id
-                FROM orders
-                WHERE status = 'in_progress' AND created_at < ?
-                ''', ((datetime.now() - timedelta(hours=12)).isoformat(),)
-            )
+        async with db_pool.read() as conn:
+            cursor = await conn.execute(SQL_STALE_IN_PROGRESS_ORDERS, ((datetime.now() - timedelta(hours=12)).isoformat(),))
             orders = await cursor.fetchall()
 
         for order_id, memo_order_id, squad_id in orders:
@@ -733,70 +1828,385 @@ async def check_pending_orders():
 
 
 # --- Проверка подписки ---
-async def check_subscription(user_id: int) -> bool:
+SUBSCRIPTION_TTL = int(os.getenv("SUBSCRIPTION_TTL", "600"))
+SUBSCRIPTION_STALE_TTL = int(os.getenv("SUBSCRIPTION_STALE_TTL", "86400"))
+SUBSCRIPTION_API_TIMEOUT = float(os.getenv("SUBSCRIPTION_API_TIMEOUT", "2"))
+SUBSCRIBED_STATUSES = ('member', 'administrator', 'creator')
+
+class SubscriptionCache:
+    """Кэш подтвержденных подписок на обязательный канал.
+
+    Свежий ответ отдается без запроса к API, устаревший - сразу, с обновлением в фоне.
+    При сбое API доступ сохраняется только тем, чья подписка уже была подтверждена.
+    Отписки приходят через chat_member и сразу убирают пользователя из кэша.
+    """
+
+    def __init__(self, ttl: int = SUBSCRIPTION_TTL, stale_ttl: int = SUBSCRIPTION_STALE_TTL):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.api_errors = 0
+        # user_id -> время последнего подтверждения подписки
+        self._confirmed = {}
+        self._refreshing = {}
+
+    def update(self, user_id: int, subscribed: bool):
+        if subscribed:
+            self._confirmed[user_id] = time.monotonic()
+        else:
+            self._confirmed.pop(user_id, None)
+
+    async def fetch(self, user_id: int) -> bool:
+        member = await asyncio.wait_for(bot.get_chat_member(REQUIRED_CHANNEL_ID, user_id), SUBSCRIPTION_API_TIMEOUT)
+        subscribed = member.status in SUBSCRIBED_STATUSES
+        self.update(user_id, subscribed)
+        return subscribed
+
+    async def _refresh(self, user_id: int):
+        try:
+            await self.fetch(user_id)
+        except Exception as e:
+            self.api_errors += 1
+            logger.warning(f"Фоновая проверка подписки для {user_id} не удалась: {e}")
+        finally:
+            self._refreshing.pop(user_id, None)
+
+    async def check(self, user_id: int, force: bool = False) -> bool:
+        confirmed_at = self._confirmed.get(user_id)
+        if not force and confirmed_at is not None:
+            age = time.monotonic() - confirmed_at
+            if age < self.ttl:
+                self.hits += 1
+                return True
+            if age < self.stale_ttl:
+                self.stale_hits += 1
+                if user_id not in self._refreshing:
+                    self._refreshing[user_id] = asyncio.create_task(self._refresh(user_id))
+                return True
+
+        self.misses += 1
+        try:
+            return await self.fetch(user_id)
+        except Exception as e:
+            # Сбой API не блокирует уже подтвержденного подписчика, но и не пускает без подтверждения
+            self.api_errors += 1
+            logger.error(f"Ошибка проверки подписки для {user_id}: {e}")
+            return confirmed_at is not None
+
+    def stats(self) -> str:
+        return (f"подписки: {len(self._confirmed)}, свежих {self.hits}, устаревших {self.stale_hits}, "
+                f"запросов к API {self.misses}, ошибок API {self.api_errors}")
+
+subscription_cache = SubscriptionCache()
+
+async def check_subscription(user_id: int, force: bool = False) -> bool:
     """Проверяет подписку пользователя на обязательный канал"""
-    try:
-        member = await bot.get_chat_member(REQUIRED_CHANNEL_ID, user_id)
-        return member.status in ['member', 'administrator', 'creator']
-    except Exception as e:
-        logger.error(f"Ошибка проверки подписки для {user_id}: {e}")
-        return False
+    return await subscription_cache.check(user_id, force)
+
+@dp.chat_member(F.chat.id == REQUIRED_CHANNEL_ID)
+async def required_channel_member_updated(event: types.ChatMemberUpdated):
+    """Обновляет кэш подписок по событиям канала (бот должен быть администратором канала)"""
+    member = event.new_chat_member
+    subscribed = member.status in SUBSCRIBED_STATUSES
+    subscription_cache.update(member.user.id, subscribed)
+    logger.info(f"Подписка {member.user.id} на обязательный канал: {member.status}")
 
 # --- Проверка доступа ---
+ROLE_ADMIN = 1
+ROLE_LEADER = 2
+
+class RoleIndex:
+    """Роли пользователей в памяти: битовая маска по telegram_id и сквад лидера.
+
+    Лидеры загружаются из squad_leaders при запуске и дальше обновляются
+    обработчиками, которые пишут в squad_leaders; админы берутся из ADMIN_IDS.
+    """
+
+    def __init__(self, admin_ids):
+        self._admin_ids = frozenset(admin_ids)
+        self._roles = {}
+        self._leader_squads = {}
+        self._reset()
+
+    def _reset(self):
+        self._roles = {telegram_id: ROLE_ADMIN for telegram_id in self._admin_ids}
+        self._leader_squads = {}
+
+    async def load(self):
+        async with db_pool.read() as conn:
+            cursor = await conn.execute('''
+                SELECT e.telegram_id, sl.squad_id FROM squad_leaders sl
+                JOIN escorts e ON sl.leader_id = e.id
+                JOIN squads s ON sl.squad_id = s.id
+            ''')
+            leaders = await cursor.fetchall()
+        self._reset()
+        for telegram_id, squad_id in leaders:
+            self.set_leader(telegram_id, squad_id)
+        logger.info(f"Индекс ролей загружен: админов {len(self._admin_ids)}, лидеров {len(self._leader_squads)}")
+
+    def has(self, telegram_id: int, role: int) -> bool:
+        return bool(self._roles.get(telegram_id, 0) & role)
+
+    def leader_squad(self, telegram_id: int):
+        return self._leader_squads.get(telegram_id)
+
+    def set_leader(self, telegram_id: int, squad_id: int):
+        self._roles[telegram_id] = self._roles.get(telegram_id, 0) | ROLE_LEADER
+        self._leader_squads[telegram_id] = squad_id
+
+    def remove_leader(self, telegram_id: int):
+        self._leader_squads.pop(telegram_id, None)
+        roles = self._roles.get(telegram_id, 0) & ~ROLE_LEADER
+        if roles:
+            self._roles[telegram_id] = roles
+        else:
+            self._roles.pop(telegram_id, None)
+
+    def remove_squad(self, squad_id: int):
+        for telegram_id in [tid for tid, sid in self._leader_squads.items() if sid == squad_id]:
+            self.remove_leader(telegram_id)
+
+role_index = RoleIndex(ADMIN_IDS)
+
 def is_admin(user_id: int) -> bool:
-    return user_id in ADMIN_IDS
+    return role_index.has(user_id, ROLE_ADMIN)
 
-async def is_leader(user_id: int) -> bool:
+def is_leader(user_id: int) -> bool:
     """Проверяет, является ли пользователь лидером сквада"""
-    try:
-        async with aiosqlite.connect(DB_PATH) as conn:
-            cursor = await conn.execute(
-                '''
-                SELECT sl.squad_id, s.name FROM escorts e
-                JOIN squad_leaders sl ON e.id = sl.leader_id
-                JOIN squads s ON sl.squad_id = s.id
-                WHERE e.telegram_id = ?
-                ''', (user_id,)
-            )
-            result = await cursor.fetchone()
-            return result is not None
-    except aiosqlite.Error as e:
-        logger.error(f"Ошибка проверки лидерства для {user_id}: {e}")
-        return False
+    return role_index.has(user_id, ROLE_LEADER)
+
+# --- Рейтинг ---
+# Рейтинг пользователей и сквадов держится в памяти: ключи (-средняя оценка, id)
+# в отсортированных списках, позиция ищется bisect'ом за O(log n). Записи в escorts
+# сбрасывают escort_cache, тот помечает строки здесь, и перед чтением перечитываются
+# только помеченные строки.
+
+LEADERBOARD_TOP = 10
+LEADERBOARD_REFRESH_CHUNK = 500  # не больше параметров в одном IN (...)
+
+class LeaderboardEntry:
+    __slots__ = ("escort_id", "telegram_id", "username", "squad_id", "rating", "rating_count", "completed_orders")
+
+    def __init__(self, escort_id, telegram_id, username, squad_id, rating, rating_count, completed_orders):
+        self.escort_id = escort_id
+        self.telegram_id = telegram_id
+        self.username = username
+        self.squad_id = squad_id
+        self.rating = rating
+        self.rating_count = rating_count
+        self.completed_orders = completed_orders
+
+class LeaderboardSquad:
+    __slots__ = ("squad_id", "name", "members", "rating_sum", "completed_orders", "key")
+
+    def __init__(self, squad_id, name):
+        self.squad_id = squad_id
+        self.name = name
+        self.members = set()
+        self.rating_sum = 0.0
+        self.completed_orders = 0
+        self.key = None
+
+    @property
+    def rating(self) -> float:
+        return self.rating_sum / len(self.members) if self.members else 0.0
+
+class Leaderboard:
+    """Таблица лидеров в памяти с инкрементальным обновлением.
+
+    В рейтинг попадают пользователи с оценками; рейтинг сквада - среднее по его
+    оцененным участникам, как в прежнем запросе с GROUP BY.
+    """
+
+    def __init__(self):
+        self._users = {}
+        self._user_keys = []
+        self._ids = {}
+        self._squads = {}
+        self._squad_keys = []
+        self._dirty_telegram_ids = set()
+        self._dirty_escort_ids = set()
+        self._stale = True
+        self._lock = asyncio.Lock()
+        self.loads = 0
+        self.refreshed_rows = 0
+
+    def mark(self, telegram_ids=(), escort_ids=(), full: bool = False):
+        """Помечает строки escorts, изменившиеся после коммита"""
+        if full:
+            self._stale = True
+        self._dirty_telegram_ids.update(telegram_ids)
+        self._dirty_escort_ids.update(escort_ids)
+
+    async def refresh(self):
+        """Перечитывает помеченные строки; если ничего не менялось, в базу не ходит"""
+        if not (self._stale or self._dirty_telegram_ids or self._dirty_escort_ids):
+            return
+        async with self._lock:
+            if self._stale:
+                await self._load()
+            elif self._dirty_telegram_ids or self._dirty_escort_ids:
+                await self._refresh_marked()
+
+    async def _load(self):
+        self._stale = False
+        self._dirty_telegram_ids.clear()
+        self._dirty_escort_ids.clear()
+        try:
+            async with db_pool.read() as conn:
+                cursor = await conn.execute(SQL_LEADERBOARD)
+                rows = await cursor.fetchall()
+        except aiosqlite.Error:
+            self._stale = True
+            raise
+        self._users, self._user_keys, self._ids = {}, [], {}
+        self._squads, self._squad_keys = {}, []
+        for escort_id, telegram_id, username, squad_id, squad_name, total_rating, rating_count, completed_orders in rows:
+            entry = LeaderboardEntry(escort_id, telegram_id, username, squad_id,
+                                     total_rating / rating_count, rating_count, completed_orders)
+            self._users[telegram_id] = entry
+            self._ids[escort_id] = telegram_id
+            self._user_keys.append((-entry.rating, telegram_id))
+            if squad_id is not None:
+                self._squad_join(entry, squad_name, rekey=False)
+        self._user_keys.sort()
+        for squad in self._squads.values():
+            squad.key = (-squad.rating, squad.squad_id)
+            self._squad_keys.append(squad.key)
+        self._squad_keys.sort()
+        self.loads += 1
+        logger.info(f"Рейтинг загружен: пользователей {len(self._users)}, сквадов {len(self._squads)}")
+
+    async def _refresh_marked(self):
+        telegram_ids, self._dirty_telegram_ids = self._dirty_telegram_ids, set()
+        escort_ids, self._dirty_escort_ids = self._dirty_escort_ids, set()
+        # id уже известных пользователей переводим в telegram_id, остальные ищем по escorts.id
+        unknown_ids = set()
+        for escort_id in escort_ids:
+            telegram_id = self._ids.get(escort_id)
+            if telegram_id is None:
+                unknown_ids.add(escort_id)
+            else:
+                telegram_ids.add(telegram_id)
+        rows = []
+        try:
+            async with db_pool.read() as conn:
+                for column, keys in (("e.telegram_id", list(telegram_ids)), ("e.id", list(unknown_ids))):
+                    for i in range(0, len(keys), LEADERBOARD_REFRESH_CHUNK):
+                        chunk = keys[i:i + LEADERBOARD_REFRESH_CHUNK]
+                        sql = SQL_LEADERBOARD_ROWS.format(column=column, marks=", ".join("?" * len(chunk)))
+                        cursor = await conn.execute(sql, chunk)
+                        rows.extend(await cursor.fetchall())
+        except aiosqlite.Error:
+            self._dirty_telegram_ids |= telegram_ids
+            self._dirty_escort_ids |= unknown_ids
+            raise
+        found = set()
+        for row in rows:
+            found.add(row[1])
+            self._upsert(row)
+        # Строки, которых больше нет в escorts
+        for telegram_id in telegram_ids - found:
+            self._remove(telegram_id)
+        self.refreshed_rows += len(rows)
+
+    def _upsert(self, row):
+        escort_id, telegram_id, username, squad_id, squad_name, total_rating, rating_count, completed_orders = row
+        self._remove(telegram_id)
+        if not rating_count:
+            return
+        entry = LeaderboardEntry(escort_id, telegram_id, username, squad_id,
+                                 total_rating / rating_count, rating_count, completed_orders)
+        self._users[telegram_id] = entry
+        self._ids[escort_id] = telegram_id
+        insort(self._user_keys, (-entry.rating, telegram_id))
+        if squad_id is not None:
+            self._squad_join(entry, squad_name)
+
+    def _remove(self, telegram_id: int):
+        entry = self._users.pop(telegram_id, None)
+        if entry is None:
+            return
+        self._ids.pop(entry.escort_id, None)
+        self._discard(self._user_keys, (-entry.rating, telegram_id))
+        squad = self._squads.get(entry.squad_id)
+        if squad is not None:
+            squad.members.discard(telegram_id)
+            squad.rating_sum -= entry.rating
+            squad.completed_orders -= entry.completed_orders
+            self._rekey_squad(squad)
+
+    def _squad_join(self, entry: LeaderboardEntry, squad_name, rekey: bool = True):
+        squad = self._squads.get(entry.squad_id)
+        if squad is None:
+            squad = self._squads[entry.squad_id] = LeaderboardSquad(entry.squad_id, squad_name)
+        elif squad_name is not None:
+            squad.name = squad_name
+        squad.members.add(entry.telegram_id)
+        squad.rating_sum += entry.rating
+        squad.completed_orders += entry.completed_orders
+        if rekey:
+            self._rekey_squad(squad)
+
+    def _rekey_squad(self, squad: LeaderboardSquad):
+        if squad.key is not None:
+            self._discard(self._squad_keys, squad.key)
+            squad.key = None
+        if not squad.members:
+            del self._squads[squad.squad_id]
+            return
+        squad.key = (-squad.rating, squad.squad_id)
+        insort(self._squad_keys, squad.key)
+
+    @staticmethod
+    def _discard(keys: list, key):
+        i = bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            del keys[i]
+
+    def rename_squad(self, squad_id: int, name: str):
+        squad = self._squads.get(squad_id)
+        if squad is not None:
+            squad.name = name
+
+    def top_users(self, limit: int = LEADERBOARD_TOP):
+        return [self._users[telegram_id] for _, telegram_id in self._user_keys[:limit]]
+
+    def top_squads(self, limit: int = LEADERBOARD_TOP):
+        return [self._squads[squad_id] for _, squad_id in self._squad_keys[:limit]]
+
+    def user_position(self, telegram_id: int):
+        """(позиция с 1, запись) или (None, None), если у пользователя нет оценок"""
+        entry = self._users.get(telegram_id)
+        if entry is None:
+            return None, None
+        return bisect_left(self._user_keys, (-entry.rating, telegram_id)) + 1, entry
+
+    def squad_position(self, squad_id):
+        """(позиция с 1, сквад) или (None, None), если в скваде нет оцененных участников"""
+        squad = self._squads.get(squad_id)
+        if squad is None:
+            return None, None
+        return bisect_left(self._squad_keys, squad.key) + 1, squad
+
+    def stats(self) -> str:
+        return (f"рейтинг: пользователей {len(self._users)}, сквадов {len(self._squads)}, "
+                f"полных загрузок {self.loads}, перечитано строк {self.refreshed_rows}")
+
+leaderboard = Leaderboard()
+escort_cache.listeners.append(leaderboard.mark)
 
 async def get_user_rating_position(user_id: int):
     """Получает позицию пользователя в рейтинге"""
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
-            # Получаем рейтинг пользователя
-            cursor = await conn.execute(
-                "SELECT total_rating, rating_count FROM escorts WHERE telegram_id = ?",
-                (user_id,)
-            )
-            user_data = await cursor.fetchone()
-            if not user_data or user_data[1] == 0:
-                return None, 0.0
-
-            user_rating = user_data[0] / user_data[1]
-
-            # Получаем все рейтинги для подсчета позиции
-            cursor = await conn.execute(
-                '''
-                SELECT telegram_id, total_rating, rating_count
-                FROM escorts
-                WHERE rating_count > 0
-                ORDER BY (total_rating / rating_count) DESC
-                '''
-            )
-            ratings = await cursor.fetchall()
-
-            position = 1
-            for telegram_id, total_rating, rating_count in ratings:
-                if telegram_id == user_id:
-                    return position, user_rating
-                position += 1
-
-            return None, user_rating
+        await leaderboard.refresh()
+        position, entry = leaderboard.user_position(user_id)
+        if entry is None:
+            return None, 0.0
+        return position, entry.rating
     except aiosqlite.Error as e:
         logger.error(f"Ошибка получения позиции рейтинга для {user_id}: {e}")
         return None, 0.0
@@ -804,68 +2214,332 @@ async def get_user_rating_position(user_id: int):
 async def get_squad_rating_position(user_id: int):
     """Получает позицию сквада пользователя в рейтинге"""
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
-            # Получаем сквад пользователя
-            cursor = await conn.execute(
-                "SELECT squad_id FROM escorts WHERE telegram_id = ?",
-                (user_id,)
-            )
-            user_data = await cursor.fetchone()
-            if not user_data or not user_data[0]:
-                return None, None, 0.0
+        escort = await get_escort_fields(user_id, "squad_id")
+        if not escort or not escort.squad_id:
+            return None, None, 0.0
 
-            squad_id = user_data[0]
-
-            # Получаем название сквада
-            cursor = await conn.execute(
-                "SELECT name FROM squads WHERE id = ?",
-                (squad_id,)
-            )
-            squad_name_result = await cursor.fetchone()
-            squad_name = squad_name_result[0] if squad_name_result else "Unknown"
-
-            # Вычисляем средний рейтинг сквада
-            cursor = await conn.execute(
-                '''
-                SELECT AVG(total_rating / rating_count) as avg_rating
-                FROM escorts
-                WHERE squad_id = ? AND rating_count > 0
-                ''', (squad_id,)
-            )
-            squad_rating_result = await cursor.fetchone()
-            squad_rating = squad_rating_result[0] if squad_rating_result and squad_rating_result[0] else 0.0
-
-            # Получаем все рейтинги сквадов
-            cursor = await conn.execute(
-                '''
-                SELECT s.id, s.name, AVG(e.total_rating / e.rating_count) as avg_rating
-                FROM squads s
-                JOIN escorts e ON s.id = e.squad_id
-                WHERE e.rating_count > 0
-                GROUP BY s.id
-                HAVING COUNT(e.id) > 0
-                ORDER BY avg_rating DESC
-                '''
-            )
-            squad_ratings = await cursor.fetchall()
-
-            position = 1
-            for sid, sname, rating in squad_ratings:
-                if sid == squad_id:
-                    return position, squad_name, squad_rating
-                position += 1
-
-            return None, squad_name, squad_rating
+        await leaderboard.refresh()
+        position, squad = leaderboard.squad_position(escort.squad_id)
+        if squad is None:
+            return None, None, 0.0
+        return position, squad.name, squad.rating
     except aiosqlite.Error as e:
         logger.error(f"Ошибка получения позиции сквада для {user_id}: {e}")
         return None, None, 0.0
 
+# --- Доска заказов ---
+# Ожидающие заказы вместе с числом заявок по сквадам собираются одним запросом
+# и держатся в памяти до первой записи в orders/order_applications.
+
+PENDING_BOARD_TTL = 60  # страховка на случай записи в обход invalidate()
+
+class PendingOrder:
+    __slots__ = ("id", "memo_order_id", "customer_info", "amount", "created_at", "applications")
+
+    def __init__(self, order_id, memo_order_id, customer_info, amount, created_at):
+        self.id = order_id
+        self.memo_order_id = memo_order_id
+        self.customer_info = customer_info
+        self.amount = amount
+        self.created_at = created_at
+        self.applications = {}  # squad_id -> число заявок
+
+class PendingOrderBoard:
+    """Кэш ожидающих заказов; сбрасывается обработчиками, меняющими заказы и заявки"""
+
+    def __init__(self, ttl: int = PENDING_BOARD_TTL):
+        self.ttl = ttl
+        self.generation = 0
+        self.hits = 0
+        self.loads = 0
+        self._orders = None
+        self._expires = 0.0
+
+    def invalidate(self):
+        self.generation += 1
+        self._orders = None
+
+    async def get(self):
+        """Список PendingOrder, новые сверху"""
+        if self._orders is not None and self._expires > time.monotonic():
+            self.hits += 1
+            return self._orders
+        generation = self.generation
+        async with db_pool.read() as conn:
+            cursor = await conn.execute(SQL_PENDING_BOARD)
+            rows = await cursor.fetchall()
+        orders = []
+        for order_id, memo_order_id, customer_info, amount, created_at, squad_id, app_count in rows:
+            if not orders or orders[-1].id != order_id:
+                orders.append(PendingOrder(order_id, memo_order_id, customer_info, amount, created_at))
+            if squad_id is not None:
+                orders[-1].applications[squad_id] = app_count
+        self.loads += 1
+        # Доска, загруженная до сброса, уже устарела
+        if generation == self.generation:
+            self._orders = orders
+            self._expires = time.monotonic() + self.ttl
+        return orders
+
+    def stats(self) -> str:
+        return f"доска заказов: {len(self._orders or ())} заказов, попаданий {self.hits}, загрузок {self.loads}"
+
+pending_board = PendingOrderBoard()
+
+# --- Состояния заказа ---
+# pending -> in_progress -> completed, отмена возвращает in_progress -> pending.
+# Каждый переход - один условный запрос: условия проверяются в самом UPDATE/INSERT,
+# а результат - по числу измененных строк, поэтому два одновременных нажатия
+# не могут оба пройти проверку, прочитанную заранее.
+ORDER_MIN_PARTICIPANTS = 2
+ORDER_MAX_PARTICIPANTS = 4
+ORDER_COMMISSION_RATE = 0.2
+ORDER_TRANSITIONS = {
+    ("pending", "in_progress"),
+    ("in_progress", "completed"),
+    ("in_progress", "pending"),
+}
+
+# Итоги попытки присоединиться к набору
+JOIN_OK = "joined"
+JOIN_ALREADY = "already"
+JOIN_FULL = "full"
+JOIN_OTHER_SQUAD = "other_squad"
+JOIN_NOT_PENDING = "not_pending"
+
+# Причины, по которым заказ не удалось начать
+START_NOT_FOUND = "not_found"
+START_NOT_PENDING = "not_pending"
+START_TOO_FEW = "too_few"
+START_TOO_MANY = "too_many"
+
+SQL_ORDER_JOIN = f'''
+    INSERT INTO order_applications (order_id, escort_id, squad_id, pubg_id)
+    SELECT ?1, ?2, ?3, ?4
+    WHERE EXISTS (SELECT 1 FROM orders WHERE id = ?1 AND status = 'pending')
+      AND NOT EXISTS (SELECT 1 FROM order_applications WHERE order_id = ?1 AND (escort_id = ?2 OR squad_id != ?3))
+      AND (SELECT COUNT(*) FROM order_applications WHERE order_id = ?1) < {ORDER_MAX_PARTICIPANTS}
+'''
+
+async def begin_immediate(conn):
+    """Открывает транзакцию с блокировкой записи сразу, а не при первом изменении"""
+    if not conn.in_transaction:
+        await conn.execute("BEGIN IMMEDIATE")
+
+async def transition_order(conn, order_db_id: int, source: str, target: str, assignments: str = "", params: tuple = (),
+                           guard: str = "", guard_params: tuple = ()) -> bool:
+    """Переводит заказ из source в target, если он все еще в source и выполнено guard
+
+    assignments - дополнительные поля вида ", squad_id = ?"; guard - условия вида " AND ...".
+    Коммит - за вызывающим.
+    """
+    if (source, target) not in ORDER_TRANSITIONS:
+        raise ValueError(f"Недопустимый переход заказа: {source} -> {target}")
+    cursor = await conn.execute(
+        f"UPDATE orders SET status = ?{assignments} WHERE id = ? AND status = ?{guard}",
+        (target,) + tuple(params) + (order_db_id, source) + tuple(guard_params)
+    )
+    return cursor.rowcount == 1
+
+async def order_join(order_db_id: int, escort_id: int, squad_id: int, pubg_id: str) -> str:
+    """Заявка в набор: заказ ожидает, набирает его тот же сквад и мест меньше максимума"""
+    if await write_queue.submit(SQL_ORDER_JOIN, (order_db_id, escort_id, squad_id, pubg_id)):
+        return JOIN_OK
+    # Заявка не прошла - выясняем причину для ответа пользователю
+    async with db_pool.read() as conn:
+        cursor = await conn.execute(
+            '''
+            SELECT o.status,
+                   SUM(oa.escort_id = ?), SUM(oa.squad_id != ?), COUNT(oa.escort_id)
+            FROM orders o
+            LEFT JOIN order_applications oa ON oa.order_id = o.id
+            WHERE o.id = ?
+            ''', (escort_id, squad_id, order_db_id)
+        )
+        status, own, other_squads, total = await cursor.fetchone()
+    if status != 'pending':
+        return JOIN_NOT_PENDING
+    if own:
+        return JOIN_ALREADY
+    if other_squads:
+        return JOIN_OTHER_SQUAD
+    return JOIN_FULL
+
+async def order_leave(order_db_id: int, escort_id: int) -> bool:
+    """Выход из набора, пока заказ не начат"""
+    deleted = await write_queue.submit(
+        '''
+        DELETE FROM order_applications
+        WHERE order_id = ? AND escort_id = ?
+          AND EXISTS (SELECT 1 FROM orders WHERE id = ? AND status = 'pending')
+        ''', (order_db_id, escort_id, order_db_id)
+    )
+    return bool(deleted)
+
+async def order_start(conn, order_db_id: int, squad_id: int):
+    """Начинает заказ силами сквада: переход и перенос заявок в участники одной транзакцией
+
+    Вызывается внутри блока писателя, коммит - за вызывающим. Возвращает
+    (memo_order_id, участники, название сквада), участники - (telegram_id, username,
+    pubg_id, reachable); None - переход не прошел, причину дает order_start_refusal.
+    """
+    await begin_immediate(conn)
+    started = await transition_order(
+        conn, order_db_id, 'pending', 'in_progress',
+        ", squad_id = ?, commission_amount = amount * ?", (squad_id, ORDER_COMMISSION_RATE),
+        " AND (SELECT COUNT(*) FROM order_applications WHERE order_id = ? AND squad_id = ?) BETWEEN ? AND ?",
+        (order_db_id, squad_id, ORDER_MIN_PARTICIPANTS, ORDER_MAX_PARTICIPANTS)
+    )
+    if not started:
+        return None
+    await conn.execute(
+        '''
+        INSERT INTO order_escorts (order_id, escort_id, pubg_id)
+        SELECT oa.order_id, oa.escort_id, e.pubg_id
+        FROM order_applications oa
+        JOIN escorts e ON oa.escort_id = e.id
+        WHERE oa.order_id = ? AND oa.squad_id = ?
+        ''', (order_db_id, squad_id)
+    )
+    await conn.execute("DELETE FROM order_applications WHERE order_id = ?", (order_db_id,))
+    cursor = await conn.execute(
+        '''
+        SELECT e.telegram_id, e.username, oe.pubg_id, e.reachable
+        FROM order_escorts oe
+        JOIN escorts e ON oe.escort_id = e.id
+        WHERE oe.order_id = ?
+        ''', (order_db_id,)
+    )
+    participants = await cursor.fetchall()
+    cursor = await conn.execute(
+        "SELECT o.memo_order_id, s.name FROM orders o LEFT JOIN squads s ON s.id = o.squad_id WHERE o.id = ?",
+        (order_db_id,)
+    )
+    memo_order_id, squad_name = await cursor.fetchone()
+    return memo_order_id, participants, squad_name or "Unknown"
+
+async def order_complete(conn, order_db_id: int):
+    """Завершает заказ и начисляет участникам выплату за вычетом комиссии одной транзакцией
+
+    Вызывается внутри блока писателя, коммит - за вызывающим. Возвращает
+    (выплата на участника, escort_id участников); None - заказ уже не в работе.
+    """
+    await begin_immediate(conn)
+    cursor = await conn.execute(
+        '''
+        SELECT o.amount, COUNT(oe.escort_id)
+        FROM orders o
+        JOIN order_escorts oe ON oe.order_id = o.id
+        WHERE o.id = ? AND o.status = 'in_progress'
+        GROUP BY o.id
+        ''', (order_db_id,)
+    )
+    order = await cursor.fetchone()
+    if order is None:
+        return None
+    amount, participant_count = order
+    payout_per_participant = (amount - amount * ORDER_COMMISSION_RATE) / participant_count
+    if not await transition_order(conn, order_db_id, 'in_progress', 'completed', ", completed_at = ?", (datetime.now().isoformat(),)):
+        return None
+    await conn.execute(
+        '''
+        UPDATE escorts SET
+            completed_orders = completed_orders + 1,
+            reputation = reputation + 200,
+            balance = balance + ?
+        WHERE id IN (
+            SELECT escort_id FROM order_escorts WHERE order_id = ?
+        )
+        ''', (payout_per_participant, order_db_id)
+    )
+    cursor = await conn.execute("SELECT escort_id FROM order_escorts WHERE order_id = ?", (order_db_id,))
+    return payout_per_participant, [row[0] for row in await cursor.fetchall()]
+
+async def order_start_refusal(order_db_id: int, squad_id: int):
+    """Почему order_start не прошел: (причина, memo_order_id) для ответа пользователю"""
+    async with db_pool.read() as conn:
+        cursor = await conn.execute(
+            '''
+            SELECT o.memo_order_id, o.status,
+                   (SELECT COUNT(*) FROM order_applications WHERE order_id = o.id AND squad_id = ?)
+            FROM orders o WHERE o.id = ?
+            ''', (squad_id, order_db_id)
+        )
+        order = await cursor.fetchone()
+    if order is None:
+        return START_NOT_FOUND, None
+    memo_order_id, status, applications = order
+    if status != 'pending':
+        return START_NOT_PENDING, memo_order_id
+    if applications < ORDER_MIN_PARTICIPANTS:
+        return START_TOO_FEW, memo_order_id
+    return START_TOO_MANY, memo_order_id
+
+# --- Постраничный просмотр ---
+
+class KeysetPager:
+    """Страницы списка, упорядоченного по (created_at, id) от новых к старым.
+
+    fetch(direction, key, limit) возвращает строки за ключом key: для PAGE_NEXT -
+    более старые от новых к старым, для PAGE_PREV - более новые от старых к новым.
+    Первые два поля строки - created_at и id.
+    """
+
+    def __init__(self, name: str, page_size: int = ORDERS_PAGE_SIZE):
+        self.page_size = page_size
+        self.prefix = f"page_{name}_"
+
+    def parse(self, data: str):
+        """callback_data кнопки -> (direction, key)"""
+        direction, row_id, created_at = data[len(self.prefix):].split("_", 2)
+        return direction, (created_at, int(row_id))
+
+    def _button(self, text: str, direction: str, row):
+        return InlineKeyboardButton(text=text, callback_data=f"{self.prefix}{direction}_{row[1]}_{row[0]}")
+
+    async def page(self, fetch, direction: str = PAGE_NEXT, key=None):
+        """(строки страницы от новых к старым, ряд кнопок навигации или None)"""
+        if key is None:
+            direction, key = PAGE_NEXT, PAGE_START
+        rows = list(await fetch(direction, key, self.page_size + 1))
+        more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if direction == PAGE_PREV:
+            rows.reverse()
+            has_newer, has_older = more, True
+        else:
+            has_newer, has_older = key != PAGE_START, more
+        nav = []
+        if rows and has_newer:
+            nav.append(self._button("« назад", PAGE_PREV, rows[0]))
+        if rows and has_older:
+            nav.append(self._button("далее »", PAGE_NEXT, rows[-1]))
+        return rows, nav or None
+
+def keyset_slice(rows, direction: str, key, limit: int):
+    """fetch для списка в памяти, уже отсортированного от новых к старым"""
+    if direction == PAGE_PREV:
+        return [row for row in rows if (row[0], row[1]) > key][-limit:][::-1]
+    return [row for row in rows if (row[0], row[1]) < key][:limit]
+
+pending_pager = KeysetPager("pending")
+my_orders_pager = KeysetPager("my")
+squad_orders_pager = KeysetPager("squad")
+
 # --- Клавиатуры ---
+# Клавиатуры неизменяемы: каждый вариант собирается один раз и переиспользуется
+# из кэша, чтобы не строить модели aiogram заново на каждое сообщение.
+# Возвращённые объекты нельзя изменять.
+KEYBOARD_CACHE_SIZE = 1024  # для inline-клавиатур с id заказа
+
 async def get_menu_keyboard(user_id: int):
     # Проверяем, состоит ли пользователь в скваде
-    escort = await get_escort(user_id)
-    has_squad = escort and escort[1] is not None  # squad_id
-    
+    escort = await get_escort_fields(user_id, "squad_id")
+    has_squad = bool(escort and escort.squad_id is not None)
+    return _build_menu_keyboard(has_squad, has_squad and is_leader(user_id), is_admin(user_id))
+
+@lru_cache(maxsize=None)
+def _build_menu_keyboard(has_squad: bool, is_leader: bool, is_admin: bool):
     if not has_squad:
         # Для пользователей без сквада - только кнопки для поиска команды
         base_keyboard = [
@@ -875,7 +2549,7 @@ async def get_menu_keyboard(user_id: int):
         ]
         
         # Добавляем админ-панель для админов
-        if is_admin(user_id):
+        if is_admin:
             base_keyboard.append([KeyboardButton(text="админ-панель")])
     else:
         # Обычное меню для пользователей со сквадом (без кнопки информация)
@@ -887,11 +2561,11 @@ async def get_menu_keyboard(user_id: int):
         ]
 
         # Добавляем кнопки лидера если пользователь является лидером
-        if await is_leader(user_id):
+        if is_leader:
             base_keyboard.append([KeyboardButton(text="управление участниками"), KeyboardButton(text="управление сквадом")])
 
         # Добавляем админ-панель для админов
-        if is_admin(user_id):
+        if is_admin:
             base_keyboard.append([KeyboardButton(text="админ-панель")])
         
         # Добавляем кнопку выплаты в конец для всех
@@ -904,6 +2578,7 @@ async def get_menu_keyboard(user_id: int):
     )
     return keyboard
 
+@lru_cache(maxsize=None)
 def get_admin_keyboard():
     keyboard = ReplyKeyboardMarkup(
         keyboard=[
@@ -918,6 +2593,7 @@ def get_admin_keyboard():
     )
     return keyboard
 
+@lru_cache(maxsize=None)
 def get_orders_submenu_keyboard():
     keyboard = ReplyKeyboardMarkup(
         keyboard=[
@@ -930,6 +2606,7 @@ def get_orders_submenu_keyboard():
     )
     return keyboard
 
+@lru_cache(maxsize=None)
 def get_squads_submenu_keyboard():
     keyboard = ReplyKeyboardMarkup(
         keyboard=[
@@ -942,6 +2619,7 @@ def get_squads_submenu_keyboard():
     )
     return keyboard
 
+@lru_cache(maxsize=None)
 def get_escorts_submenu_keyboard():
     keyboard = ReplyKeyboardMarkup(
         keyboard=[
@@ -954,6 +2632,7 @@ def get_escorts_submenu_keyboard():
     )
     return keyboard
 
+@lru_cache(maxsize=None)
 def get_bans_submenu_keyboard():
     keyboard = ReplyKeyboardMarkup(
         keyboard=[
@@ -967,6 +2646,7 @@ def get_bans_submenu_keyboard():
     )
     return keyboard
 
+@lru_cache(maxsize=None)
 def get_balances_submenu_keyboard():
     keyboard = ReplyKeyboardMarkup(
         keyboard=[
@@ -980,6 +2660,7 @@ def get_balances_submenu_keyboard():
     return keyboard
 
 
+@lru_cache(maxsize=None)
 def get_admin_orders_submenu_keyboard():
     keyboard = ReplyKeyboardMarkup(
         keyboard=[
@@ -992,6 +2673,7 @@ def get_admin_orders_submenu_keyboard():
     )
     return keyboard
 
+@lru_cache(maxsize=None)
 def get_users_submenu_keyboard():
     keyboard = ReplyKeyboardMarkup(
         keyboard=[
@@ -1004,6 +2686,7 @@ def get_users_submenu_keyboard():
     )
     return keyboard
 
+@lru_cache(maxsize=None)
 def get_reputation_submenu_keyboard():
     keyboard = ReplyKeyboardMarkup(
         keyboard=[
@@ -1017,6 +2700,7 @@ def get_reputation_submenu_keyboard():
 
 
 
+@lru_cache(maxsize=None)
 def get_rules_keyboard():
     keyboard = ReplyKeyboardMarkup(
         keyboard=[
@@ -1030,6 +2714,7 @@ def get_rules_keyboard():
     )
     return keyboard
 
+@lru_cache(maxsize=None)
 def get_cancel_keyboard(is_admin: bool = False):
     return ReplyKeyboardMarkup(
         keyboard=[[KeyboardButton(text="отмена")]],
@@ -1037,6 +2722,7 @@ def get_cancel_keyboard(is_admin: bool = False):
         one_time_keyboard=True
     )
 
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
 def get_order_keyboard(order_id: int):
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="присоединиться", callback_data=f"join_order_{order_id}")],
@@ -1044,6 +2730,7 @@ def get_order_keyboard(order_id: int):
     ])
     return keyboard
 
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
 def get_confirmed_order_keyboard(order_id: str, is_admin: bool = False):
     buttons = [[InlineKeyboardButton(text="завершить заказ", callback_data=f"complete_order_{order_id}")]]
 
@@ -1058,6 +2745,7 @@ def get_confirmed_order_keyboard_user(order_id: str):
     # Для обычных пользователей - никаких кнопок после старта заказа
     return None
 
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
 def get_rating_keyboard(order_id: str):
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [
@@ -1073,6 +2761,7 @@ def get_rating_keyboard(order_id: str):
     return keyboard
 
 # --- Новые клавиатуры для управления лидерами ---
+@lru_cache(maxsize=None)
 def get_leaders_submenu_keyboard():
     keyboard = ReplyKeyboardMarkup(
         keyboard=[
@@ -1086,6 +2775,7 @@ def get_leaders_submenu_keyboard():
     )
     return keyboard
 
+@lru_cache(maxsize=None)
 def get_squad_management_keyboard():
     keyboard = ReplyKeyboardMarkup(
         keyboard=[
@@ -1099,6 +2789,7 @@ def get_squad_management_keyboard():
     )
     return keyboard
 
+@lru_cache(maxsize=None)
 def get_members_management_keyboard():
     keyboard = ReplyKeyboardMarkup(
         keyboard=[
@@ -1112,6 +2803,7 @@ def get_members_management_keyboard():
     )
     return keyboard
 
+@lru_cache(maxsize=None)
 def get_communication_submenu_keyboard():
     keyboard = ReplyKeyboardMarkup(
         keyboard=[
@@ -1124,6 +2816,7 @@ def get_communication_submenu_keyboard():
     )
     return keyboard
 
+@lru_cache(maxsize=None)
 def get_personal_cabinet_keyboard():
     keyboard = ReplyKeyboardMarkup(
         keyboard=[
@@ -1154,32 +2847,26 @@ async def check_access(message: types.Message, initial_start: bool = False):
                 await message.answer(MESSAGES["error"], reply_markup=ReplyKeyboardRemove())
                 return False
         
-        # Проверяем корректность данных escort
-        if len(escort) < 13:
-            logger.error(f"Некорректная структура данных escort для пользователя {user_id}: {escort}")
-            await message.answer(MESSAGES["error"], reply_markup=ReplyKeyboardRemove())
-            return False
-            
-        if escort[9]:  # is_banned
+        if escort.is_banned:
             await message.answer(MESSAGES["user_banned"], reply_markup=ReplyKeyboardRemove())
             return False
-        if escort[10]:  # ban_until
+        if escort.ban_until:
             try:
-                if datetime.fromisoformat(escort[10]) > datetime.now():
-                    formatted_date = datetime.fromisoformat(escort[10]).strftime("%d.%m.%Y %H:%M")
+                if datetime.fromisoformat(escort.ban_until) > datetime.now():
+                    formatted_date = datetime.fromisoformat(escort.ban_until).strftime("%d.%m.%Y %H:%M")
                     await message.answer(MESSAGES["user_banned"].format(date=formatted_date), reply_markup=ReplyKeyboardRemove())
                     return False
             except (ValueError, TypeError):
-                logger.warning(f"Некорректная дата ban_until для пользователя {user_id}: {escort[10]}")
-        if escort[11]:  # restrict_until
+                logger.warning(f"Некорректная дата ban_until для пользователя {user_id}: {escort.ban_until}")
+        if escort.restrict_until:
             try:
-                if datetime.fromisoformat(escort[11]) > datetime.now():
-                    formatted_date = datetime.fromisoformat(escort[11]).strftime("%d.%m.%Y %H:%M")
+                if datetime.fromisoformat(escort.restrict_until) > datetime.now():
+                    formatted_date = datetime.fromisoformat(escort.restrict_until).strftime("%d.%m.%Y %H:%M")
                     await message.answer(MESSAGES["user_restricted"].format(date=formatted_date), reply_markup=ReplyKeyboardRemove())
                     return False
             except (ValueError, TypeError):
-                logger.warning(f"Некорректная дата restrict_until для пользователя {user_id}: {escort[11]}")
-        if not escort[12] and initial_start:  # rules_accepted
+                logger.warning(f"Некорректная дата restrict_until для пользователя {user_id}: {escort.restrict_until}")
+        if not escort.rules_accepted and initial_start:
             await message.answer(MESSAGES["rules_not_accepted"], reply_markup=get_rules_keyboard())
             return False
         
@@ -1214,6 +2901,7 @@ async def cmd_start(message: types.Message):
     try:
         if not await check_access(message, initial_start=True):
             return
+        await mark_reachable(user_id)
         user_context[user_id] = 'main_menu'
         await message.answer(f"{MESSAGES['welcome']}\n\n Выберите действие:", reply_markup=await get_menu_keyboard(user_id))
         logger.info(f"Пользователь {user_id} (@{username}) запустил бота")
@@ -1229,13 +2917,50 @@ async def cmd_ping(message: types.Message):
         logger.error(f"Ошибка Telegram API в cmd_ping для {message.from_user.id}: \n{e}\n{traceback.format_exc()}")
         await message.answer(MESSAGES["error"], reply_markup=await get_menu_keyboard(message.from_user.id))
 
+@dp.message(Command("explain"))
+async def cmd_explain(message: types.Message):
+    user_id = message.from_user.id
+    if not is_admin(user_id):
+        await message.answer(MESSAGES["no_access"], reply_markup=await get_menu_keyboard(user_id))
+        return
+    try:
+        async with db_pool.read() as conn:
+            report = await explain_queries(conn)
+        # В чат отправляем только проблемные планы, полный отчет - в CLI
+        await message.answer(format_index_report(report, verbose=False)[:4000], parse_mode=None)
+    except aiosqlite.Error as e:
+        logger.error(f"Ошибка в cmd_explain для {user_id}: {e}\n\n{traceback.format_exc()}")
+        await message.answer(MESSAGES["error"])
+    except TelegramAPIError as e:
+        logger.error(f"Ошибка Telegram API в cmd_explain для {user_id}: {e}\n\n{traceback.format_exc()}")
+
+@dp.message(Command("cache"))
+async def cmd_cache(message: types.Message):
+    user_id = message.from_user.id
+    if not is_admin(user_id):
+        await message.answer(MESSAGES["no_access"], reply_markup=await get_menu_keyboard(user_id))
+        return
+    try:
+        await message.answer(
+            f"Кэш {escort_cache.stats()}\nКэш {subscription_cache.stats()}\nКэш {leaderboard.stats()}\nКэш {pending_board.stats()}\n\n"
+            f"Outbox: {outbox.stats()}\n{await admin_delivery_report()}"
+            + f"\n\n{update_lanes.stats()}"
+            + (f"\n{webhook_server.stats()}" if BOT_MODE == "webhook" else ""),
+            parse_mode=None
+        )
+    except aiosqlite.Error as e:
+        logger.error(f"Ошибка базы данных в cmd_cache для {user_id}: {e}\n\n{traceback.format_exc()}")
+    except TelegramAPIError as e:
+        logger.error(f"Ошибка Telegram API в cmd_cache для {user_id}: {e}\n\n{traceback.format_exc()}")
+
 @dp.message(F.text == "принять условия")
 async def accept_rules(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.acquire() as conn:
             await conn.execute("UPDATE escorts SET rules_accepted = 1 WHERE telegram_id = ?", (user_id,))
             await conn.commit()
+            escort_cache.invalidate(user_id)
             
             # Проверяем, нужна ли регистрация
             cursor = await conn.execute("SELECT username, pubg_id FROM escorts WHERE telegram_id = ?", (user_id,))
@@ -1295,12 +3020,13 @@ async def process_registration_pubg_id(message: types.Message, state: FSMContext
         username = data.get('username')
         
         # Обновляем данные пользователя
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.acquire() as conn:
             await conn.execute(
                 "UPDATE escorts SET username = ?, pubg_id = ? WHERE telegram_id = ?",
                 (username, pubg_id if pubg_id != "-" else None, user_id)
             )
             await conn.commit()
+            escort_cache.invalidate(user_id)
         
         user_context[user_id] = 'main_menu'
         await message.answer(
@@ -1418,9 +3144,11 @@ async def my_profile(message: types.Message):
         if not escort:
             await message.answer("\n Профиль не найден.", reply_markup=await get_menu_keyboard(user_id))
             return
-        escort_id, squad_id, pubg_id, balance, reputation, completed_orders, username, rating, rating_count, _, ban_until, restrict_until, _ = escort
+        squad_id, pubg_id = escort.squad_id, escort.pubg_id
+        balance, completed_orders = escort.balance, escort.completed_orders
+        username, rating, rating_count = escort.username, escort.rating, escort.rating_count
         
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute("SELECT name FROM squads WHERE id = ?", (squad_id,))
             squad = await cursor.fetchone()
             
@@ -1460,12 +3188,12 @@ async def my_balance(message: types.Message):
         return
     user_id = message.from_user.id
     try:
-        escort = await get_escort(user_id)
+        escort = await get_escort_fields(user_id, "balance")
         if not escort:
             await message.answer("Профиль не найден.", reply_markup=get_personal_cabinet_keyboard())
             return
         
-        _, _, _, balance, _, _, username, _, _, _, _, _, _ = escort
+        balance = escort.balance
         
         if balance > 0:
             response = f"Ваш баланс: {balance:.2f} руб."
@@ -1486,28 +3214,19 @@ async def my_rating(message: types.Message):
         return
     user_id = message.from_user.id
     try:
-        escort = await get_escort(user_id)
+        escort = await get_escort_fields(user_id, "completed_orders", "username")
         if not escort:
             await message.answer("Профиль не найден.", reply_markup=get_personal_cabinet_keyboard())
             return
         
-        escort_id, _, _, _, _, completed_orders, username, _, _, _, _, _, _ = escort
-        
-        # Получаем рейтинг в звездах
-        async with aiosqlite.connect(DB_PATH) as conn:
-            cursor = await conn.execute(
-                "SELECT total_rating, rating_count FROM escorts WHERE telegram_id = ?",
-                (user_id,)
-            )
-            rating_data = await cursor.fetchone()
+        completed_orders, username = escort.completed_orders, escort.username
         
+        # Рейтинг в звездах и позиция - из таблицы лидеров
+        user_position, user_rating_value = await get_user_rating_position(user_id)
         stars_rating = "Нет оценок"
-        if rating_data and rating_data[1] > 0:
-            star_rating = rating_data[0] / rating_data[1]
-            stars_rating = f"★ {star_rating:.2f} / 5.00"
+        if user_position:
+            stars_rating = f"★ {user_rating_value:.2f} / 5.00"
         
-        # Получаем позицию в рейтинге
-        user_position, user_rating_value = await get_user_rating_position(user_id)
         position_text = f"Позиция в рейтинге: {user_position}" if user_position else "Позиция: не определена"
         
         response = (
@@ -1539,6 +3258,42 @@ async def orders_menu(message: types.Message):
         logger.error(f"Ошибка Telegram API в orders_menu для {user_id}: {e}\n\n{traceback.format_exc()}")
         await message.answer(MESSAGES["error"], reply_markup=await get_menu_keyboard(user_id))
 
+async def build_available_orders_page(squad_id, direction: str = PAGE_NEXT, key=None):
+    """Страница доступных заказов: (текст, клавиатура) или (None, None), если заказов нет"""
+    # Все заказы со статусом pending вместе с заявками сквадов
+    all_orders = await pending_board.get()
+    if squad_id:
+        # Для пользователей со сквадом - свободные заказы и заказы, которые набирает наш сквад
+        all_orders = [order for order in all_orders if not order.applications or squad_id in order.applications]
+    rows = [(order.created_at or "", order.id, order) for order in all_orders]
+
+    async def fetch(direction, key, limit):
+        return keyset_slice(rows, direction, key, limit)
+
+    page, nav = await pending_pager.page(fetch, direction, key)
+    if not page:
+        return None, None
+
+    keyboard_buttons = []
+    for _, _, order in page:
+        button_text = f"#{order.memo_order_id} - {order.customer_info} ({order.amount:.0f}₽)"
+        if not squad_id:
+            # Добавляем callback_data, но обработчик будет показывать сообщение о необходимости сквада
+            keyboard_buttons.append([InlineKeyboardButton(text=button_text, callback_data=f"no_squad_order_{order.id}")])
+            continue
+        app_count = order.applications.get(squad_id, 0)
+        if app_count > 0:
+            button_text += f" {app_count}"
+        keyboard_buttons.append([InlineKeyboardButton(text=button_text, callback_data=f"select_order_{order.id}")])
+    if nav:
+        keyboard_buttons.append(nav)
+
+    if not squad_id:
+        text = "Доступные заказы:\n\nДля участия в заказах необходимо состоять в скваде!"
+    else:
+        text = "Доступные заказы\n\nВыберите заказ:"
+    return text, InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
+
 @dp.message(F.text == "доступные заказы")
 async def available_orders(message: types.Message):
     if not await check_access(message):
@@ -1546,84 +3301,18 @@ async def available_orders(message: types.Message):
     user_id = message.from_user.id
     try:
         # Получаем информацию о пользователе и его скваде
-        escort = await get_escort(user_id)
+        escort = await get_escort_fields(user_id, "squad_id")
         if not escort:
             await message.answer("Ваш профиль не найден.", reply_markup=get_orders_submenu_keyboard())
             return
 
-        escort_id, squad_id, pubg_id, _, _, _, _, _, _, _, _, _, _ = escort
-
-        # Получаем все заказы со статусом pending
-        async with aiosqlite.connect(DB_PATH) as conn:
-            cursor = await conn.execute(
-                '''
-                SELECT o.id, o.memo_order_id, o.customer_info, o.amount, o.created_at
-                FROM orders o
-                WHERE o.status = 'pending'
-                ORDER BY o.created_at DESC
-                '''
-            )
-            all_orders = await cursor.fetchall()
-
-        if not all_orders:
-            await message.answer("Заказы отсутствуют", reply_markup=get_orders_submenu_keyboard())
-            return
-
-        if not squad_id:
-            # Для пользователей без сквада показываем инлайн кнопки, но без возможности присоединения
-            keyboard_buttons = []
-            for order_id, memo_order_id, customer_info, amount, created_at in all_orders:
-                button_text = f"#{memo_order_id} - {customer_info} ({amount:.0f}₽)"
-                # Добавляем callback_data, но обработчик будет показывать сообщение о необходимости сквада
-                keyboard_buttons.append([InlineKeyboardButton(text=button_text, callback_data=f"no_squad_order_{order_id}")])
-            
-            keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
-            await message.answer("Доступные заказы:\n\nДля участия в заказах необходимо состоять в скваде!", reply_markup=keyboard)
-            return
-
-        # Для пользователей со сквадом - фильтруем заказы и создаем клавиатуру
-        available_orders_list = []
-        for order_id, memo_order_id, customer_info, amount, created_at in all_orders:
-            # Проверяем, есть ли уже заявки на этот заказ
-            async with aiosqlite.connect(DB_PATH) as conn:
-                cursor = await conn.execute(
-                    "SELECT squad_id, COUNT(*) FROM order_applications WHERE order_id = ? GROUP BY squad_id",
-                    (order_id,)
-                )
-                applications = await cursor.fetchall()
-
-            # Если заявок нет, или есть заявки от нашего сквада - показываем заказ
-            if not applications:
-                # Свободный заказ
-                available_orders_list.append((order_id, memo_order_id, customer_info, amount, 0, None))
-            else:
-                # Проверяем, есть ли заявки от нашего сквада
-                for app_squad_id, app_count in applications:
-                    if app_squad_id == squad_id:
-                        available_orders_list.append((order_id, memo_order_id, customer_info, amount, app_count, squad_id))
-                        break
+        squad_id = escort.squad_id
 
-        if not available_orders_list:
+        text, keyboard = await build_available_orders_page(squad_id)
+        if not text:
             await message.answer("Заказы отсутствуют", reply_markup=get_orders_submenu_keyboard())
             return
-
-        # Создаем инлайн клавиатуру с заказами
-        keyboard_buttons = []
-        for db_id, order_id, customer, amount, app_count, recruiting_squad in available_orders_list:
-            button_text = f"#{order_id} - {customer} ({amount:.0f}₽)"
-            if app_count > 0 and recruiting_squad == squad_id:
-                button_text += f" {app_count}"
-            keyboard_buttons.append([InlineKeyboardButton(text=button_text, callback_data=f"select_order_{db_id}")])
-
-        keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
-
-        # Получаем название сквада
-        async with aiosqlite.connect(DB_PATH) as conn:
-            cursor = await conn.execute("SELECT name FROM squads WHERE id = ?", (squad_id,))
-            squad_result = await cursor.fetchone()
-            squad_name = squad_result[0] if squad_result else "Unknown"
-
-        await message.answer("Доступные заказы\n\nВыберите заказ:", reply_markup=keyboard)
+        await message.answer(text, reply_markup=keyboard)
 
     except aiosqlite.Error as e:
         logger.error(f"Ошибка базы данных в available_orders для {user_id}: {e}\n\n{traceback.format_exc()}")
@@ -1632,40 +3321,39 @@ async def available_orders(message: types.Message):
         logger.error(f"Ошибка Telegram API в available_orders для {user_id}: {e}\n\n{traceback.format_exc()}")
         await message.answer(MESSAGES["error"], reply_markup=get_orders_submenu_keyboard())
 
+async def build_my_orders_page(escort_id: int, direction: str = PAGE_NEXT, key=None):
+    """Страница заказов пользователя: (текст, inline-клавиатура навигации или None)"""
+    async def fetch(direction, key, limit):
+        async with db_pool.read() as conn:
+            # Заказы из order_escorts (принятые заказы) и order_applications (заявки)
+            cursor = await conn.execute(SQL_MY_ORDERS[direction], (escort_id, escort_id) + key + (limit,))
+            return await cursor.fetchall()
+
+    orders, nav = await my_orders_pager.page(fetch, direction, key)
+    if not orders:
+        return None, None
+    response = "\n Ваши заказы:\n"
+    for _, _, order_id, customer, amount, status in orders:
+        status_text = "Ожидает" if status == "pending" else "В процессе" if status == "in_progress" else "Завершен"
+        response += f"#{order_id} - {customer}, {amount:.2f} руб., Статус: {status_text}\n"
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[nav]) if nav else None
+    return response, keyboard
+
 @dp.message(F.text == "мои заказы")
 async def my_orders(message: types.Message):
     if not await check_access(message):
         return
     user_id = message.from_user.id
     try:
-        escort = await get_escort(user_id)
+        escort = await get_escort_fields(user_id, "id")
         if not escort:
             await message.answer("\n Ваш профиль не найден.", reply_markup=await get_menu_keyboard(user_id))
             return
-        escort_id = escort[0]
-        async with aiosqlite.connect(DB_PATH) as conn:
-            # Получаем заказы из order_escorts (принятые заказы) и order_applications (заявки)
-            cursor = await conn.execute(
-                '''
-                SELECT DISTINCT o.memo_order_id, o.customer_info, o.amount, o.status
-                FROM orders o
-                WHERE o.id IN (
-                    SELECT order_id FROM order_escorts WHERE escort_id = ?
-                    UNION
-                    SELECT order_id FROM order_applications WHERE escort_id = ?
-                )
-                ORDER BY o.created_at DESC
-                ''', (escort_id, escort_id)
-            )
-            orders = await cursor.fetchall()
-        if not orders:
+        response, keyboard = await build_my_orders_page(escort.id)
+        if not response:
             await message.answer(MESSAGES["no_active_orders"], reply_markup=await get_menu_keyboard(user_id))
             return
-        response = "\n Ваши заказы:\n"
-        for order_id, customer, amount, status in orders:
-            status_text = "Ожидает" if status == "pending" else "В процессе" if status == "in_progress" else "Завершен"
-            response += f"#{order_id} - {customer}, {amount:.2f} руб., Статус: {status_text}\n"
-        await message.answer(response, reply_markup=await get_menu_keyboard(user_id))
+        await message.answer(response, reply_markup=keyboard or await get_menu_keyboard(user_id))
     except aiosqlite.Error as e:
         logger.error(f"Ошибка базы данных в my_orders для {user_id}: {e}\n\n{traceback.format_exc()}")
         await message.answer(MESSAGES["error"], reply_markup=await get_menu_keyboard(user_id))
@@ -1673,19 +3361,40 @@ async def my_orders(message: types.Message):
         logger.error(f"Ошибка Telegram API в my_orders для {user_id}: {e}\n\n{traceback.format_exc()}")
         await message.answer(MESSAGES["error"], reply_markup=await get_menu_keyboard(user_id))
 
+@dp.callback_query(F.data.startswith(my_orders_pager.prefix))
+async def my_orders_page(callback: types.CallbackQuery):
+    user_id = callback.from_user.id
+    try:
+        direction, key = my_orders_pager.parse(callback.data)
+        escort = await get_escort_fields(user_id, "id")
+        if not escort:
+            await callback.answer("Ваш профиль не найден.", show_alert=True)
+            return
+        response, keyboard = await build_my_orders_page(escort.id, direction, key)
+        if not response:
+            # Список изменился - возвращаемся к первой странице
+            response, keyboard = await build_my_orders_page(escort.id)
+        await callback.message.edit_text(response or MESSAGES["no_active_orders"], reply_markup=keyboard)
+        await callback.answer()
+    except (ValueError, aiosqlite.Error) as e:
+        logger.error(f"Ошибка в my_orders_page для {user_id}: {e}\n\n{traceback.format_exc()}")
+        await callback.answer(MESSAGES["error"], show_alert=True)
+    except TelegramAPIError as e:
+        logger.error(f"Ошибка Telegram API в my_orders_page для {user_id}: {e}\n\n{traceback.format_exc()}")
+        await callback.answer()
+
 @dp.message(F.text == "завершить заказ")
 async def complete_order(message: types.Message, state: FSMContext):
     if not await check_access(message):
         return
     user_id = message.from_user.id
     try:
-        escort = await get_escort(user_id)
+        escort = await get_escort_fields(user_id, "id")
         if not escort:
             await message.answer("\n Ваш профиль не найден.", reply_markup=await get_menu_keyboard(user_id))
             await state.clear()
             return
-        escort_id = escort[0]
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             # Показываем заказы в процессе, где пользователь является участником
             cursor = await conn.execute(
                 '''
@@ -1725,17 +3434,17 @@ async def process_complete_order(message: types.Message, state: FSMContext):
         return
     order_id = message.text.strip()
     try:
-        escort = await get_escort(user_id)
+        escort = await get_escort_fields(user_id, "pubg_id", "username")
         if not escort:
             await message.answer("\n Ваш профиль не найден.", reply_markup=await get_menu_keyboard(user_id))
             await state.clear()
             return
-        escort_id, _, pubg_id, _, _, _, username, _, _, _, _, _, _ = escort
-        async with aiosqlite.connect(DB_PATH) as conn:
+        pubg_id, username = escort.pubg_id, escort.username
+        async with db_pool.read() as conn:
             # Исправленный запрос с проверкой принадлежности заказа пользователю
             cursor = await conn.execute(
                 """
-                SELECT o.id, o.status, o.amount
+                SELECT o.id, (SELECT COUNT(*) FROM order_escorts WHERE order_id = o.id)
                 FROM orders o
                 JOIN order_escorts oe ON o.id = oe.order_id
                 JOIN escorts e ON oe.escort_id = e.id
@@ -1746,57 +3455,37 @@ async def process_complete_order(message: types.Message, state: FSMContext):
                 (order_id, user_id)
             )
             order = await cursor.fetchone()
-            if not order:
-                await message.answer(f"\n Заказ #{order_id} не найден или не в процессе.", reply_markup=await get_menu_keyboard(user_id))
-                await state.clear()
-                return
-            order_db_id, _, order_amount = order
-
-            # Проверяем количество участников в заказе
-            cursor = await conn.execute(
-                "SELECT COUNT(*) FROM order_escorts WHERE order_id = ?",
-                (order_db_id,)
-            )
-            participant_count = (await cursor.fetchone())[0]
-
-            # Проверяем, достаточно ли участников (минимум 2)
-            if participant_count < 2:
-                await message.answer(f"\n Недостаточно сопровождающих для завершения заказа (требуется минимум 2, есть {participant_count}).", reply_markup=await get_menu_keyboard(user_id))
-                await state.clear()
-                return
-
-            # Рассчитываем выплату с учетом 20% комиссии
-            commission = order_amount * 0.2
-            payout_per_participant = (order_amount - commission) / participant_count
+        if not order:
+            await message.answer(f"\n Заказ #{order_id} не найден или не в процессе.", reply_markup=await get_menu_keyboard(user_id))
+            await state.clear()
+            return
+        order_db_id, participant_count = order
 
-            await conn.execute(
-                '''
-                UPDATE orders SET status = 'completed', completed_at = ? WHERE id = ?
-                ''', (datetime.now().isoformat(), order_db_id)
-            )
+        # Проверяем, достаточно ли участников (минимум 2); пока заказ в работе, состав не меняется
+        if participant_count < ORDER_MIN_PARTICIPANTS:
+            await message.answer(f"\n Недостаточно сопровождающих для завершения заказа (требуется минимум {ORDER_MIN_PARTICIPANTS}, есть {participant_count}).", reply_markup=await get_menu_keyboard(user_id))
+            await state.clear()
+            return
 
-            # Начисляем баланс участникам (80% от суммы заказа, разделенные поровну)
-            await conn.execute(
-                '''
-                UPDATE escorts SET
-                    completed_orders = completed_orders + 1,
-                    reputation = reputation + 200,
-                    balance = balance + ?
-                WHERE id IN (
-                    SELECT escort_id FROM order_escorts WHERE order_id = ?
-                )
-                ''', (payout_per_participant, order_db_id)
-            )
-            await conn.commit()
+        # Начисляем баланс участникам (80% от суммы заказа, разделенные поровну)
+        async with db_pool.acquire() as conn:
+            completed = await order_complete(conn, order_db_id)
+            if completed is not None:
+                fanout = OrderFanout(order_db_id)
+                fanout.add(FANOUT_ADMIN, f"заказ {order_id} завершен\nюзер - {user_id} - {pubg_id or 'не указан'}")
+                await fanout.enqueue(conn)
+                await conn.commit()
+        if completed is None:
+            await message.answer(f"\n Заказ #{order_id} не найден или не в процессе.", reply_markup=await get_menu_keyboard(user_id))
+            await state.clear()
+            return
+        payout_per_participant, participant_ids = completed
+        escort_cache.invalidate_ids(participant_ids)
         await message.answer(
             f"заказ {order_id} завершен\n"
             f"юзер - {user_id} - {pubg_id or 'не указан'}",
             reply_markup=await get_menu_keyboard(user_id)
         )
-        await notify_admins(
-            f"заказ {order_id} завершен\n"
-            f"юзер - {user_id} - {pubg_id or 'не указан'}"
-        )
         await log_action(
             "complete_order",
             user_id,
@@ -1820,10 +3509,8 @@ async def admin_rate_orders(message: types.Message):
         await message.answer(MESSAGES["no_access"], reply_markup=await get_menu_keyboard(user_id))
         return
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
-            cursor = await conn.execute(
-                "SELECT memo_order_id, customer_info, amount FROM orders WHERE status = 'completed' AND rating = 0"
-            )
+        async with db_pool.read() as conn:
+            cursor = await conn.execute(SQL_UNRATED_ORDERS)
             orders = await cursor.fetchall()
 
         if not orders:
@@ -1867,19 +3554,20 @@ async def admin_rate_order_callback(callback: types.CallbackQuery):
         memo_order_id = parts[2]
         rating = int(parts[3])
 
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute(
                 "SELECT id, squad_id FROM orders WHERE memo_order_id = ? AND status = 'completed'",
                 (memo_order_id,)
             )
             order = await cursor.fetchone()
-            if not order:
-                await callback.message.edit_text(" Заказ не найден или не завершён.")
-                await callback.answer()
-                return
+        if not order:
+            await callback.message.edit_text(" Заказ не найден или не завершён.")
+            await callback.answer()
+            return
 
-            order_db_id, squad_id = order
+        order_db_id, squad_id = order
 
+        async with db_pool.acquire() as conn:
             # Обновляем рейтинг заказа
             await conn.execute(
                 "UPDATE orders SET rating = ? WHERE id = ?",
@@ -1903,9 +3591,10 @@ async def admin_rate_order_callback(callback: types.CallbackQuery):
 
             # Обновляем рейтинг сквада
             if squad_id:
-                await update_squad_reputation(squad_id, rating)
+                await update_squad_reputation(conn, squad_id, rating)
 
             await conn.commit()
+            escort_cache.invalidate_ids([escort_id for (escort_id,) in escorts])
 
         await callback.message.edit_text(
             f" Заказ #{memo_order_id} оценён на {rating}звезд\n"
@@ -1931,12 +3620,12 @@ async def request_payout(message: types.Message, state: FSMContext):
         return
     user_id = message.from_user.id
     try:
-        escort = await get_escort(user_id)
+        escort = await get_escort_fields(user_id, "balance")
         if not escort:
             await message.answer("\n Ваш профиль не найден.", reply_markup=await get_menu_keyboard(user_id))
             await state.clear()
             return
-        escort_id, _, _, balance, _, _, username, _, _, _, _, _, _ = escort
+        balance = escort.balance
 
         if balance <= 0:
             await message.answer("❗ У вас нет средств для вывода", reply_markup=await get_menu_keyboard(user_id))
@@ -1969,13 +3658,13 @@ async def select_payout_method(callback: types.CallbackQuery, state: FSMContext)
     try:
         payout_method = callback.data.split("_")[-1]  # "uc" или "card"
         
-        escort = await get_escort(user_id)
+        escort = await get_escort_fields(user_id, "balance")
         if not escort:
             await callback.message.answer("Ваш профиль не найден.", reply_markup=await get_menu_keyboard(user_id))
             await callback.answer()
             return
         
-        balance = escort[3]
+        balance = escort.balance
         
         # Сохраняем выбранный способ вывода
         await state.update_data(payout_method=payout_method)
@@ -2010,12 +3699,12 @@ async def process_payout_request(message: types.Message, state: FSMContext):
             await message.answer("\n Сумма должна быть больше 0", reply_markup=get_cancel_keyboard())
             return
 
-        escort = await get_escort(user_id)
+        escort = await get_escort_fields(user_id, "balance", "username")
         if not escort:
             await message.answer("\n Ваш профиль не найден.", reply_markup=await get_menu_keyboard(user_id))
             await state.clear()
             return
-        escort_id, _, _, balance, _, _, username, _, _, _, _, _, _ = escort
+        balance, username = escort.balance, escort.username
 
         if payout_amount > balance:
             await message.answer(f"\n Недостаточно средств на балансе. Доступно: {balance:.2f} руб.", reply_markup=get_cancel_keyboard())
@@ -2071,17 +3760,40 @@ async def no_squad_order_callback(callback: types.CallbackQuery):
     except TelegramAPIError as e:
         logger.error(f"Ошибка в no_squad_order_callback для {user_id}: {e}")
 
+@dp.callback_query(F.data.startswith(pending_pager.prefix))
+async def available_orders_page(callback: types.CallbackQuery):
+    user_id = callback.from_user.id
+    try:
+        direction, key = pending_pager.parse(callback.data)
+        escort = await get_escort_fields(user_id, "squad_id")
+        squad_id = escort.squad_id if escort else None
+        text, keyboard = await build_available_orders_page(squad_id, direction, key)
+        if not text:
+            # Список изменился - возвращаемся к первой странице
+            text, keyboard = await build_available_orders_page(squad_id)
+        if not text:
+            await callback.message.edit_text("Заказы отсутствуют", reply_markup=None)
+        else:
+            await callback.message.edit_text(text, reply_markup=keyboard)
+        await callback.answer()
+    except (ValueError, aiosqlite.Error) as e:
+        logger.error(f"Ошибка в available_orders_page для {user_id}: {e}\n\n{traceback.format_exc()}")
+        await callback.answer(MESSAGES["error"], show_alert=True)
+    except TelegramAPIError as e:
+        logger.error(f"Ошибка Telegram API в available_orders_page для {user_id}: {e}\n\n{traceback.format_exc()}")
+        await callback.answer()
+
 @dp.callback_query(F.data.startswith("select_order_"))
 async def select_order(callback: types.CallbackQuery):
     user_id = callback.from_user.id
     try:
         order_db_id = int(callback.data.split("_")[-1])
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute("SELECT memo_order_id, customer_info, amount FROM orders WHERE id = ?", (order_db_id,))
             order = await cursor.fetchone()
-            if not order:
-                await callback.answer(" Заказ не найден.")
-                return
+        if not order:
+            await callback.answer(" Заказ не найден.")
+            return
         
         memo_order_id, customer_info, amount = order
         
@@ -2105,12 +3817,12 @@ async def select_order(callback: types.CallbackQuery):
 async def join_recruit(callback: types.CallbackQuery):
     user_id = callback.from_user.id
     try:
-        escort = await get_escort(user_id)
+        escort = await get_escort_fields(user_id, "id", "squad_id", "pubg_id")
         if not escort:
             await callback.message.answer("Ваш профиль не найден.", reply_markup=await get_menu_keyboard(user_id))
             await callback.answer()
             return
-        escort_id, squad_id, pubg_id, _, _, _, _, _, _, _, _, _, _ = escort
+        escort_id, squad_id, pubg_id = escort.id, escort.squad_id, escort.pubg_id
         if not pubg_id:
             await callback.message.answer(" Укажите PUBG ID!", reply_markup=await get_menu_keyboard(user_id))
             await callback.answer()
@@ -2121,56 +3833,35 @@ async def join_recruit(callback: types.CallbackQuery):
             return
         
         order_db_id = int(callback.data.split("_")[-1])
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute(
                 "SELECT status, memo_order_id FROM orders WHERE id = ?", (order_db_id,)
             )
             order = await cursor.fetchone()
-            if not order or order[0] != 'pending':
-                await callback.message.answer(MESSAGES["order_already_in_progress"].format(order_id=order[1]), reply_markup=await get_menu_keyboard(user_id))
-                await callback.answer()
-                return
-
-            memo_order_id = order[1]
-
-            # Проверяем, набирается ли заказ другим сквадом
-            cursor = await conn.execute(
-                "SELECT squad_id FROM order_applications WHERE order_id = ? LIMIT 1", (order_db_id,)
-            )
-            existing_squad = await cursor.fetchone()
-            if existing_squad and existing_squad[0] != squad_id:
-                await callback.message.answer(" Этот заказ уже набирается другим сквадом!", reply_markup=await get_menu_keyboard(user_id))
-                await callback.answer()
-                return
-
-            # Проверяем, не присоединился ли пользователь уже
-            cursor = await conn.execute(
-                "SELECT COUNT(*) FROM order_applications WHERE order_id = ? AND escort_id = ?",
-                (order_db_id, escort_id)
-            )
-            if (await cursor.fetchone())[0] > 0:
-                # Показываем меню участников
-                await show_order_participants_menu(callback.message, order_db_id, memo_order_id)
-                await callback.answer()
-                return
-
-            # Проверяем максимальное количество участников
-            cursor = await conn.execute(
-                "SELECT COUNT(*) FROM order_applications WHERE order_id = ? AND squad_id = ?",
-                (order_db_id, squad_id)
-            )
-            participant_count = (await cursor.fetchone())[0]
-            
-            if participant_count >= 4:
-                await callback.answer(" Достигнуто максимальное количество участников (4)!", show_alert=True)
-                return
+        if not order:
+            await callback.answer(" Заказ не найден.")
+            return
+        memo_order_id = order[1]
 
-            # Добавляем пользователя к заказу
-            await conn.execute(
-                "INSERT INTO order_applications (order_id, escort_id, squad_id, pubg_id) VALUES (?, ?, ?, ?)",
-                (order_db_id, escort_id, squad_id, pubg_id)
-            )
-            await conn.commit()
+        # Все проверки набора выполняются в самой вставке заявки
+        result = await order_join(order_db_id, escort_id, squad_id, pubg_id)
+        if result == JOIN_NOT_PENDING:
+            await callback.message.answer(MESSAGES["order_already_in_progress"].format(order_id=memo_order_id), reply_markup=await get_menu_keyboard(user_id))
+            await callback.answer()
+            return
+        if result == JOIN_OTHER_SQUAD:
+            await callback.message.answer(" Этот заказ уже набирается другим сквадом!", reply_markup=await get_menu_keyboard(user_id))
+            await callback.answer()
+            return
+        if result == JOIN_ALREADY:
+            # Показываем меню участников
+            await show_order_participants_menu(callback.message, order_db_id, memo_order_id)
+            await callback.answer()
+            return
+        if result == JOIN_FULL:
+            await callback.answer(f" Достигнуто максимальное количество участников ({ORDER_MAX_PARTICIPANTS})!", show_alert=True)
+            return
+        pending_board.invalidate()
         
         # Отображаем динамическое меню участников
         await show_order_participants_menu(callback.message, order_db_id, memo_order_id)
@@ -2190,12 +3881,12 @@ async def join_order(callback: types.CallbackQuery):
     """Обработчик для кнопки присоединиться в меню участников"""
     user_id = callback.from_user.id
     try:
-        escort = await get_escort(user_id)
+        escort = await get_escort_fields(user_id, "id", "squad_id", "pubg_id")
         if not escort:
             await callback.message.answer("Ваш профиль не найден.", reply_markup=await get_menu_keyboard(user_id))
             await callback.answer()
             return
-        escort_id, squad_id, pubg_id, _, _, _, _, _, _, _, _, _, _ = escort
+        escort_id, squad_id, pubg_id = escort.id, escort.squad_id, escort.pubg_id
         if not pubg_id:
             await callback.message.answer(" Укажите PUBG ID!", reply_markup=await get_menu_keyboard(user_id))
             await callback.answer()
@@ -2206,44 +3897,32 @@ async def join_order(callback: types.CallbackQuery):
             return
         
         order_db_id = int(callback.data.split("_")[-1])
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute(
                 "SELECT status, memo_order_id FROM orders WHERE id = ?", (order_db_id,)
             )
             order = await cursor.fetchone()
-            if not order or order[0] != 'pending':
-                await callback.message.answer(MESSAGES["order_already_in_progress"].format(order_id=order[1]), reply_markup=await get_menu_keyboard(user_id))
-                await callback.answer()
-                return
-
-            memo_order_id = order[1]
-
-            # Проверяем, не присоединился ли пользователь уже
-            cursor = await conn.execute(
-                "SELECT COUNT(*) FROM order_applications WHERE order_id = ? AND escort_id = ?",
-                (order_db_id, escort_id)
-            )
-            if (await cursor.fetchone())[0] > 0:
-                await callback.answer(" Вы уже присоединились к этому заказу!")
-                return
-
-            # Проверяем максимальное количество участников
-            cursor = await conn.execute(
-                "SELECT COUNT(*) FROM order_applications WHERE order_id = ? AND squad_id = ?",
-                (order_db_id, squad_id)
-            )
-            participant_count = (await cursor.fetchone())[0]
-            
-            if participant_count >= 4:
-                await callback.answer(" Достигнуто максимальное количество участников (4)!", show_alert=True)
-                return
+        if not order:
+            await callback.answer(" Заказ не найден.")
+            return
+        memo_order_id = order[1]
 
-            # Добавляем пользователя к заказу
-            await conn.execute(
-                "INSERT INTO order_applications (order_id, escort_id, squad_id, pubg_id) VALUES (?, ?, ?, ?)",
-                (order_db_id, escort_id, squad_id, pubg_id)
-            )
-            await conn.commit()
+        # Добавляем пользователя к заказу; все условия набора проверяются в самой вставке
+        result = await order_join(order_db_id, escort_id, squad_id, pubg_id)
+        if result == JOIN_NOT_PENDING:
+            await callback.message.answer(MESSAGES["order_already_in_progress"].format(order_id=memo_order_id), reply_markup=await get_menu_keyboard(user_id))
+            await callback.answer()
+            return
+        if result == JOIN_ALREADY:
+            await callback.answer(" Вы уже присоединились к этому заказу!")
+            return
+        if result == JOIN_OTHER_SQUAD:
+            await callback.answer(" Этот заказ уже набирается другим сквадом!", show_alert=True)
+            return
+        if result == JOIN_FULL:
+            await callback.answer(f" Достигнуто максимальное количество участников ({ORDER_MAX_PARTICIPANTS})!", show_alert=True)
+            return
+        pending_board.invalidate()
         
         # Обновляем динамическое меню участников
         await show_order_participants_menu(callback.message, order_db_id, memo_order_id)
@@ -2262,95 +3941,61 @@ async def join_order(callback: types.CallbackQuery):
 async def start_order(callback: types.CallbackQuery):
     user_id = callback.from_user.id
     try:
-        escort = await get_escort(user_id)
-        if not escort or not escort[1]:
+        escort = await get_escort_fields(user_id, "squad_id")
+        if not escort or not escort.squad_id:
             await callback.message.answer(MESSAGES["not_in_squad"], reply_markup=await get_menu_keyboard(user_id))
             await callback.answer()
             return
-        escort_id, squad_id, pubg_id, _, _, _, _, _, _, _, _, _, _ = escort
+        # Всех участников берем только из сквада пользователя
+        winning_squad_id = escort.squad_id
         order_db_id = int(callback.data.split("_")[-1])
-        async with aiosqlite.connect(DB_PATH) as conn:
-            cursor = await conn.execute(
-                "SELECT memo_order_id, status, amount FROM orders WHERE id = ?",
-                (order_db_id,)
-            )
-            order = await cursor.fetchone()
-            if not order or order[1] != 'pending':
-                await callback.message.answer(MESSAGES["order_already_in_progress"].format(order_id=order[0]), reply_markup=await get_menu_keyboard(user_id))
-                await callback.answer()
-                return
-            # Получаем участников только из сквада пользователя
-            cursor = await conn.execute(
-                "SELECT escort_id, squad_id FROM order_applications WHERE order_id = ? AND squad_id = ?",
-                (order_db_id, squad_id)
-            )
-            squad_applications = await cursor.fetchall()
-
-            if len(squad_applications) < 2:
-                await callback.answer(" Недостаточно участников для начала выполнения заказа! Минимум: 2")
-                await show_order_participants_menu(callback.message, order_db_id, order[0])
-                return
-            
-            if len(squad_applications) > 4:
-                await callback.answer(" Слишком много участников! Максимум: 4")
-                await show_order_participants_menu(callback.message, order_db_id, order[0])
-                return
-
-            # Всех участников берем только из одного сквада
-            winning_squad_id = squad_id
-            valid_applications = squad_applications
-            commission = order[2] * 0.2
-            for escort_id, _ in valid_applications:
-                cursor = await conn.execute("SELECT pubg_id FROM escorts WHERE id = ?", (escort_id,))
-                pubg_id = (await cursor.fetchone())[0]
-                await conn.execute(
-                    "INSERT INTO order_escorts (order_id, escort_id, pubg_id) VALUES (?, ?, ?)",
-                    (order_db_id, escort_id, pubg_id)
+        async with db_pool.acquire() as conn:
+            # Все условия старта проверяются в самом переходе
+            started = await order_start(conn, order_db_id, winning_squad_id)
+            if started is not None:
+                order_id, escorts, squad_name = started
+                participants = "\n".join(
+                    f"@{username or 'Unknown'} (PUBG ID: {pubg_id}, Squad: {squad_name})"
+                    for _, username, pubg_id, _ in escorts
                 )
-                # Removed: UPDATE completed_orders +1 here
-            await conn.execute(
-                "UPDATE orders SET status = 'in_progress', squad_id = ?, commission_amount = ? WHERE id = ?",
-                (winning_squad_id, commission, order_db_id)
-            )
-            await conn.execute(
-                "DELETE FROM order_applications WHERE order_id = ?",
-                (order_db_id,)
-            )
-            await conn.commit()
-        order_id = order[0]
-        participants = "\n".join(
-            f"@{username or 'Unknown'} (PUBG ID: {pubg_id}, Squad: {squad_name or 'No squad'})"
-            for _, username, pubg_id, _, squad_name in await get_order_escorts(order_db_id)
-        )
-        async with aiosqlite.connect(DB_PATH) as conn:
-            cursor = await conn.execute("SELECT name FROM squads WHERE id = ?", (winning_squad_id,))
-            squad_result = await conn.fetchone()
-            squad_name = squad_result[0] if squad_result else "Unknown"
-        response = MESSAGES["order_taken"].format(order_id=order_id, squad_name=squad_name, participants=participants)
+                response = MESSAGES["order_taken"].format(order_id=order_id, squad_name=squad_name, participants=participants)
+
+                # Уведомления уходят вместе с коммитом перехода: участники получают одно сообщение
+                # о старте (админы среди них - с кнопками), остальной сквад - общее,
+                # остальные админы - карточку заказа, если включено ORDER_START_NOTIFY_ADMINS
+                fanout = OrderFanout(
+                    order_db_id, winning_squad_id,
+                    participants=[telegram_id for telegram_id, _, _, reachable in escorts if reachable]
+                )
+                fanout.add(
+                    FANOUT_PARTICIPANT, f"Заказ #{order_id} начат!\n{participants}",
+                    admin_reply_markup=get_confirmed_order_keyboard(order_id, is_admin=True)
+                )
+                fanout.add(FANOUT_SQUAD, response)
+                if ORDER_START_NOTIFY_ADMINS:
+                    fanout.add(FANOUT_ADMIN, response, reply_markup=get_confirmed_order_keyboard(order_id, is_admin=True))
+                await fanout.enqueue(conn)
+                await conn.commit()
+                pending_board.invalidate()
+
+        if started is None:
+            reason, memo_order_id = await order_start_refusal(order_db_id, winning_squad_id)
+            if reason == START_NOT_FOUND:
+                await callback.answer(" Заказ не найден.")
+            elif reason == START_NOT_PENDING:
+                await callback.message.answer(MESSAGES["order_already_in_progress"].format(order_id=memo_order_id), reply_markup=await get_menu_keyboard(user_id))
+                await callback.answer()
+            else:
+                if reason == START_TOO_FEW:
+                    await callback.answer(f" Недостаточно участников для начала выполнения заказа! Минимум: {ORDER_MIN_PARTICIPANTS}")
+                else:
+                    await callback.answer(f" Слишком много участников! Максимум: {ORDER_MAX_PARTICIPANTS}")
+                await show_order_participants_menu(callback.message, order_db_id, memo_order_id)
+            return
 
         # Для админа показываем кнопки управления
         keyboard = get_confirmed_order_keyboard(order_id, is_admin=is_admin(user_id))
         await callback.message.edit_text(response, reply_markup=keyboard)
-
-        # Уведомляем участников заказа (без кнопок для обычных пользователей)
-        for telegram_id, _, _, _, _ in await get_order_escorts(order_db_id):
-            try:
-                user_keyboard = get_confirmed_order_keyboard(order_id, is_admin=is_admin(telegram_id)) if is_admin(telegram_id) else None
-                await bot.send_message(
-                    telegram_id,
-                    f"Заказ #{order_id} начат!\n{participants}",
-                    reply_markup=user_keyboard
-                )
-            except TelegramAPIError as e:
-                logger.warning(f"Не удалось уведомить {telegram_id}: {e}")
-        await notify_squad(
-            winning_squad_id,
-            MESSAGES["order_taken"].format(
-                order_id=order_id,
-                squad_name=squad_name,
-                participants=participants
-            )
-        )
         await log_action("start_order", user_id, order_db_id, f"Заказ #{order_id} начат на скваде {squad_name}")
         await callback.answer()
     except (ValueError, aiosqlite.Error) as e:
@@ -2367,61 +4012,39 @@ async def complete_order_callback(callback: types.CallbackQuery):
     user_id = callback.from_user.id
     memo_order_id = callback.data.split('_')[-1]
     try:
-        escort = await get_escort(user_id)
+        escort = await get_escort_fields(user_id, "pubg_id", "username")
         if not escort:
             await callback.message.answer("\n Ваш профиль не найден.", reply_markup=await get_menu_keyboard(user_id))
             await callback.answer()
             return
-        escort_id, _, pubg_id, _, _, _, username, _, _, _, _, _, _ = escort
-        async with aiosqlite.connect(DB_PATH) as conn:
+        pubg_id, username = escort.pubg_id, escort.username
+        async with db_pool.read() as conn:
             cursor = await conn.execute(
-                "SELECT id, status, amount FROM orders WHERE memo_order_id = ? AND status = 'in_progress'",
+                "SELECT id FROM orders WHERE memo_order_id = ? AND status = 'in_progress'",
                 (memo_order_id,)
             )
             order = await cursor.fetchone()
-            if not order:
-                await callback.message.answer(f"\n Заказ #{memo_order_id} не найден или не в процессе.", reply_markup=await get_menu_keyboard(user_id))
-                await callback.answer()
-                return
-            order_db_id, _, amount = order
-
-            # Проверяем количество участников в заказе
-            cursor = await conn.execute(
-                "SELECT COUNT(*) FROM order_escorts WHERE order_id = ?",
-                (order_db_id,)
-            )
-            participant_count = (await cursor.fetchone())[0]
-
-            # Рассчитываем выплату с учетом 20% комиссии
-            commission = amount * 0.2
-            payout_per_participant = (amount - commission) / participant_count
-
-            await conn.execute(
-                '''
-                UPDATE orders SET status = 'completed', completed_at = ? WHERE id = ?
-                ''', (datetime.now().isoformat(), order_db_id)
-            )
-            await conn.execute(
-                '''
-                UPDATE escorts SET
-                    completed_orders = completed_orders + 1,
-                    reputation = reputation + 200,
-                    balance = balance + ?
-                WHERE id IN (
-                    SELECT escort_id FROM order_escorts WHERE order_id = ?
-                )
-                ''', (payout_per_participant, order_db_id)
-            )
-            await conn.commit()
+        completed = None
+        if order:
+            order_db_id = order[0]
+            async with db_pool.acquire() as conn:
+                completed = await order_complete(conn, order_db_id)
+                if completed is not None:
+                    fanout = OrderFanout(order_db_id)
+                    fanout.add(FANOUT_ADMIN, f"заказ {memo_order_id} завершен\nюзер - {user_id} - {pubg_id or 'не указан'}")
+                    await fanout.enqueue(conn)
+                    await conn.commit()
+        if completed is None:
+            await callback.message.answer(f"\n Заказ #{memo_order_id} не найден или не в процессе.", reply_markup=await get_menu_keyboard(user_id))
+            await callback.answer()
+            return
+        payout_per_participant, participant_ids = completed
+        escort_cache.invalidate_ids(participant_ids)
         await callback.message.edit_text(
             f"заказ {memo_order_id} завершен\n"
             f"юзер - {user_id} - {pubg_id or 'не указан'}",
             reply_markup=None
         )
-        await notify_admins(
-            f"заказ {memo_order_id} завершен\n"
-            f"юзер - {user_id} - {pubg_id or 'не указан'}"
-        )
         await log_action(
             "complete_order",
             user_id,
@@ -2445,62 +4068,65 @@ async def cancel_confirmed_order(callback: types.CallbackQuery):
         memo_order_id = callback.data.split("_")[-1]
 
         # Проверяем права пользователя на отмену заказа
-        escort = await get_escort(user_id)
+        escort = await get_escort_fields(user_id, "id")
         if not escort:
             await callback.message.answer("Ваш профиль не найден.", reply_markup=await get_menu_keyboard(user_id))
             await callback.answer()
             return
 
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute(
                 "SELECT id, status, squad_id FROM orders WHERE memo_order_id = ?",
                 (memo_order_id,)
             )
             order = await cursor.fetchone()
-            if not order:
-                await callback.message.answer("Заказ не найден.", reply_markup=await get_menu_keyboard(user_id))
-                await callback.answer()
-                return
-
-            order_db_id, status, squad_id = order
+            if order:
+                # Проверяем, участвует ли пользователь в заказе
+                cursor = await conn.execute(
+                    "SELECT COUNT(*) FROM order_escorts oe JOIN escorts e ON oe.escort_id = e.id WHERE oe.order_id = ? AND e.telegram_id = ?",
+                    (order[0], user_id)
+                )
+                is_participant = (await cursor.fetchone())[0] > 0
+        if not order:
+            await callback.message.answer("Заказ не найден.", reply_markup=await get_menu_keyboard(user_id))
+            await callback.answer()
+            return
 
-            if status != 'in_progress':
-                await callback.message.answer("Заказ не находится в процессе выполнения.", reply_markup=await get_menu_keyboard(user_id))
-                await callback.answer()
-                return
+        order_db_id, status, squad_id = order
 
-            # Проверяем, участвует ли пользователь в заказе или является ли админом
-            cursor = await conn.execute(
-                "SELECT COUNT(*) FROM order_escorts oe JOIN escorts e ON oe.escort_id = e.id WHERE oe.order_id = ? AND e.telegram_id = ?",
-                (order_db_id, user_id)
-            )
-            is_participant = (await cursor.fetchone())[0] > 0
+        if status != 'in_progress':
+            await callback.message.answer("Заказ не находится в процессе выполнения.", reply_markup=await get_menu_keyboard(user_id))
+            await callback.answer()
+            return
 
-            if not (is_participant or is_admin(user_id)):
-                await callback.message.answer("У вас нет прав на отмену этого заказа.", reply_markup=await get_menu_keyboard(user_id))
-                await callback.answer()
-                return
+        if not (is_participant or is_admin(user_id)):
+            await callback.message.answer("У вас нет прав на отмену этого заказа.", reply_markup=await get_menu_keyboard(user_id))
+            await callback.answer()
+            return
 
-            # Отменяем заказ
-            await conn.execute(
-                "UPDATE orders SET status = 'pending' WHERE id = ?",
-                (order_db_id,)
-            )
+        async with db_pool.acquire() as conn:
+            # Отменяем заказ; статус перепроверяется в самом переходе
+            cancelled = await transition_order(conn, order_db_id, 'in_progress', 'pending')
+            if cancelled:
+                # Удаляем участников из заказа
+                await conn.execute(
+                    "DELETE FROM order_escorts WHERE order_id = ?",
+                    (order_db_id,)
+                )
 
-            # Удаляем участников из заказа
-            await conn.execute(
-                "DELETE FROM order_escorts WHERE order_id = ?",
-                (order_db_id,)
-            )
+                # Уведомляем участников об отмене
+                if squad_id:
+                    await notify_squad(squad_id, f"Заказ #{memo_order_id} был отменен и возвращен в статус ожидания.")
 
-            await conn.commit()
+                await conn.commit()
+        if not cancelled:
+            await callback.message.answer("Заказ не находится в процессе выполнения.", reply_markup=await get_menu_keyboard(user_id))
+            await callback.answer()
+            return
+        pending_board.invalidate()
 
         await callback.message.edit_text(f"Заказ #{memo_order_id} отменен и возвращен в статус ожидания.", reply_markup=None)
 
-        # Уведомляем участников об отмене
-        if squad_id:
-            await notify_squad(squad_id, f"Заказ #{memo_order_id} был отменен и возвращен в статус ожидания.")
-
         await log_action(
             "cancel_confirmed_order",
             user_id,
@@ -2619,7 +4245,7 @@ async def users_list_handler(message: types.Message):
         await message.answer(MESSAGES["no_access"], reply_markup=await get_menu_keyboard(user_id))
         return
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute(
                 '''
                 SELECT e.telegram_id, e.username, e.pubg_id, s.name as squad_name, 
@@ -2809,29 +4435,32 @@ async def process_broadcast_message(message: types.Message, state: FSMContext):
     
     try:
         # Получаем всех пользователей
-        async with aiosqlite.connect(DB_PATH) as conn:
-            cursor = await conn.execute("SELECT telegram_id FROM escorts")
+        async with db_pool.read() as conn:
+            cursor = await conn.execute("SELECT telegram_id FROM escorts WHERE reachable = 1")
             users = await cursor.fetchall()
         
-        sent_count = 0
-        failed_count = 0
-        
-        for (telegram_id,) in users:
-            try:
-                await bot.send_message(telegram_id, broadcast_text)
-                sent_count += 1
-            except TelegramAPIError:
-                failed_count += 1
-        
-        await message.answer(
-            f"📢 Объявление отправлено!\n"
-            f" Успешно: {sent_count}\n"
-            f" Не удалось: {failed_count}",
-            reply_markup=get_communication_submenu_keyboard()
-        )
-        
-        await log_action("broadcast", user_id, None, f"Объявление отправлено {sent_count} пользователям")
         await state.clear()
+        await message.answer("📢 Объявление поставлено в рассылку.", reply_markup=get_communication_submenu_keyboard())
+        status = await message.answer(f"📢 Рассылка: 0/{len(users)}")
+        
+        async def on_progress(broadcast):
+            if broadcast.finished:
+                await status.edit_text(
+                    f"📢 Объявление отправлено!\n"
+                    f" Доставлено: {broadcast.counts[DELIVERED]}\n"
+                    f" Заблокировали бота: {broadcast.counts[BLOCKED]}\n"
+                    f" Не удалось: {broadcast.counts[FAILED]}"
+                )
+                await log_action("broadcast", user_id, None, f"Объявление: {broadcast.summary()}")
+            else:
+                await status.edit_text(
+                    f"📢 Рассылка: {broadcast.done}/{broadcast.total}\n"
+                    f" Доставлено: {broadcast.counts[DELIVERED]}, заблокировали: {broadcast.counts[BLOCKED]}, "
+                    f"ошибок: {broadcast.counts[FAILED]}"
+                )
+        
+        Broadcast(f"announcement:{message.message_id}", [telegram_id for (telegram_id,) in users],
+                  broadcast_text, on_progress=on_progress).start()
     except Exception as e:
         logger.error(f"Ошибка в process_broadcast_message для {user_id}: {e}")
         await message.answer(MESSAGES["error"], reply_markup=get_communication_submenu_keyboard())
@@ -2865,26 +4494,34 @@ async def approve_payout(callback: types.CallbackQuery):
         
         method_text = "UC" if payout_method == "uc" else "банковскую карту" if payout_method == "card" else "неизвестный способ"
 
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute("SELECT username, balance FROM escorts WHERE telegram_id = ?", (target_user_id,))
             user = await cursor.fetchone()
-            if not user:
-                await callback.message.edit_text(" Пользователь не найден.")
-                await callback.answer()
-                return
-
-            username, balance = user
-            if balance < payout_amount:
-                await callback.message.edit_text(f" Недостаточно средств на балансе. Доступно: {balance:.2f} руб.")
-                await callback.answer()
-                return
+        if not user:
+            await callback.message.edit_text(" Пользователь не найден.")
+            await callback.answer()
+            return
 
-            # Списываем деньги с баланса
-            await conn.execute(
-                "UPDATE escorts SET balance = balance - ? WHERE telegram_id = ?",
-                (payout_amount, target_user_id)
-            )
-            await conn.commit()
+        username, balance = user
+        debited = False
+        if balance >= payout_amount:
+            # Списываем деньги с баланса; достаточность перепроверяется в самом UPDATE
+            async with db_pool.acquire() as conn:
+                cursor = await conn.execute(
+                    "UPDATE escorts SET balance = balance - ? WHERE telegram_id = ? AND balance >= ?",
+                    (payout_amount, target_user_id, payout_amount)
+                )
+                debited = cursor.rowcount > 0
+                await conn.commit()
+            if not debited:
+                async with db_pool.read() as conn:
+                    cursor = await conn.execute("SELECT balance FROM escorts WHERE telegram_id = ?", (target_user_id,))
+                    balance = (await cursor.fetchone() or (0,))[0]
+        if not debited:
+            await callback.message.edit_text(f" Недостаточно средств на балансе. Доступно: {balance:.2f} руб.")
+            await callback.answer()
+            return
+        escort_cache.invalidate(target_user_id)
 
         # Уведомляем пользователя
         try:
@@ -2921,7 +4558,7 @@ async def approve_payout(callback: types.CallbackQuery):
 async def check_subscription_callback(callback: types.CallbackQuery):
     user_id = callback.from_user.id
     try:
-        if await check_subscription(user_id):
+        if await check_subscription(user_id, force=True):
             await callback.message.edit_text(" Спасибо за подписку! Теперь вы можете пользоваться ботом.")
             await callback.message.answer(f"{MESSAGES['welcome']}\n\nВыберите действие:", reply_markup=await get_menu_keyboard(user_id))
         else:
@@ -2944,15 +4581,15 @@ async def reject_payout(callback: types.CallbackQuery):
         
         method_text = "UC" if payout_method == "uc" else "банковскую карту" if payout_method == "card" else "неизвестный способ"
 
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute("SELECT username FROM escorts WHERE telegram_id = ?", (target_user_id,))
             user = await cursor.fetchone()
-            if not user:
-                await callback.message.edit_text(" Пользователь не найден.")
-                await callback.answer()
-                return
+        if not user:
+            await callback.message.edit_text(" Пользователь не найден.")
+            await callback.answer()
+            return
 
-            username = user[0]
+        username = user[0]
 
         # Уведомляем пользователя
         try:
@@ -2991,7 +4628,7 @@ async def select_leader_callback(callback: types.CallbackQuery):
     try:
         leader_telegram_id = int(callback.data.split("_")[-1])
 
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute(
                 '''
                 SELECT e.username, s.name
@@ -3180,36 +4817,43 @@ async def process_leader_user_id(message: types.Message, state: FSMContext):
             await message.answer(f" Не удалось получить информацию о пользователе с Telegram ID {leader_telegram_id}.", reply_markup=get_cancel_keyboard(True))
             return
             
-        escort_id = escort_record[0]  # ID пользователя
-        current_squad_id = escort_record[1]  # squad_id
+        escort_id = escort_record.id
+        current_squad_id = escort_record.squad_id
         
-        async with aiosqlite.connect(DB_PATH) as conn:
-            # Проверяем, не является ли пользователь уже лидером
+        # Проверяем, не является ли пользователь уже лидером
+        async with db_pool.read() as conn:
             cursor = await conn.execute("SELECT squad_id FROM squad_leaders WHERE leader_id = ?", (escort_id,))
             existing_leader = await cursor.fetchone()
-            if existing_leader:
-                await message.answer(" Этот пользователь уже является лидером.", reply_markup=get_cancel_keyboard(True))
-                return
-            
-            # Если пользователь уже в скваде, делаем его лидером этого сквада
-            if current_squad_id:
-                # Назначаем пользователя лидером его текущего сквада
-                await conn.execute("INSERT INTO squad_leaders (leader_id, squad_id) VALUES (?, ?)", (escort_id, current_squad_id))
-                await conn.commit()
-                
-                # Получаем название сквада
-                cursor = await conn.execute("SELECT name FROM squads WHERE id = ?", (current_squad_id,))
-                squad_result = await cursor.fetchone()
-                squad_name = squad_result[0] if squad_result else "Unknown"
-                
-                await message.answer(f" Пользователь {leader_telegram_id} назначен лидером сквада '{squad_name}'!", reply_markup=get_leaders_submenu_keyboard())
-                await log_action("add_leader", user_id, None, f"Назначен лидер {leader_telegram_id} для сквада '{squad_name}'")
-                await state.clear()
-            else:
-                # Если пользователь не в скваде, предлагаем создать новый
-                await state.update_data(leader_telegram_id=leader_telegram_id)
-                await message.answer("Пользователь не состоит в скваде. Введите название нового сквада:", reply_markup=get_cancel_keyboard(True))
-                await state.set_state(Form.leader_squad_name)
+        if existing_leader:
+            await message.answer(" Этот пользователь уже является лидером.", reply_markup=get_cancel_keyboard(True))
+            return
+        
+        if not current_squad_id:
+            # Если пользователь не в скваде, предлагаем создать новый
+            await state.update_data(leader_telegram_id=leader_telegram_id)
+            await message.answer("Пользователь не состоит в скваде. Введите название нового сквада:", reply_markup=get_cancel_keyboard(True))
+            await state.set_state(Form.leader_squad_name)
+            return
+        
+        # Назначаем пользователя лидером его текущего сквада; проверка повторяется в самой вставке
+        async with db_pool.acquire() as conn:
+            cursor = await conn.execute(
+                "INSERT INTO squad_leaders (leader_id, squad_id) SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM squad_leaders WHERE leader_id = ?)",
+                (escort_id, current_squad_id, escort_id)
+            )
+            inserted = cursor.rowcount
+            cursor = await conn.execute("SELECT name FROM squads WHERE id = ?", (current_squad_id,))
+            squad_result = await cursor.fetchone()
+            await conn.commit()
+        if not inserted:
+            await message.answer(" Этот пользователь уже является лидером.", reply_markup=get_cancel_keyboard(True))
+            return
+        role_index.set_leader(leader_telegram_id, current_squad_id)
+        squad_name = squad_result[0] if squad_result else "Unknown"
+        
+        await message.answer(f" Пользователь {leader_telegram_id} назначен лидером сквада '{squad_name}'!", reply_markup=get_leaders_submenu_keyboard())
+        await log_action("add_leader", user_id, None, f"Назначен лидер {leader_telegram_id} для сквада '{squad_name}'")
+        await state.clear()
                 
     except ValueError:
         await message.answer(" Неверный формат Telegram ID. Введите числовое значение:", reply_markup=get_cancel_keyboard(True))
@@ -3234,39 +4878,42 @@ async def process_leader_squad_name(message: types.Message, state: FSMContext):
         data = await state.get_data()
         leader_telegram_id = data.get('leader_telegram_id')
 
-        async with aiosqlite.connect(DB_PATH) as conn:
-            # Проверяем, существует ли пользователь
-            cursor = await conn.execute("SELECT id FROM escorts WHERE telegram_id = ?", (leader_telegram_id,))
+        async with db_pool.read() as conn:
+            # Проверяем, существует ли пользователь и не является ли он уже лидером
+            cursor = await conn.execute(
+                "SELECT id, EXISTS (SELECT 1 FROM squad_leaders WHERE leader_id = escorts.id) FROM escorts WHERE telegram_id = ?",
+                (leader_telegram_id,)
+            )
             escort_record = await cursor.fetchone()
-            if not escort_record:
-                await message.answer(f" Пользователь с Telegram ID {leader_telegram_id} не найден.", reply_markup=get_admin_keyboard())
-                await state.clear()
-                return
-            escort_id = escort_record[0]
-
-            # Проверяем, не является ли пользователь уже лидером
-            cursor = await conn.execute("SELECT squad_id FROM squad_leaders WHERE leader_id = ?", (escort_id,))
-            existing_leader = await cursor.fetchone()
-            if existing_leader:
-                await message.answer(" Этот пользователь уже является лидером.", reply_markup=get_admin_keyboard())
-                await state.clear()
-                return
-
-            # Создаем новый сквад
-            await conn.execute("INSERT INTO squads (name) VALUES (?)", (squad_name,))
-            squad_id = cursor.lastrowid
-            if squad_id is None:
-                cursor = await conn.execute("SELECT id FROM squads WHERE name = ?", (squad_name,))
-                result = await cursor.fetchone()
-                squad_id = result[0] if result else None
-
-            # Назначаем пользователя лидером
-            await conn.execute("INSERT INTO squad_leaders (leader_id, squad_id) VALUES (?, ?)", (escort_id, squad_id))
+        if not escort_record:
+            await message.answer(f" Пользователь с Telegram ID {leader_telegram_id} не найден.", reply_markup=get_admin_keyboard())
+            await state.clear()
+            return
+        escort_id, existing_leader = escort_record
 
-            # Обновляем информацию о пользователе (связываем с новым сквадом)
-            await conn.execute("UPDATE escorts SET squad_id = ? WHERE id = ?", (squad_id, escort_id))
+        appointed = False
+        if not existing_leader:
+            async with db_pool.acquire() as conn:
+                # Создаем новый сквад
+                cursor = await conn.execute("INSERT INTO squads (name) VALUES (?)", (squad_name,))
+                squad_id = cursor.lastrowid
 
-            await conn.commit()
+                # Назначаем пользователя лидером; повторное назначение отсекается в самом INSERT
+                cursor = await conn.execute(
+                    "INSERT INTO squad_leaders (leader_id, squad_id) SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM squad_leaders WHERE leader_id = ?)",
+                    (escort_id, squad_id, escort_id)
+                )
+                appointed = cursor.rowcount > 0
+                if appointed:
+                    # Обновляем информацию о пользователе (связываем с новым сквадом)
+                    await conn.execute("UPDATE escorts SET squad_id = ? WHERE id = ?", (squad_id, escort_id))
+                    await conn.commit()
+        if not appointed:
+            await message.answer(" Этот пользователь уже является лидером.", reply_markup=get_admin_keyboard())
+            await state.clear()
+            return
+        escort_cache.invalidate_ids([escort_id])
+        role_index.set_leader(leader_telegram_id, squad_id)
 
         await message.answer(f" Пользователь {leader_telegram_id} назначен лидером сквада '{squad_name}'!", reply_markup=get_admin_keyboard())
         await log_action("add_leader", user_id, None, f"Назначен лидер {leader_telegram_id} для сквада '{squad_name}'")
@@ -3290,7 +4937,7 @@ async def list_leaders(message: types.Message):
         await message.answer(MESSAGES["no_access"], reply_markup=await get_menu_keyboard(user_id))
         return
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute(
                 '''
                 SELECT e.telegram_id, e.username, s.name as squad_name
@@ -3328,7 +4975,7 @@ async def remove_leader(message: types.Message, state: FSMContext):
         await message.answer(MESSAGES["no_access"], reply_markup=await get_menu_keyboard(user_id))
         return
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute(
                 '''
                 SELECT e.id, e.telegram_id, e.username, s.name as squad_name
@@ -3385,11 +5032,11 @@ async def process_remove_leader_user_id(message: types.Message, state: FSMContex
             await message.answer(" Пользователь с таким Telegram ID не найден в списке лидеров.", reply_markup=get_cancel_keyboard(True))
             return
 
-        async with aiosqlite.connect(DB_PATH) as conn:
-            # Получаем информацию о лидере и его скваде перед удалением
+        async with db_pool.read() as conn:
+            # Получаем информацию о лидере и ID его сквада до удаления записи из squad_leaders
             cursor = await conn.execute(
                 '''
-                SELECT e.username, s.name
+                SELECT e.username, s.name, sl.squad_id
                 FROM escorts e
                 JOIN squad_leaders sl ON e.id = sl.leader_id
                 JOIN squads s ON sl.squad_id = s.id
@@ -3397,19 +5044,13 @@ async def process_remove_leader_user_id(message: types.Message, state: FSMContex
                 ''', (escort_id_to_remove,)
             )
             leader_info = await cursor.fetchone()
-            if not leader_info: # Дополнительная проверка
-                await message.answer(" Не удалось получить информацию о лидере.", reply_markup=get_leaders_submenu_keyboard())
-                await state.clear()
-                return
-            leader_username, squad_name = leader_info
-
-            # Получаем ID сквада до удаления записи из squad_leaders
-            cursor = await conn.execute("SELECT squad_id FROM squad_leaders WHERE leader_id = ?", (escort_id_to_remove,))
-            squad_id_result = await cursor.fetchone()
-            squad_id_to_delete = None
-            if squad_id_result:
-                squad_id_to_delete = squad_id_result[0]
+        if not leader_info: # Дополнительная проверка
+            await message.answer(" Не удалось получить информацию о лидере.", reply_markup=get_leaders_submenu_keyboard())
+            await state.clear()
+            return
+        leader_username, squad_name, squad_id_to_delete = leader_info
 
+        async with db_pool.acquire() as conn:
             # Удаляем запись из squad_leaders
             await conn.execute("DELETE FROM squad_leaders WHERE leader_id = ?", (escort_id_to_remove,))
 
@@ -3423,6 +5064,11 @@ async def process_remove_leader_user_id(message: types.Message, state: FSMContex
             await conn.execute("UPDATE escorts SET squad_id = NULL WHERE id = ?", (escort_id_to_remove,))
 
             await conn.commit()
+        # Сквад расформирован вместе со всеми участниками
+        escort_cache.clear()
+        role_index.remove_leader(target_telegram_id)
+        if squad_id_to_delete:
+            role_index.remove_squad(squad_id_to_delete)
 
         await message.answer(f" Лидер @{leader_username or 'Unknown'} (ID: {target_telegram_id}) удален, сквад '{squad_name}' расформирован.", reply_markup=get_leaders_submenu_keyboard())
         await log_action("remove_leader", user_id, None, f"Удален лидер {target_telegram_id} (сквад: {squad_name})")
@@ -3446,7 +5092,7 @@ async def admin_contact_leader(message: types.Message, state: FSMContext):
         await message.answer(MESSAGES["no_access"], reply_markup=await get_menu_keyboard(user_id))
         return
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute(
                 '''
                 SELECT e.telegram_id, e.username, s.name
@@ -3482,7 +5128,7 @@ async def members_management_menu(message: types.Message):
     if not await check_access(message):
         return
     user_id = message.from_user.id
-    if not await is_leader(user_id):
+    if not is_leader(user_id):
         await message.answer(" У вас нет доступа к этой функции.", reply_markup=await get_menu_keyboard(user_id))
         return
     try:
@@ -3497,7 +5143,7 @@ async def squad_management_menu(message: types.Message):
     if not await check_access(message):
         return
     user_id = message.from_user.id
-    if not await is_leader(user_id):
+    if not is_leader(user_id):
         await message.answer(" У вас нет доступа к этой функции.", reply_markup=await get_menu_keyboard(user_id))
         return
     try:
@@ -3512,7 +5158,7 @@ async def add_member_handler(message: types.Message, state: FSMContext):
     if not await check_access(message):
         return
     user_id = message.from_user.id
-    if not await is_leader(user_id):
+    if not is_leader(user_id):
         await message.answer("У вас нет доступа к этой функции.", reply_markup=await get_menu_keyboard(user_id))
         return
     try:
@@ -3543,7 +5189,7 @@ async def process_add_member_telegram_id(message: types.Message, state: FSMConte
         target_user_id = int(message.text.strip())
         
         # Проверяем, что лидер существует и имеет сквад
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute(
                 '''
                 SELECT sl.squad_id, s.name
@@ -3554,36 +5200,36 @@ async def process_add_member_telegram_id(message: types.Message, state: FSMConte
                 ''', (user_id,)
             )
             leader_squad = await cursor.fetchone()
-            if not leader_squad:
-                await message.answer("Вы не являетесь лидером сквада.", reply_markup=get_members_management_keyboard())
-                await state.clear()
-                return
-            
-            squad_id, squad_name = leader_squad
-            
-            # Проверяем текущее количество участников
-            cursor = await conn.execute("SELECT COUNT(*) FROM escorts WHERE squad_id = ?", (squad_id,))
-            current_count = (await cursor.fetchone())[0]
-            
-            if current_count >= 10:
-                await message.answer("В скваде уже максимальное количество участников (10).", reply_markup=get_cancel_keyboard())
-                return
-            
-            # Проверяем, существует ли пользователь (создаем если нет)
-            user_data = await find_or_create_user(target_user_id)
-            if not user_data:
-                await message.answer("Не удалось получить информацию о пользователе.", reply_markup=get_cancel_keyboard())
-                return
-            
-            escort_id, current_squad_id, _, _, _, _, username = user_data[:7]
-            
-            if current_squad_id == squad_id:
-                await message.answer("Пользователь уже состоит в вашем скваде.", reply_markup=get_cancel_keyboard())
-                return
-            
-            if current_squad_id:
-                await message.answer("Пользователь уже состоит в другом скваде.", reply_markup=get_cancel_keyboard())
-                return
+            if leader_squad:
+                # Проверяем текущее количество участников
+                cursor = await conn.execute("SELECT COUNT(*) FROM escorts WHERE squad_id = ?", (leader_squad[0],))
+                current_count = (await cursor.fetchone())[0]
+        if not leader_squad:
+            await message.answer("Вы не являетесь лидером сквада.", reply_markup=get_members_management_keyboard())
+            await state.clear()
+            return
+        
+        squad_id, squad_name = leader_squad
+        
+        if current_count >= 10:
+            await message.answer("В скваде уже максимальное количество участников (10).", reply_markup=get_cancel_keyboard())
+            return
+        
+        # Проверяем, существует ли пользователь (создаем если нет)
+        user_data = await find_or_create_user(target_user_id)
+        if not user_data:
+            await message.answer("Не удалось получить информацию о пользователе.", reply_markup=get_cancel_keyboard())
+            return
+        
+        escort_id, current_squad_id, username = user_data.id, user_data.squad_id, user_data.username
+        
+        if current_squad_id == squad_id:
+            await message.answer("Пользователь уже состоит в вашем скваде.", reply_markup=get_cancel_keyboard())
+            return
+        
+        if current_squad_id:
+            await message.answer("Пользователь уже состоит в другом скваде.", reply_markup=get_cancel_keyboard())
+            return
         
         # Сохраняем данные и переходим к следующему шагу
         await state.update_data(target_user_id=target_user_id, squad_id=squad_id, squad_name=squad_name, escort_id=escort_id, username=username)
@@ -3677,7 +5323,7 @@ async def process_add_member_age(message: types.Message, state: FSMContext):
         cd = data['cd']
         
         # Добавляем пользователя в сквад и сохраняем информацию
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.acquire() as conn:
             # Обновляем основную информацию пользователя
             await conn.execute(
                 "UPDATE escorts SET squad_id = ?, pubg_id = ? WHERE id = ?", 
@@ -3691,6 +5337,7 @@ async def process_add_member_age(message: types.Message, state: FSMContext):
                 (escort_id, squad_id, city, pubg_id, cd, age)
             )
             await conn.commit()
+            escort_cache.invalidate_ids([escort_id])
         
         await message.answer(f"Пользователь @{username or 'Unknown'} добавлен в сквад '{squad_name}'!", reply_markup=get_members_management_keyboard())
         await log_action("add_member", user_id, description=f"Добавлен участник {target_user_id} в сквад {squad_name}")
@@ -3712,7 +5359,7 @@ async def remove_member_handler(message: types.Message, state: FSMContext):
     if not await check_access(message):
         return
     user_id = message.from_user.id
-    if not await is_leader(user_id):
+    if not is_leader(user_id):
         await message.answer(" У вас нет доступа к этой функции.", reply_markup=await get_menu_keyboard(user_id))
         return
     try:
@@ -3734,7 +5381,7 @@ async def process_remove_member(message: types.Message, state: FSMContext):
         target_user_id = int(message.text.strip())
         
         # Получаем информацию о лидере и его сквад
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute(
                 '''
                 SELECT sl.squad_id, s.name
@@ -3745,30 +5392,33 @@ async def process_remove_member(message: types.Message, state: FSMContext):
                 ''', (user_id,)
             )
             leader_squad = await cursor.fetchone()
-            if not leader_squad:
-                await message.answer(" Вы не являетесь лидером сквада.", reply_markup=get_members_management_keyboard())
-                await state.clear()
-                return
-            
-            squad_id, squad_name = leader_squad
-            
-            # Проверяем, является ли пользователь участником сквада
-            cursor = await conn.execute("SELECT id, username FROM escorts WHERE telegram_id = ? AND squad_id = ?", (target_user_id, squad_id))
-            user_data = await cursor.fetchone()
-            if not user_data:
-                await message.answer(" Пользователь не состоит в вашем скваде.", reply_markup=get_cancel_keyboard())
-                return
-            
-            escort_id, username = user_data
-            
-            # Нельзя удалить самого себя
-            if target_user_id == user_id:
-                await message.answer(" Вы не можете удалить себя из сквада.", reply_markup=get_cancel_keyboard())
-                return
-            
-            # Удаляем пользователя из сквада
-            await conn.execute("UPDATE escorts SET squad_id = NULL WHERE id = ?", (escort_id,))
+            if leader_squad:
+                # Проверяем, является ли пользователь участником сквада
+                cursor = await conn.execute("SELECT id, username FROM escorts WHERE telegram_id = ? AND squad_id = ?", (target_user_id, leader_squad[0]))
+                user_data = await cursor.fetchone()
+        if not leader_squad:
+            await message.answer(" Вы не являетесь лидером сквада.", reply_markup=get_members_management_keyboard())
+            await state.clear()
+            return
+        
+        squad_id, squad_name = leader_squad
+        
+        if not user_data:
+            await message.answer(" Пользователь не состоит в вашем скваде.", reply_markup=get_cancel_keyboard())
+            return
+        
+        escort_id, username = user_data
+        
+        # Нельзя удалить самого себя
+        if target_user_id == user_id:
+            await message.answer(" Вы не можете удалить себя из сквада.", reply_markup=get_cancel_keyboard())
+            return
+        
+        # Удаляем пользователя из сквада
+        async with db_pool.acquire() as conn:
+            await conn.execute("UPDATE escorts SET squad_id = NULL WHERE id = ? AND squad_id = ?", (escort_id, squad_id))
             await conn.commit()
+        escort_cache.invalidate_ids([escort_id])
         
         await message.answer(f" Пользователь @{username or 'Unknown'} удален из сквада '{squad_name}'!", reply_markup=get_members_management_keyboard())
         await log_action("remove_member", user_id, None, f"Удален участник {target_user_id} из сквада {squad_name}")
@@ -3792,11 +5442,11 @@ async def list_members(message: types.Message):
     if not await check_access(message):
         return
     user_id = message.from_user.id
-    if not await is_leader(user_id):
+    if not is_leader(user_id):
         await message.answer(" У вас нет доступа к этой функции.", reply_markup=await get_menu_keyboard(user_id))
         return
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute(
                 '''
                 SELECT e.telegram_id, e.username, e.pubg_id, e.completed_orders, e.balance, s.name
@@ -3808,22 +5458,24 @@ async def list_members(message: types.Message):
             )
             leader_info = await cursor.fetchone()
             if not leader_info:
-                await message.answer(" Вы не являетесь лидером сквада.", reply_markup=get_members_management_keyboard())
-                return
-            
-            squad_name = leader_info[5]
-            
-            cursor = await conn.execute(
+                members = None
+            else:
+                cursor = await conn.execute(
                 '''
-                SELECT e.telegram_id, e.username, e.pubg_id, e.completed_orders, e.balance
-                FROM squad_leaders sl
-                JOIN escorts e2 ON sl.leader_id = e2.id
-                JOIN escorts e ON e.squad_id = sl.squad_id
-                WHERE e2.telegram_id = ?
-                ORDER BY e.username
-                ''', (user_id,)
-            )
-            members = await cursor.fetchall()
+                    SELECT e.telegram_id, e.username, e.pubg_id, e.completed_orders, e.balance
+                    FROM squad_leaders sl
+                    JOIN escorts e2 ON sl.leader_id = e2.id
+                    JOIN escorts e ON e.squad_id = sl.squad_id
+                    WHERE e2.telegram_id = ?
+                    ORDER BY e.username
+                    ''', (user_id,)
+                )
+                members = await cursor.fetchall()
+        if not leader_info:
+            await message.answer(" Вы не являетесь лидером сквада.", reply_markup=get_members_management_keyboard())
+            return
+        
+        squad_name = leader_info[5]
         
         if not members:
             await message.answer(f" В скваде '{squad_name}' пока нет участников.", reply_markup=get_members_management_keyboard())
@@ -3847,7 +5499,7 @@ async def rename_squad_handler(message: types.Message, state: FSMContext):
     if not await check_access(message):
         return
     user_id = message.from_user.id
-    if not await is_leader(user_id):
+    if not is_leader(user_id):
         await message.answer(" У вас нет доступа к этой функции.", reply_markup=await get_menu_keyboard(user_id))
         return
     try:
@@ -3871,7 +5523,7 @@ async def process_rename_squad(message: types.Message, state: FSMContext):
         return
     
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute(
                 '''
                 SELECT sl.squad_id, s.name
@@ -3882,15 +5534,17 @@ async def process_rename_squad(message: types.Message, state: FSMContext):
                 ''', (user_id,)
             )
             leader_squad = await cursor.fetchone()
-            if not leader_squad:
-                await message.answer(" Вы не являетесь лидером сквада.", reply_markup=get_squad_management_keyboard())
-                await state.clear()
-                return
-            
-            squad_id, old_name = leader_squad
-            
+        if not leader_squad:
+            await message.answer(" Вы не являетесь лидером сквада.", reply_markup=get_squad_management_keyboard())
+            await state.clear()
+            return
+        
+        squad_id, old_name = leader_squad
+        
+        async with db_pool.acquire() as conn:
             await conn.execute("UPDATE squads SET name = ? WHERE id = ?", (new_name, squad_id))
             await conn.commit()
+        leaderboard.rename_squad(squad_id, new_name)
         
         await message.answer(f" Сквад '{old_name}' переименован в '{new_name}'!", reply_markup=get_squad_management_keyboard())
         await log_action("rename_squad", user_id, None, f"Переименован сквад '{old_name}' в '{new_name}'")
@@ -3908,12 +5562,12 @@ async def set_criteria_handler(message: types.Message, state: FSMContext):
     if not await check_access(message):
         return
     user_id = message.from_user.id
-    if not await is_leader(user_id):
+    if not is_leader(user_id):
         await message.answer(" У вас нет доступа к этой функции.", reply_markup=await get_menu_keyboard(user_id))
         return
     try:
         # Получаем текущие критерии
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute(
                 '''
                 SELECT sc.criteria_text
@@ -3951,7 +5605,7 @@ async def process_set_criteria(message: types.Message, state: FSMContext):
         return
     
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             # Получаем squad_id лидера
             cursor = await conn.execute(
                 '''
@@ -3963,13 +5617,14 @@ async def process_set_criteria(message: types.Message, state: FSMContext):
                 ''', (user_id,)
             )
             leader_squad = await cursor.fetchone()
-            if not leader_squad:
-                await message.answer(" Вы не являетесь лидером сквада.", reply_markup=get_squad_management_keyboard())
-                await state.clear()
-                return
-            
-            squad_id, squad_name = leader_squad
-            
+        if not leader_squad:
+            await message.answer(" Вы не являетесь лидером сквада.", reply_markup=get_squad_management_keyboard())
+            await state.clear()
+            return
+        
+        squad_id, squad_name = leader_squad
+        
+        async with db_pool.acquire() as conn:
             # Сохраняем или обновляем критерии
             await conn.execute(
                 '''
@@ -3991,102 +5646,109 @@ async def process_set_criteria(message: types.Message, state: FSMContext):
         await message.answer(MESSAGES["error"], reply_markup=get_squad_management_keyboard())
         await state.clear()
 
+async def build_squad_orders_page(squad_id: int, squad_name: str, direction: str = PAGE_NEXT, key=None):
+    """Страница заказов сквада: (текст, inline-клавиатура навигации или None)"""
+    async def fetch(direction, key, limit):
+        async with db_pool.read() as conn:
+            cursor = await conn.execute(SQL_SQUAD_ORDERS[direction], (squad_id,) + key + (limit,))
+            return await cursor.fetchall()
+
+    orders, nav = await squad_orders_pager.page(fetch, direction, key)
+    if not orders:
+        return None, None
+    response = f" Последние заказы сквада '{squad_name}':\n\n"
+    for _, _, memo_order_id, customer_info, amount, status, completed_at in orders:
+        status_text = {
+            'pending': '⏳ Ожидает',
+            'in_progress': '🔄 В процессе', 
+            'completed': ' Завершен'
+        }.get(status, status)
+        
+        response += f"#{memo_order_id} - {customer_info}\n"
+        response += f" {amount:.2f} руб. | {status_text}\n"
+        if completed_at:
+            response += f" Завершен: {datetime.fromisoformat(completed_at).strftime('%d.%m %H:%M')}\n"
+        response += "\n"
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[nav]) if nav else None
+    return response, keyboard
+
 @dp.message(F.text == "список заказов")
 async def squad_orders_list(message: types.Message):
     if not await check_access(message):
         return
     user_id = message.from_user.id
-    if not await is_leader(user_id):
+    if not is_leader(user_id):
         await message.answer(" У вас нет доступа к этой функции.", reply_markup=await get_menu_keyboard(user_id))
         return
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
-            cursor = await conn.execute(
-                '''
-                SELECT sl.squad_id, s.name
-                FROM squad_leaders sl
-                JOIN squads s ON sl.squad_id = s.id
-                JOIN escorts e ON sl.leader_id = e.id
-                WHERE e.telegram_id = ?
-                ''', (user_id,)
-            )
+        async with db_pool.read() as conn:
+            cursor = await conn.execute(SQL_LEADER_SQUAD, (user_id,))
             leader_squad = await cursor.fetchone()
-            if not leader_squad:
-                await message.answer(" Вы не являетесь лидером сквада.", reply_markup=get_squad_management_keyboard())
-                return
-            
-            squad_id, squad_name = leader_squad
-            
-            cursor = await conn.execute(
-                '''
-                SELECT o.memo_order_id, o.customer_info, o.amount, o.status, o.created_at, o.completed_at
-                FROM orders o
-                WHERE o.squad_id = ?
-                ORDER BY o.created_at DESC
-                LIMIT 10
-                ''', (squad_id,)
-            )
-            orders = await cursor.fetchall()
+        if not leader_squad:
+            await message.answer(" Вы не являетесь лидером сквада.", reply_markup=get_squad_management_keyboard())
+            return
         
-        if not orders:
+        squad_id, squad_name = leader_squad
+        
+        response, keyboard = await build_squad_orders_page(squad_id, squad_name)
+        if not response:
             await message.answer(f" У сквада '{squad_name}' пока нет заказов.", reply_markup=get_squad_management_keyboard())
             return
         
-        response = f" Последние заказы сквада '{squad_name}':\n\n"
-        for memo_order_id, customer_info, amount, status, created_at, completed_at in orders:
-            status_text = {
-                'pending': '⏳ Ожидает',
-                'in_progress': '🔄 В процессе', 
-                'completed': ' Завершен'
-            }.get(status, status)
-            
-            response += f"#{memo_order_id} - {customer_info}\n"
-            response += f" {amount:.2f} руб. | {status_text}\n"
-            if completed_at:
-                response += f" Завершен: {datetime.fromisoformat(completed_at).strftime('%d.%m %H:%M')}\n"
-            response += "\n"
-        
-        await message.answer(response, reply_markup=get_squad_management_keyboard())
+        await message.answer(response, reply_markup=keyboard or get_squad_management_keyboard())
     except aiosqlite.Error as e:
         logger.error(f"Ошибка в squad_orders_list для {user_id}: {e}")
         await message.answer(MESSAGES["error"], reply_markup=get_squad_management_keyboard())
 
+@dp.callback_query(F.data.startswith(squad_orders_pager.prefix))
+async def squad_orders_page(callback: types.CallbackQuery):
+    user_id = callback.from_user.id
+    if not is_leader(user_id):
+        await callback.answer(" У вас нет доступа к этой функции.", show_alert=True)
+        return
+    try:
+        direction, key = squad_orders_pager.parse(callback.data)
+        async with db_pool.read() as conn:
+            cursor = await conn.execute(SQL_LEADER_SQUAD, (user_id,))
+            leader_squad = await cursor.fetchone()
+        if not leader_squad:
+            await callback.answer(" Вы не являетесь лидером сквада.", show_alert=True)
+            return
+        squad_id, squad_name = leader_squad
+        response, keyboard = await build_squad_orders_page(squad_id, squad_name, direction, key)
+        if not response:
+            # Список изменился - возвращаемся к первой странице
+            response, keyboard = await build_squad_orders_page(squad_id, squad_name)
+        await callback.message.edit_text(response or f" У сквада '{squad_name}' пока нет заказов.", reply_markup=keyboard)
+        await callback.answer()
+    except (ValueError, aiosqlite.Error) as e:
+        logger.error(f"Ошибка в squad_orders_page для {user_id}: {e}\n\n{traceback.format_exc()}")
+        await callback.answer(MESSAGES["error"], show_alert=True)
+    except TelegramAPIError as e:
+        logger.error(f"Ошибка Telegram API в squad_orders_page для {user_id}: {e}\n\n{traceback.format_exc()}")
+        await callback.answer()
+
 @dp.message(F.text == "статус сопровождений")
 async def escort_status_handler(message: types.Message):
     if not await check_access(message):
         return
     user_id = message.from_user.id
-    if not await is_leader(user_id):
+    if not is_leader(user_id):
         await message.answer(" У вас нет доступа к этой функции.", reply_markup=await get_menu_keyboard(user_id))
         return
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
-            cursor = await conn.execute(
-                '''
-                SELECT sl.squad_id, s.name
-                FROM squad_leaders sl
-                JOIN squads s ON sl.squad_id = s.id
-                JOIN escorts e ON sl.leader_id = e.id
-                WHERE e.telegram_id = ?
-                ''', (user_id,)
-            )
+        async with db_pool.read() as conn:
+            cursor = await conn.execute(SQL_LEADER_SQUAD, (user_id,))
             leader_squad = await cursor.fetchone()
-            if not leader_squad:
-                await message.answer(" Вы не являетесь лидером сквада.", reply_markup=get_squad_management_keyboard())
-                return
-            
-            squad_id, squad_name = leader_squad
-            
-            # Получаем все активные заказы команды (в процессе выполнения)
-            cursor = await conn.execute(
-                '''
-                SELECT o.id, o.memo_order_id, o.customer_info, o.amount, o.created_at
-                FROM orders o
-                WHERE o.squad_id = ? AND o.status = 'in_progress'
-                ORDER BY o.created_at ASC
-                ''', (squad_id,)
-            )
-            active_orders = await cursor.fetchall()
+            if leader_squad:
+                # Получаем все активные заказы команды (в процессе выполнения)
+                cursor = await conn.execute(SQL_SQUAD_ACTIVE_ORDERS, (leader_squad[0],))
+                active_orders = await cursor.fetchall()
+        if not leader_squad:
+            await message.answer(" Вы не являетесь лидером сквада.", reply_markup=get_squad_management_keyboard())
+            return
+        
+        squad_id, squad_name = leader_squad
         
         if not active_orders:
             await message.answer(f"📊 У команды '{squad_name}' сейчас нет активных сопровождений.", reply_markup=get_squad_management_keyboard())
@@ -4112,7 +5774,7 @@ async def escort_status_handler(message: types.Message):
                 start_time_text = "неизвестно"
             
             # Получаем участников заказа
-            async with aiosqlite.connect(DB_PATH) as conn:
+            async with db_pool.read() as conn:
                 cursor = await conn.execute(
                     '''
                     SELECT e.username, e.telegram_id, oe.pubg_id
@@ -4147,14 +5809,14 @@ async def user_contact_leader(message: types.Message):
         return
     user_id = message.from_user.id
     try:
-        escort = await get_escort(user_id)
-        if not escort or not escort[1]:  # squad_id
+        escort = await get_escort_fields(user_id, "squad_id")
+        if not escort or not escort.squad_id:
             await message.answer(" Вы не состоите в скваде.", reply_markup=await get_menu_keyboard(user_id))
             return
 
-        squad_id = escort[1]
+        squad_id = escort.squad_id
 
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute(
                 '''
                 SELECT e.telegram_id, e.username
@@ -4261,7 +5923,7 @@ async def process_squad_name(message: types.Message, state: FSMContext):
         return
     
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.acquire() as conn:
             await conn.execute("INSERT INTO squads (name) VALUES (?)", (squad_name,))
             await conn.commit()
         
@@ -4282,7 +5944,7 @@ async def list_squads(message: types.Message):
         await message.answer(MESSAGES["no_access"], reply_markup=await get_menu_keyboard(user_id))
         return
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute(
                 '''
                 SELECT s.name, COUNT(e.id) as member_count, 
@@ -4319,7 +5981,7 @@ async def delete_squad_handler(message: types.Message, state: FSMContext):
         await message.answer(MESSAGES["no_access"], reply_markup=await get_menu_keyboard(user_id))
         return
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute("SELECT name FROM squads ORDER BY name")
             squads = await cursor.fetchall()
         
@@ -4348,18 +6010,21 @@ async def process_delete_squad(message: types.Message, state: FSMContext):
     
     squad_name = message.text.strip()
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute("SELECT id FROM squads WHERE name = ?", (squad_name,))
             squad = await cursor.fetchone()
-            if not squad:
-                await message.answer(" Сквад не найден.", reply_markup=get_cancel_keyboard(True))
-                return
-            
-            squad_id = squad[0]
+        if not squad:
+            await message.answer(" Сквад не найден.", reply_markup=get_cancel_keyboard(True))
+            return
+        
+        squad_id = squad[0]
+        async with db_pool.acquire() as conn:
             await conn.execute("UPDATE escorts SET squad_id = NULL WHERE squad_id = ?", (squad_id,))
             await conn.execute("DELETE FROM squad_leaders WHERE squad_id = ?", (squad_id,))
             await conn.execute("DELETE FROM squads WHERE id = ?", (squad_id,))
             await conn.commit()
+        escort_cache.clear()
+        role_index.remove_squad(squad_id)
         
         await message.answer(MESSAGES["squad_deleted"].format(squad_name=squad_name), reply_markup=get_squads_submenu_keyboard())
         await log_action("delete_squad", user_id, None, f"Расформирован сквад '{squad_name}'")
@@ -4399,15 +6064,16 @@ async def process_escort_info(message: types.Message, state: FSMContext):
         telegram_id_str, username, pubg_id, squad_name = [part.strip() for part in parts]
         telegram_id = int(telegram_id_str)
         
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute("SELECT id FROM squads WHERE name = ?", (squad_name,))
             squad = await cursor.fetchone()
-            if not squad:
-                await message.answer(f" Сквад '{squad_name}' не найден.", reply_markup=get_cancel_keyboard(True))
-                return
-            
-            squad_id = squad[0]
-            
+        if not squad:
+            await message.answer(f" Сквад '{squad_name}' не найден.", reply_markup=get_cancel_keyboard(True))
+            return
+        
+        squad_id = squad[0]
+        
+        async with db_pool.acquire() as conn:
             await conn.execute(
                 '''
                 INSERT OR REPLACE INTO escorts (telegram_id, username, pubg_id, squad_id, rules_accepted)
@@ -4415,6 +6081,9 @@ async def process_escort_info(message: types.Message, state: FSMContext):
                 ''', (telegram_id, username, pubg_id, squad_id)
             )
             await conn.commit()
+        escort_cache.invalidate(telegram_id)
+        # REPLACE создает строку с новым id, старая запись squad_leaders больше не связана с ним
+        role_index.remove_leader(telegram_id)
         
         await message.answer(f"Сопровождающий @{username} добавлен в сквад '{squad_name}'!", reply_markup=get_escorts_submenu_keyboard())
         await log_action("add_escort", user_id, None, f"Добавлен сопровождающий @{username} в сквад '{squad_name}'")
@@ -4450,16 +6119,19 @@ async def process_remove_escort(message: types.Message, state: FSMContext):
     try:
         target_telegram_id = int(message.text.strip())
         
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute("SELECT username FROM escorts WHERE telegram_id = ?", (target_telegram_id,))
             escort = await cursor.fetchone()
-            if not escort:
-                await message.answer(" Сопровождающий не найден.", reply_markup=get_cancel_keyboard(True))
-                return
-            
-            username = escort[0]
+        if not escort:
+            await message.answer(" Сопровождающий не найден.", reply_markup=get_cancel_keyboard(True))
+            return
+        
+        username = escort[0]
+        async with db_pool.acquire() as conn:
             await conn.execute("DELETE FROM escorts WHERE telegram_id = ?", (target_telegram_id,))
             await conn.commit()
+        escort_cache.invalidate(target_telegram_id)
+        role_index.remove_leader(target_telegram_id)
         
         await message.answer(f" Сопровождающий @{username or 'Unknown'} удален!", reply_markup=get_escorts_submenu_keyboard())
         await log_action("remove_escort", user_id, None, f"Удален сопровождающий @{username or 'Unknown'}")
@@ -4478,7 +6150,7 @@ async def escorts_balances(message: types.Message):
         await message.answer(MESSAGES["no_access"], reply_markup=await get_menu_keyboard(user_id))
         return
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute(
                 "SELECT username, balance, telegram_id FROM escorts ORDER BY balance DESC"
             )
@@ -4527,25 +6199,31 @@ async def process_add_order(message: types.Message, state: FSMContext):
         order_id, customer_info, amount_str = [part.strip() for part in parts]
         amount = float(amount_str)
         
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.acquire() as conn:
             await conn.execute(
                 "INSERT INTO orders (memo_order_id, customer_info, amount) VALUES (?, ?, ?)",
                 (order_id, customer_info, amount)
             )
+            # Уведомления всем пользователям о новом заказе уходят вместе с заказом
+            batch = f"new_order:{order_id}:{message.message_id}"
+            queued = await notify_all_users_about_new_order(order_id, customer_info, amount, batch=batch)
             await conn.commit()
+            pending_board.invalidate()
         
+        await state.clear()
         await message.answer(
             MESSAGES["order_added"].format(
                 order_id=order_id, amount=amount, description=customer_info, customer=customer_info
-            ), 
+            ) + f"\n\nУведомления поставлены в очередь: {queued}. Итог рассылки придет отдельным сообщением.",
             reply_markup=get_admin_orders_submenu_keyboard()
         )
-        
-        # Отправляем уведомления всем пользователям о новом заказе
-        await notify_all_users_about_new_order(order_id, customer_info, amount)
+        if queued:
+            spawn_background(
+                track_outbox_batch(batch, user_id, f"Уведомления о заказе #{order_id} разосланы:"),
+                f"track:{batch}"
+            )
         
         await log_action("add_order", user_id, None, f"Добавлен заказ #{order_id} на сумму {amount} руб.")
-        await state.clear()
     except ValueError:
         await message.answer(" Неверный формат суммы.", reply_markup=get_cancel_keyboard(True))
     except aiosqlite.IntegrityError:
@@ -4578,18 +6256,20 @@ async def process_delete_order(message: types.Message, state: FSMContext):
     
     order_id = message.text.strip()
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute("SELECT id FROM orders WHERE memo_order_id = ?", (order_id,))
             order = await cursor.fetchone()
-            if not order:
-                await message.answer(" Заказ не найден.", reply_markup=get_cancel_keyboard(True))
-                return
-            
-            order_db_id = order[0]
+        if not order:
+            await message.answer(" Заказ не найден.", reply_markup=get_cancel_keyboard(True))
+            return
+        
+        order_db_id = order[0]
+        async with db_pool.acquire() as conn:
             await conn.execute("DELETE FROM order_escorts WHERE order_id = ?", (order_db_id,))
             await conn.execute("DELETE FROM order_applications WHERE order_id = ?", (order_db_id,))
             await conn.execute("DELETE FROM orders WHERE id = ?", (order_db_id,))
             await conn.commit()
+        pending_board.invalidate()
         
         await message.answer(f" Заказ #{order_id} удален!", reply_markup=get_admin_orders_submenu_keyboard())
         await log_action("delete_order", user_id, order_db_id, f"Удален заказ #{order_id}")
@@ -4625,8 +6305,8 @@ async def process_support_message(message: types.Message, state: FSMContext):
         return
     
     try:
-        escort = await get_escort(user_id)
-        username = escort[6] if escort else "Unknown"
+        escort = await get_escort_fields(user_id, "username")
+        username = escort.username if escort else "Unknown"
         
         admin_keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="ответить", callback_data=f"reply_support_{user_id}")]
@@ -4650,33 +6330,23 @@ async def user_rating(message: types.Message):
         return
     user_id = message.from_user.id
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
-            cursor = await conn.execute(
-                '''
-                SELECT username, total_rating, rating_count, completed_orders, telegram_id
-                FROM escorts 
-                WHERE rating_count > 0
-                ORDER BY (total_rating / rating_count) DESC
-                LIMIT 10
-                '''
-            )
-            top_users = await cursor.fetchall()
+        await leaderboard.refresh()
+        top_users = leaderboard.top_users()
         
         if not top_users:
             await message.answer("Пока нет пользователей с рейтингом.", reply_markup=await get_menu_keyboard(user_id))
             return
         
         response = "Топ-10 пользователей по рейтингу:\n\n"
-        for i, (username, total_rating, rating_count, completed_orders, telegram_id) in enumerate(top_users, 1):
-            avg_rating = total_rating / rating_count
-            is_current_user = telegram_id == user_id
+        for i, entry in enumerate(top_users, 1):
+            is_current_user = entry.telegram_id == user_id
             marker = " 👈 ВЫ" if is_current_user else ""
-            response += f"{i}. @{username or 'Unknown'} - ★ {avg_rating:.2f} ({rating_count} оценок, {completed_orders} заказов){marker}\n"
+            response += f"{i}. @{entry.username or 'Unknown'} - ★ {entry.rating:.2f} ({entry.rating_count} оценок, {entry.completed_orders} заказов){marker}\n"
         
         # Показываем позицию текущего пользователя, если он не в топ-10
-        user_position, user_rating_value = await get_user_rating_position(user_id)
-        if user_position and user_position > 10:
-            response += f"\n📍 Ваша позиция: {user_position} место (★ {user_rating_value:.2f})"
+        user_position, user_entry = leaderboard.user_position(user_id)
+        if user_position and user_position > LEADERBOARD_TOP:
+            response += f"\n📍 Ваша позиция: {user_position} место (★ {user_entry.rating:.2f})"
         
         await message.answer(response, reply_markup=await get_menu_keyboard(user_id))
     except aiosqlite.Error as e:
@@ -4689,22 +6359,8 @@ async def squad_rating(message: types.Message):
         return
     user_id = message.from_user.id
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
-            cursor = await conn.execute(
-                '''
-                SELECT s.name, AVG(e.total_rating / e.rating_count) as avg_rating,
-                       COUNT(e.id) as member_count,
-                       SUM(e.completed_orders) as total_orders
-                FROM squads s
-                JOIN escorts e ON s.id = e.squad_id
-                WHERE e.rating_count > 0
-                GROUP BY s.id
-                HAVING COUNT(e.id) > 0
-                ORDER BY avg_rating DESC
-                LIMIT 10
-                '''
-            )
-            top_squads = await cursor.fetchall()
+        await leaderboard.refresh()
+        top_squads = leaderboard.top_squads()
         
         if not top_squads:
             await message.answer("🏆 Пока нет сквадов с рейтингом.", reply_markup=await get_menu_keyboard(user_id))
@@ -4713,13 +6369,13 @@ async def squad_rating(message: types.Message):
         response = "🏆 Топ-10 сквадов по рейтингу:\n\n"
         user_squad_position, user_squad_name, user_squad_rating = await get_squad_rating_position(user_id)
         
-        for i, (squad_name, avg_rating, member_count, total_orders) in enumerate(top_squads, 1):
-            is_user_squad = squad_name == user_squad_name
+        for i, squad in enumerate(top_squads, 1):
+            is_user_squad = squad.name == user_squad_name
             marker = " 👈 ВАШ СКВАД" if is_user_squad else ""
-            response += f"{i}. {squad_name} - ★ {avg_rating:.2f} ({member_count} чел., {total_orders} заказов){marker}\n"
+            response += f"{i}. {squad.name} - ★ {squad.rating:.2f} ({len(squad.members)} чел., {squad.completed_orders} заказов){marker}\n"
         
         # Показываем позицию сквада пользователя, если он не в топ-10
-        if user_squad_position and user_squad_position > 10:
+        if user_squad_position and user_squad_position > LEADERBOARD_TOP:
             response += f"\n📍 Позиция вашего сквада '{user_squad_name}': {user_squad_position} место (★ {user_squad_rating:.2f})"
         
         await message.answer(response, reply_markup=await get_menu_keyboard(user_id))
@@ -4736,22 +6392,13 @@ async def find_squad(message: types.Message):
     user_id = message.from_user.id
     try:
         # Проверяем, не состоит ли пользователь уже в скваде
-        escort = await get_escort(user_id)
-        if escort and escort[1]:  # squad_id
+        escort = await get_escort_fields(user_id, "squad_id")
+        if escort and escort.squad_id:
             await message.answer(" Вы уже состоите в скваде!", reply_markup=await get_menu_keyboard(user_id))
             return
         
-        async with aiosqlite.connect(DB_PATH) as conn:
-            cursor = await conn.execute(
-                '''
-                SELECT s.id, s.name, COUNT(e.id) as member_count
-                FROM squads s
-                LEFT JOIN escorts e ON s.id = e.squad_id
-                GROUP BY s.id, s.name
-                HAVING COUNT(e.id) < 10
-                ORDER BY s.name
-                '''
-            )
+        async with db_pool.read() as conn:
+            cursor = await conn.execute(SQL_OPEN_SQUADS)
             squads = await cursor.fetchall()
         
         if not squads:
@@ -4776,23 +6423,23 @@ async def view_squad_criteria(callback: types.CallbackQuery):
     try:
         squad_id = int(callback.data.split("_")[-1])
         
-        async with aiosqlite.connect(DB_PATH) as conn:
-            cursor = await conn.execute("SELECT name FROM squads WHERE id = ?", (squad_id,))
+        async with db_pool.read() as conn:
+            # Название, критерии и количество участников команды
+            cursor = await conn.execute(
+                '''
+                SELECT s.name, c.criteria_text, (SELECT COUNT(*) FROM escorts WHERE squad_id = s.id)
+                FROM squads s
+                LEFT JOIN squad_criteria c ON c.squad_id = s.id
+                WHERE s.id = ?
+                ''', (squad_id,)
+            )
             squad_data = await cursor.fetchone()
-            if not squad_data:
-                await callback.answer(" Команда не найдена.")
-                return
-            
-            squad_name = squad_data[0]
-            
-            # Получаем критерии команды
-            cursor = await conn.execute("SELECT criteria_text FROM squad_criteria WHERE squad_id = ?", (squad_id,))
-            criteria_data = await cursor.fetchone()
-            criteria_text = criteria_data[0] if criteria_data else "Критерии для вступления в команду не установлены лидером."
-            
-            # Получаем количество участников
-            cursor = await conn.execute("SELECT COUNT(*) FROM escorts WHERE squad_id = ?", (squad_id,))
-            member_count = (await cursor.fetchone())[0]
+        if not squad_data:
+            await callback.answer(" Команда не найдена.")
+            return
+        
+        squad_name, criteria_text, member_count = squad_data
+        criteria_text = criteria_text or "Критерии для вступления в команду не установлены лидером."
         
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="подать заявку", callback_data=f"apply_squad_{squad_id}")],
@@ -4907,25 +6554,26 @@ async def process_application_age(message: types.Message, state: FSMContext):
         cd = data.get('cd')
         
         # Получаем информацию о пользователе
-        escort = await get_escort(user_id)
+        escort = await get_escort_fields(user_id, "username")
         if not escort:
             await message.answer("Ваш профиль не найден.", reply_markup=await get_menu_keyboard(user_id))
             await state.clear()
             return
         
-        username = escort[6] or "Unknown"
+        username = escort.username or "Unknown"
         
-        # Сохраняем анкету в базу данных
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute("SELECT name FROM squads WHERE id = ?", (target_squad_id,))
             squad_data = await cursor.fetchone()
-            if not squad_data:
-                await message.answer(" Команда не найдена.", reply_markup=await get_menu_keyboard(user_id))
-                await state.clear()
-                return
-            
-            squad_name = squad_data[0]
-            
+        if not squad_data:
+            await message.answer(" Команда не найдена.", reply_markup=await get_menu_keyboard(user_id))
+            await state.clear()
+            return
+        
+        squad_name = squad_data[0]
+        
+        # Сохраняем анкету в базу данных
+        async with db_pool.acquire() as conn:
             cursor = await conn.execute(
                 '''
                 INSERT OR REPLACE INTO squad_applications 
@@ -5015,80 +6663,79 @@ async def accept_application(callback: types.CallbackQuery):
     try:
         application_id = int(callback.data.split("_")[-1])
         
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             # Получаем данные заявки
             cursor = await conn.execute(
                 '''
-                SELECT sa.user_id, sa.squad_id, e.telegram_id, e.username, s.name, sa.status
+                SELECT sa.user_id, sa.squad_id, e.telegram_id, e.username, s.name, sa.status, e.squad_id,
+                       (SELECT COUNT(*) FROM escorts WHERE squad_id = sa.squad_id),
+                       EXISTS (
+                           SELECT 1 FROM squad_leaders sl
+                           JOIN escorts l ON sl.leader_id = l.id
+                           WHERE l.telegram_id = ? AND sl.squad_id = sa.squad_id
+                       )
                 FROM squad_applications sa
                 JOIN escorts e ON sa.user_id = e.id
                 JOIN squads s ON sa.squad_id = s.id
                 WHERE sa.id = ?
-                ''', (application_id,)
+                ''', (user_id, application_id)
             )
             app_data = await cursor.fetchone()
             
-            if not app_data:
-                await callback.message.edit_text(" Заявка не найдена.")
-                await callback.answer()
-                return
-                
-            user_escort_id, squad_id, applicant_telegram_id, applicant_username, squad_name, status = app_data
-            
-            if status != 'pending':
-                await callback.message.edit_text(f" Заявка уже обработана (статус: {status}).")
-                await callback.answer()
-                return
-            
-            
-            
-            # Проверяем, что пользователь действительно лидер этого сквада
-            cursor = await conn.execute(
-                '''
-                SELECT COUNT(*) FROM squad_leaders sl
-                JOIN escorts e ON sl.leader_id = e.id
-                WHERE e.telegram_id = ? AND sl.squad_id = ?
-                ''', (user_id, squad_id)
-            )
-            is_squad_leader = (await cursor.fetchone())[0] > 0
-            
-            if not is_squad_leader and not is_admin(user_id):
-                await callback.message.edit_text(" У вас нет прав для принятия заявок в этот сквад.")
-                await callback.answer()
-                return
+        if not app_data:
+            await callback.message.edit_text(" Заявка не найдена.")
+            await callback.answer()
+            return
             
-            # Проверяем, что команда не переполнена
+        user_escort_id, squad_id, applicant_telegram_id, applicant_username, squad_name, status, current_squad, current_members, is_squad_leader = app_data
+        
+        if status != 'pending':
+            await callback.message.edit_text(f" Заявка уже обработана (статус: {status}).")
+            await callback.answer()
+            return
+        
+        # Проверяем, что пользователь действительно лидер этого сквада
+        if not is_squad_leader and not is_admin(user_id):
+            await callback.message.edit_text(" У вас нет прав для принятия заявок в этот сквад.")
+            await callback.answer()
+            return
+        
+        # Проверяем, что команда не переполнена
+        if current_members >= 10:
+            await callback.message.edit_text(" Команда уже заполнена (максимум 10 участников).")
+            await callback.answer()
+            return
+        
+        # Проверяем, что пользователь еще не в другом скваде
+        if current_squad:
+            await callback.message.edit_text(" Пользователь уже состоит в другом скваде.")
+            await callback.answer()
+            return
+        
+        async with db_pool.acquire() as conn:
+            # Принимаем заявку; статус, состав и заполненность перепроверяются в самих UPDATE
             cursor = await conn.execute(
-                "SELECT COUNT(*) FROM escorts WHERE squad_id = ?", (squad_id,)
-            )
-            current_members = (await cursor.fetchone())[0]
-            
-            if current_members >= 10:
-                await callback.message.edit_text(" Команда уже заполнена (максимум 10 участников).")
-                await callback.answer()
-                return
-            
-            # Проверяем, что пользователь еще не в другом сквадрэ
-            cursor = await conn.execute("SELECT squad_id FROM escorts WHERE id = ?", (user_escort_id,))
-            current_squad = await cursor.fetchone()
-            if current_squad and current_squad[0]:
-                await callback.message.edit_text(" Пользователь уже состоит в другом скваде.")
-                await callback.answer()
-                return
-            
-            # Принимаем заявку
-            await conn.execute(
-                "UPDATE squad_applications SET status = 'accepted' WHERE id = ?",
+                "UPDATE squad_applications SET status = 'accepted' WHERE id = ? AND status = 'pending'",
                 (application_id,)
             )
-            
-            # Добавляем пользователя в команду
-            await conn.execute(
-                "UPDATE escorts SET squad_id = ? WHERE id = ?",
-                (squad_id, user_escort_id)
-            )
-            
-            await conn.commit()
+            accepted = cursor.rowcount > 0
+            if accepted:
+                # Добавляем пользователя в команду
+                cursor = await conn.execute(
+                    '''
+                    UPDATE escorts SET squad_id = ?
+                    WHERE id = ? AND COALESCE(squad_id, 0) = 0
+                    AND (SELECT COUNT(*) FROM escorts WHERE squad_id = ?) < 10
+                    ''', (squad_id, user_escort_id, squad_id)
+                )
+                accepted = cursor.rowcount > 0
+            if accepted:
+                await conn.commit()
+        if not accepted:
+            await callback.message.edit_text(" Заявка уже обработана, команда заполнена или пользователь уже в скваде.")
+            await callback.answer()
+            return
+        escort_cache.invalidate_ids([user_escort_id])
         
         # Уведомляем пользователя
         try:
@@ -5117,7 +6764,7 @@ async def reject_application(callback: types.CallbackQuery):
     try:
         application_id = int(callback.data.split("_")[-1])
         
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             # Получаем данные заявки
             cursor = await conn.execute(
                 '''
@@ -5130,24 +6777,27 @@ async def reject_application(callback: types.CallbackQuery):
             )
             app_data = await cursor.fetchone()
             
-            if not app_data:
-                await callback.message.edit_text(" Заявка не найдена.")
-                await callback.answer()
-                return
-                
-            applicant_telegram_id, applicant_username, squad_name, status = app_data
-            
-            if status != 'pending':
-                await callback.message.edit_text(f" Заявка уже обработана (статус: {status}).")
-                await callback.answer()
-                return
+        if not app_data:
+            await callback.message.edit_text(" Заявка не найдена.")
+            await callback.answer()
+            return
             
-            # Отклоняем заявку
-            await conn.execute(
-                "UPDATE squad_applications SET status = 'rejected' WHERE id = ?",
-                (application_id,)
-            )
-            await conn.commit()
+        applicant_telegram_id, applicant_username, squad_name, status = app_data
+        
+        if status == 'pending':
+            # Отклоняем заявку; статус перепроверяется в самом UPDATE
+            async with db_pool.acquire() as conn:
+                cursor = await conn.execute(
+                    "UPDATE squad_applications SET status = 'rejected' WHERE id = ? AND status = 'pending'",
+                    (application_id,)
+                )
+                if cursor.rowcount == 0:
+                    status = 'processed'
+                await conn.commit()
+        if status != 'pending':
+            await callback.message.edit_text(f" Заявка уже обработана (статус: {status}).")
+            await callback.answer()
+            return
         
         # Уведомляем пользователя
         try:
@@ -5195,16 +6845,18 @@ async def process_ban_permanent(message: types.Message, state: FSMContext):
     try:
         target_user_id = int(message.text.strip())
         
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute("SELECT username FROM escorts WHERE telegram_id = ?", (target_user_id,))
             user_data = await cursor.fetchone()
-            if not user_data:
-                await message.answer(" Пользователь не найден.", reply_markup=get_cancel_keyboard(True))
-                return
-            
-            username = user_data[0]
+        if not user_data:
+            await message.answer(" Пользователь не найден.", reply_markup=get_cancel_keyboard(True))
+            return
+        
+        username = user_data[0]
+        async with db_pool.acquire() as conn:
             await conn.execute("UPDATE escorts SET is_banned = 1 WHERE telegram_id = ?", (target_user_id,))
             await conn.commit()
+        escort_cache.invalidate(target_user_id)
         
         await message.answer(f" Пользователь @{username or 'Unknown'} (ID: {target_user_id}) заблокирован навсегда!", reply_markup=get_bans_submenu_keyboard())
         await log_action("ban_permanent", user_id, None, f"Постоянный бан пользователя {target_user_id}")
@@ -5247,16 +6899,18 @@ async def process_ban_duration(message: types.Message, state: FSMContext):
         hours = int(parts[1])
         ban_until = datetime.now() + timedelta(hours=hours)
         
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute("SELECT username FROM escorts WHERE telegram_id = ?", (target_user_id,))
             user_data = await cursor.fetchone()
-            if not user_data:
-                await message.answer(" Пользователь не найден.", reply_markup=get_cancel_keyboard(True))
-                return
-            
-            username = user_data[0]
+        if not user_data:
+            await message.answer(" Пользователь не найден.", reply_markup=get_cancel_keyboard(True))
+            return
+        
+        username = user_data[0]
+        async with db_pool.acquire() as conn:
             await conn.execute("UPDATE escorts SET ban_until = ? WHERE telegram_id = ?", (ban_until.isoformat(), target_user_id))
             await conn.commit()
+        escort_cache.invalidate(target_user_id)
         
         await message.answer(f"⏰ Пользователь @{username or 'Unknown'} (ID: {target_user_id}) заблокирован до {ban_until.strftime('%d.%m.%Y %H:%M')}!", reply_markup=get_bans_submenu_keyboard())
         await log_action("ban_duration", user_id, None, f"Временный бан пользователя {target_user_id} на {hours} часов")
@@ -5292,16 +6946,18 @@ async def process_unban_user(message: types.Message, state: FSMContext):
     try:
         target_user_id = int(message.text.strip())
         
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute("SELECT username FROM escorts WHERE telegram_id = ?", (target_user_id,))
             user_data = await cursor.fetchone()
-            if not user_data:
-                await message.answer(" Пользователь не найден.", reply_markup=get_cancel_keyboard(True))
-                return
-            
-            username = user_data[0]
+        if not user_data:
+            await message.answer(" Пользователь не найден.", reply_markup=get_cancel_keyboard(True))
+            return
+        
+        username = user_data[0]
+        async with db_pool.acquire() as conn:
             await conn.execute("UPDATE escorts SET is_banned = 0, ban_until = NULL WHERE telegram_id = ?", (target_user_id,))
             await conn.commit()
+        escort_cache.invalidate(target_user_id)
         
         await message.answer(MESSAGES["user_unbanned"].format(username=username or "Unknown"), reply_markup=get_bans_submenu_keyboard())
         await log_action("unban_user", user_id, None, f"Разбан пользователя {target_user_id}")
@@ -5337,16 +6993,18 @@ async def process_unrestrict_user(message: types.Message, state: FSMContext):
     try:
         target_user_id = int(message.text.strip())
         
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute("SELECT username FROM escorts WHERE telegram_id = ?", (target_user_id,))
             user_data = await cursor.fetchone()
-            if not user_data:
-                await message.answer(" Пользователь не найден.", reply_markup=get_cancel_keyboard(True))
-                return
-            
-            username = user_data[0]
+        if not user_data:
+            await message.answer(" Пользователь не найден.", reply_markup=get_cancel_keyboard(True))
+            return
+        
+        username = user_data[0]
+        async with db_pool.acquire() as conn:
             await conn.execute("UPDATE escorts SET restrict_until = NULL WHERE telegram_id = ?", (target_user_id,))
             await conn.commit()
+        escort_cache.invalidate(target_user_id)
         
         await message.answer(MESSAGES["user_unrestricted"].format(username=username or "Unknown"), reply_markup=get_bans_submenu_keyboard())
         await log_action("unrestrict_user", user_id, None, f"Снято ограничение с пользователя {target_user_id}")
@@ -5389,16 +7047,18 @@ async def process_restrict_duration(message: types.Message, state: FSMContext):
         hours = int(parts[1])
         restrict_until = datetime.now() + timedelta(hours=hours)
         
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute("SELECT username FROM escorts WHERE telegram_id = ?", (target_user_id,))
             user_data = await cursor.fetchone()
-            if not user_data:
-                await message.answer(" Пользователь не найден.", reply_markup=get_cancel_keyboard(True))
-                return
-            
-            username = user_data[0]
+        if not user_data:
+            await message.answer(" Пользователь не найден.", reply_markup=get_cancel_keyboard(True))
+            return
+        
+        username = user_data[0]
+        async with db_pool.acquire() as conn:
             await conn.execute("UPDATE escorts SET restrict_until = ? WHERE telegram_id = ?", (restrict_until.isoformat(), target_user_id))
             await conn.commit()
+        escort_cache.invalidate(target_user_id)
         
         await message.answer(f"⛔ Пользователь @{username or 'Unknown'} (ID: {target_user_id}) ограничен до {restrict_until.strftime('%d.%m.%Y %H:%M')}!", reply_markup=get_bans_submenu_keyboard())
         await log_action("restrict_user", user_id, None, f"Ограничение пользователя {target_user_id} на {hours} часов")
@@ -5440,15 +7100,17 @@ async def process_balance_amount(message: types.Message, state: FSMContext):
         target_user_id = int(parts[0])
         amount = float(parts[1])
         
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute("SELECT username FROM escorts WHERE telegram_id = ?", (target_user_id,))
             user_data = await cursor.fetchone()
-            if not user_data:
-                await message.answer(" Пользователь не найден.", reply_markup=get_cancel_keyboard(True))
-                return
-            
+        if not user_data:
+            await message.answer(" Пользователь не найден.", reply_markup=get_cancel_keyboard(True))
+            return
+        
+        async with db_pool.acquire() as conn:
             await conn.execute("UPDATE escorts SET balance = balance + ? WHERE telegram_id = ?", (amount, target_user_id))
             await conn.commit()
+        escort_cache.invalidate(target_user_id)
         
         await message.answer(MESSAGES["balance_added"].format(amount=amount, user_id=target_user_id), reply_markup=get_balances_submenu_keyboard())
         await log_action("add_balance", user_id, None, f"Начислено {amount} руб. пользователю {target_user_id}")
@@ -5484,15 +7146,17 @@ async def process_zero_balance(message: types.Message, state: FSMContext):
     try:
         target_user_id = int(message.text.strip())
         
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute("SELECT username FROM escorts WHERE telegram_id = ?", (target_user_id,))
             user_data = await cursor.fetchone()
-            if not user_data:
-                await message.answer(" Пользователь не найден.", reply_markup=get_cancel_keyboard(True))
-                return
-            
+        if not user_data:
+            await message.answer(" Пользователь не найден.", reply_markup=get_cancel_keyboard(True))
+            return
+        
+        async with db_pool.acquire() as conn:
             await conn.execute("UPDATE escorts SET balance = 0 WHERE telegram_id = ?", (target_user_id,))
             await conn.commit()
+        escort_cache.invalidate(target_user_id)
         
         await message.answer(MESSAGES["balance_zeroed"].format(user_id=target_user_id), reply_markup=get_balances_submenu_keyboard())
         await log_action("zero_balance", user_id, None, f"Обнулен баланс пользователя {target_user_id}")
@@ -5511,7 +7175,7 @@ async def all_balances(message: types.Message):
         await message.answer(MESSAGES["no_access"], reply_markup=await get_menu_keyboard(user_id))
         return
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute(
                 "SELECT username, balance, telegram_id FROM escorts WHERE balance > 0 ORDER BY balance DESC"
             )
@@ -5557,7 +7221,7 @@ async def process_user_info_id(message: types.Message, state: FSMContext):
     try:
         target_user_id = int(message.text.strip())
         
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             # Получаем основную информацию о пользователе
             cursor = await conn.execute(
                 "SELECT id, username, pubg_id FROM escorts WHERE telegram_id = ?", 
@@ -5565,24 +7229,25 @@ async def process_user_info_id(message: types.Message, state: FSMContext):
             )
             user_data = await cursor.fetchone()
             
-            if not user_data:
-                await message.answer(" Пользователь не найден.", reply_markup=get_users_submenu_keyboard())
-                await state.clear()
-                return
-            
-            escort_id, username, pubg_id = user_data
-            
-            # Получаем информацию из анкеты (последняя заявка)
-            cursor = await conn.execute(
-                '''
-                SELECT city, pubg_id as app_pubg_id, cd, age
-                FROM squad_applications
-                WHERE user_id = ?
-                ORDER BY created_at DESC
-                LIMIT 1
-                ''', (escort_id,)
-            )
-            application_data = await cursor.fetchone()
+            if user_data:
+                # Получаем информацию из анкеты (последняя заявка)
+                cursor = await conn.execute(
+                    '''
+                    SELECT city, pubg_id as app_pubg_id, cd, age
+                    FROM squad_applications
+                    WHERE user_id = ?
+                    ORDER BY created_at DESC
+                    LIMIT 1
+                    ''', (user_data[0],)
+                )
+                application_data = await cursor.fetchone()
+        
+        if not user_data:
+            await message.answer(" Пользователь не найден.", reply_markup=get_users_submenu_keyboard())
+            await state.clear()
+            return
+        
+        _, username, pubg_id = user_data
         
         if application_data:
             city, app_pubg_id, cd, age = application_data
@@ -5617,30 +7282,29 @@ async def leave_order(callback: types.CallbackQuery):
     try:
         order_db_id = int(callback.data.split("_")[-1])
         
-        escort = await get_escort(user_id)
+        escort = await get_escort_fields(user_id, "id")
         if not escort:
             await callback.message.answer("Ваш профиль не найден.", reply_markup=await get_menu_keyboard(user_id))
             await callback.answer()
             return
         
-        escort_id = escort[0]
+        escort_id = escort.id
         
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             # Получаем информацию о заказе до удаления
             cursor = await conn.execute("SELECT memo_order_id FROM orders WHERE id = ?", (order_db_id,))
             order = await cursor.fetchone()
-            if not order:
-                await callback.answer(" Заказ не найден.")
-                return
-            
-            memo_order_id = order[0]
-            
-            # Удаляем пользователя из заявок
-            await conn.execute(
-                "DELETE FROM order_applications WHERE order_id = ? AND escort_id = ?",
-                (order_db_id, escort_id)
-            )
-            await conn.commit()
+        if not order:
+            await callback.answer(" Заказ не найден.")
+            return
+        
+        memo_order_id = order[0]
+        
+        # Удаляем пользователя из заявок, пока заказ не начат
+        if not await order_leave(order_db_id, escort_id):
+            await callback.answer(" Вы не в наборе этого заказа или он уже начат.")
+            return
+        pending_board.invalidate()
         
         # Обновляем меню участников
         await show_order_participants_menu(callback.message, order_db_id, memo_order_id)
@@ -5659,12 +7323,12 @@ async def refresh_order_menu(callback: types.CallbackQuery):
         order_db_id = int(callback.data.split("_")[-1])
         
         # Получаем информацию о заказе
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db_pool.read() as conn:
             cursor = await conn.execute("SELECT memo_order_id FROM orders WHERE id = ?", (order_db_id,))
             order = await cursor.fetchone()
-            if not order:
-                await callback.answer(" Заказ не найден.")
-                return
+        if not order:
+            await callback.answer(" Заказ не найден.")
+            return
         
         memo_order_id = order[0]
         await show_order_participants_menu(callback.message, order_db_id, memo_order_id)
@@ -5697,16 +7361,252 @@ async def unknown_command(message: types.Message):
         logger.error(f"Ошибка в unknown_command для {user_id}: {e}")
 
 # --- Запуск бота ---
+# --- Webhook ---
+# BOT_MODE=webhook поднимает HTTP-сервер вместо long polling. WEBHOOK_URL - публичный
+# адрес (https://host), по нему бот регистрирует webhook в Telegram; без него сервер
+# только принимает обновления - так его можно проверить локально командой replay.
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "64"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30"))  # секунд на дообработку при остановке
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+class WebhookServer:
+    """Прием обновлений по HTTP.
+
+    Обработчик только сверяет секрет, кладет обновление во внутреннюю очередь
+    и сразу отвечает 200. Из очереди обновления по порядку запускаются задачами
+    (не больше concurrency одновременно), порядок для одного пользователя
+    держат полосы. При переполненной очереди отвечаем 503 - Telegram повторит
+    доставку позже. Подтвержденные обновления Telegram уже не пришлет, поэтому
+    при остановке очередь дообрабатывается (не дольше drain_timeout).
+    """
+
+    def __init__(self, path: str = WEBHOOK_PATH, secret: str = WEBHOOK_SECRET, concurrency: int = WEBHOOK_CONCURRENCY,
+                 queue_size: int = WEBHOOK_QUEUE_SIZE, drain_timeout: float = WEBHOOK_DRAIN_TIMEOUT):
+        self.path = path
+        self.secret = secret
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.drain_timeout = drain_timeout
+        self.received = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.processed = 0
+        self.errors = 0
+        self._queue = None
+        self._slots = None
+        self._task = None
+        self._waiting = None  # обновление, взятое из очереди и ждущее свободного слота
+        self._inflight = {}  # задача -> update_id
+        self._runner = None
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        token = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token.encode(), self.secret.encode()):
+            self.rejected += 1
+            return web.Response(status=401)
+        try:
+            data = await request.json()
+        except ValueError:
+            self.rejected += 1
+            return web.Response(status=400)
+        if not isinstance(data, dict):
+            self.rejected += 1
+            return web.Response(status=400)
+        try:
+            self._queue.put_nowait(data)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning(f"Очередь webhook переполнена, обновление {data.get('update_id')} отклонено")
+            return web.Response(status=503)
+        self.received += 1
+        return web.Response(status=200)
+
+    async def _dispatch(self):
+        while True:
+            data = await self._queue.get()
+            self._waiting = data
+            await self._slots.acquire()
+            self._waiting = None
+            task = asyncio.create_task(self._process(data))
+            self._inflight[task] = data.get("update_id")
+            task.add_done_callback(lambda done: self._inflight.pop(done, None))
+
+    async def _process(self, data):
+        try:
+            update = types.Update.model_validate(data, context={"bot": bot})
+            await dp.feed_update(bot, update)
+            self.processed += 1
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Ошибка обработки обновления {data.get('update_id')}: {e}\n\n{traceback.format_exc()}")
+        finally:
+            self._slots.release()
+            self._queue.task_done()
+
+    async def start(self, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT):
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._task = asyncio.create_task(self._dispatch(), name="webhook:dispatch")
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"Webhook слушает {host}:{port}{self.path}, одновременно до {self.concurrency} обновлений")
+
+    async def stop(self):
+        # Сначала перестаем принимать новые обновления
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        # Уже подтвержденные дообрабатываем: task_done вызывается по завершении обработки
+        if self._queue is not None and self._task is not None:
+            try:
+                await asyncio.wait_for(self._queue.join(), self.drain_timeout)
+            except asyncio.TimeoutError:
+                pass
+        # Что не успело за drain_timeout, отменяем и сообщаем, какие обновления потеряны
+        lost = list(self._inflight.values())
+        if self._waiting is not None:
+            lost.append(self._waiting.get("update_id"))
+        while self._queue is not None and not self._queue.empty():
+            lost.append(self._queue.get_nowait().get("update_id"))
+        tasks = [self._task] if self._task is not None else []
+        tasks += list(self._inflight)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._waiting = None
+        if lost:
+            self.dropped += len(lost)
+            logger.error(f"Webhook остановлен с необработанными обновлениями ({len(lost)}): {lost}")
+        logger.info(f"Webhook остановлен: {self.stats()}")
+
+    def stats(self) -> str:
+        depth = self._queue.qsize() if self._queue is not None else 0
+        return (f"webhook: принято {self.received}, обработано {self.processed}, ошибок {self.errors}, "
+                f"отклонено {self.rejected}, сброшено {self.dropped}, в очереди {depth}, в работе {len(self._inflight)}")
+
+webhook_server = WebhookServer()
+
+async def run_webhook():
+    """Работа в режиме webhook до остановки процесса"""
+    if not webhook_server.secret:
+        webhook_server.secret = secrets.token_urlsafe(32)
+        logger.warning("WEBHOOK_SECRET не задан, используется случайный секрет до перезапуска")
+    await webhook_server.start()
+    try:
+        if WEBHOOK_URL:
+            await bot.set_webhook(
+                WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                secret_token=webhook_server.secret,
+                allowed_updates=dp.resolve_used_update_types(),
+                drop_pending_updates=True
+            )
+            logger.info(f"Webhook зарегистрирован: {WEBHOOK_URL}")
+        else:
+            logger.info("WEBHOOK_URL не задан, webhook в Telegram не регистрируется")
+        await dp.emit_startup(bot=bot)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await dp.emit_shutdown(bot=bot)
+    finally:
+        await webhook_server.stop()
+
 async def main():
     try:
         await init_db()
+        await db_pool.open()
+        await write_queue.start()
+        await outbox.start()
+        await role_index.load()
+        await leaderboard.refresh()
         scheduler.add_job(check_pending_orders, 'interval', hours=12)
+        scheduler.add_job(outbox.purge, 'interval', hours=24)
         scheduler.start()
-        logger.info("Бот запущен")
-        await dp.start_polling(bot, skip_updates=True)
+        logger.info(f"Бот запущен, режим: {BOT_MODE}")
+        if BOT_MODE == "webhook":
+            await run_webhook()
+        else:
+            # chat_member приходит только если запросить его явно
+            await bot.delete_webhook()
+            await dp.start_polling(bot, skip_updates=True, allowed_updates=dp.resolve_used_update_types())
     except Exception as e:
         logger.error(f"Ошибка при запуске бота: {e}\n{traceback.format_exc()}")
         raise
+    finally:
+        logger.info(f"Кэш {escort_cache.stats()}")
+        logger.info(f"Апдейты: {update_lanes.stats()}")
+        if background_tasks:
+            logger.info(f"Остановка фоновых задач: {len(background_tasks)}")
+            for task in list(background_tasks):
+                task.cancel()
+            await asyncio.gather(*background_tasks, return_exceptions=True)
+        await outbox.stop()
+        await write_queue.stop()
+        await db_pool.close()
+
+async def run_index_advisor():
+    """CLI: python main.py explain - планы горячих запросов на текущей базе"""
+    async with aiosqlite.connect(DB_PATH) as conn:
+        report = await explain_queries(conn)
+    print(format_index_report(report))
+    return 1 if any(full_scans for _, _, full_scans in report) else 0
+
+async def run_replay(args):
+    """CLI: python main.py replay updates.jsonl - отправляет записанные обновления на локальный webhook"""
+    parser = argparse.ArgumentParser(prog="main.py replay")
+    parser.add_argument("path", help="файл с обновлениями: JSON-массив или по одному JSON на строку")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    parser.add_argument("--secret", default=WEBHOOK_SECRET)
+    parser.add_argument("--concurrency", type=int, default=10)
+    options = parser.parse_args(args)
+
+    with open(options.path, encoding="utf-8") as f:
+        content = f.read().strip()
+    if content.startswith("["):
+        updates = json.loads(content)
+    else:
+        updates = [json.loads(line) for line in content.splitlines() if line.strip()]
+
+    statuses = {}
+    latencies = []
+    semaphore = asyncio.Semaphore(options.concurrency)
+
+    async def post(session, update):
+        async with semaphore:
+            started = time.perf_counter()
+            async with session.post(options.url, json=update, headers={SECRET_HEADER: options.secret}) as response:
+                await response.read()
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    async with ClientSession() as session:
+        await asyncio.gather(*(post(session, update) for update in updates))
+    elapsed = time.perf_counter() - started
+
+    print(f"Отправлено обновлений: {len(updates)} за {elapsed:.2f} с")
+    print(f"Ответы: {', '.join(f'{status}: {count}' for status, count in sorted(statuses.items()))}")
+    if latencies:
+        print(f"Время ответа: медиана {statistics.median(latencies):.1f} мс, максимум {max(latencies):.1f} мс")
+    return 0 if set(statuses) == {200} else 1
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "explain":
+        sys.exit(asyncio.run(run_index_advisor()))
+    if len(sys.argv) > 1 and sys.argv[1] == "replay":
+        sys.exit(asyncio.run(run_replay(sys.argv[2:])))
     asyncio.run(main())
\ No newline at end of file
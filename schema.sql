@@ -1,3 +1,5 @@
+-- Базовая схема (миграция 1 в main.py). Дальнейшие изменения схемы добавляются
+-- новыми шагами MIGRATIONS в main.py, этот файл не меняется.
 
 -- Сквады
 CREATE TABLE IF NOT EXISTS squads (